@@ -0,0 +1,240 @@
+"""
+Локальный дисковый кэш аудио с LRU-вытеснением по объёму
+"""
+import asyncio
+import hashlib
+import os
+import logging
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AudioCache:
+    """
+    Кэш скачанных треков на диске.
+
+    Ключ строится из источника, идентификатора трека и формата, имя файла -
+    хэш ключа. Индекс хранится в памяти и восстанавливается сканированием
+    каталога при запуске, порядок LRU - по времени последнего доступа.
+
+    Воркеры supervisor.py пишут в один каталог, и чужие файлы видны только
+    на диске. Поэтому в общем каталоге промах по индексу проверяется по
+    диску, а индекс пересобирается не реже раза в RESCAN_SECONDS и перед
+    вытеснением: бюджет соблюдается для каталога в целом, а не для каждого
+    процесса.
+    """
+
+    SUFFIX = '.audio'
+
+    # Временные файлы старше этого (сек) - остатки упавшей записи, а не запись другого воркера
+    STALE_TMP_SECONDS = 600
+
+    # Как часто общий каталог пересканируется ради чужих записей (сек)
+    RESCAN_SECONDS = 60
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        max_bytes: Optional[int] = None,
+        shared: Optional[bool] = None
+    ):
+        self.directory = directory or os.getenv(
+            'AUDIO_CACHE_DIR',
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'audio_cache')
+        )
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv('AUDIO_CACHE_MAX_MB', 1024)) * 1024 * 1024
+        # Под supervisor.py каталог делят все воркеры
+        self.shared = shared if shared is not None else 'BOT_WORKER_INDEX' in os.environ
+
+        self._index: 'OrderedDict[str, int]' = OrderedDict()
+        self._total_bytes = 0
+        self._rescanned_at = 0.0
+        self._lock = threading.Lock()
+
+        # Метрики
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._rebuild_index()
+
+    @staticmethod
+    def make_key(source: str, track_id: str, fmt: str) -> str:
+        """Ключ кэша: хэш от источника, идентификатора и формата"""
+        raw = f"{source}:{track_id}:{fmt}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self._index),
+            'bytes': self._total_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hit_rate(),
+        }
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def _rebuild_index(self):
+        """Восстанавливает индекс по содержимому каталога"""
+        if not self.enabled:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._rescan()
+        logger.info(f"Аудио кэш: {len(self._index)} файлов, {self._total_bytes / 1024 / 1024:.1f} МБ")
+        self._evict()
+
+    def _rescan(self):
+        """Заменяет индекс содержимым каталога в порядке времени доступа"""
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            # Недописанные временные файлы остаются после падения процесса
+            if name.startswith('.tmp'):
+                if not self.shared or now - stat.st_mtime > self.STALE_TMP_SECONDS:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                continue
+            if not name.endswith(self.SUFFIX):
+                continue
+            entries.append((stat.st_atime, name[:-len(self.SUFFIX)], stat.st_size))
+
+        entries.sort()
+        index = OrderedDict((key, size) for _, key, size in entries)
+        with self._lock:
+            self._index = index
+            self._total_bytes = sum(index.values())
+            self._rescanned_at = time.monotonic()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Читает файл из кэша (синхронно)"""
+        if not self.enabled:
+            return None
+
+        path = self._path(key)
+        with self._lock:
+            known = key in self._index
+            if known:
+                self._index.move_to_end(key)
+            elif not self.shared:
+                self.misses += 1
+                return None
+
+        if not known:
+            # Файл мог записать другой воркер - берём его в свой индекс
+            try:
+                size = os.stat(path).st_size
+            except OSError:
+                with self._lock:
+                    self.misses += 1
+                return None
+            with self._lock:
+                if key not in self._index:
+                    self._index[key] = size
+                    self._total_bytes += size
+
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                size = self._index.pop(key, None)
+                if size is not None:
+                    self._total_bytes -= size
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes):
+        """Атомарно записывает файл в кэш (синхронно)"""
+        if not self.enabled or not data or len(data) > self.max_bytes:
+            return
+
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"Не удалось записать в аудио кэш: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            old_size = self._index.pop(key, None)
+            if old_size is not None:
+                self._total_bytes -= old_size
+            self._index[key] = len(data)
+            self._total_bytes += len(data)
+            rescan = self.shared and (
+                self._total_bytes > self.max_bytes
+                or time.monotonic() - self._rescanned_at >= self.RESCAN_SECONDS
+            )
+
+        if rescan:
+            # Свой индекс не знает о файлах других воркеров - перед вытеснением считаем по диску
+            self._rescan()
+        self._evict()
+
+    def _evict(self):
+        """Удаляет самые давно использованные файлы, пока кэш не влезет в бюджет"""
+        while True:
+            with self._lock:
+                if self._total_bytes <= self.max_bytes or not self._index:
+                    return
+                key, size = self._index.popitem(last=False)
+                self._total_bytes -= size
+                self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    async def aget(self, key: str) -> Optional[bytes]:
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.get, key)
+
+    async def aput(self, key: str, data: bytes):
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.put, key, data)
+
+
+# Общий кэш на процесс
+audio_cache = AudioCache()
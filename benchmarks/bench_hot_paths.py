@@ -0,0 +1,240 @@
+"""
+Микробенчмарки кода, который выполняется на каждое обновление
+
+Сравнивает минимум из --repeat замеров с сохранённым минимумом и сообщает
+о регрессиях (код возврата 1): минимум меньше всего зависит от фоновой
+нагрузки, медиана выводится для справки. Бенчмарк, превысивший порог,
+замеряется заново (--retries раз), регрессией считается только
+повторившееся замедление. Базовые значения зависят от машины: после
+смены окружения или осознанного изменения кода их нужно перезаписать.
+
+Запуск из корня проекта:
+    python benchmarks/bench_hot_paths.py                 # сравнить с baselines/hot_paths.json
+    python benchmarks/bench_hot_paths.py --save          # записать новые базовые значения
+    python benchmarks/bench_hot_paths.py --only add_user --threshold 0.3
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+BASELINE_FILE = os.path.join(BENCH_DIR, 'baselines', 'hot_paths.json')
+FIXTURES_DIR = os.path.join(BENCH_DIR, 'fixtures')
+
+WORKDIR = tempfile.mkdtemp(prefix='musicbot-bench-')
+# bot.py при импорте открывает SQLite и каталог кэша - уводим их во временный каталог
+os.environ['BOT_DB_PATH'] = os.path.join(WORKDIR, 'bot_data.db')
+os.environ['AUDIO_CACHE_DIR'] = os.path.join(WORKDIR, 'audio_cache')
+os.environ.setdefault('LOG_FILE', '')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+import bot
+from mp3wr_parser import Mp3wrParser, parse_search_results
+from youtube_downloader import YouTubeDownloader
+
+
+class FakeMessage:
+    """Сообщение, у которого edit_text ничего не отправляет"""
+
+    async def edit_text(self, *args, **kwargs):
+        return self
+
+
+def make_tracks(count: int = 20) -> list:
+    return [
+        {
+            'title': f"Очень длинное название трека номер {i} (Official Audio)",
+            'artist': f"Исполнитель {i}",
+            'duration': '3:45',
+            'duration_seconds': 225,
+            'url': f"https://youtube.com/watch?v=vid{i:08d}",
+            'video_id': f"vid{i:08d}",
+        }
+        for i in range(count)
+    ]
+
+
+def make_entries(count: int = 20) -> list:
+    return [
+        {
+            'id': f"vid{i:08d}",
+            'title': f"Track {i} (Official Video)",
+            'uploader': f"Artist {i}",
+            'duration': 180.0 + i,
+            'url': f"https://www.youtube.com/watch?v=vid{i:08d}",
+        }
+        for i in range(count)
+    ]
+
+
+def write_stats(path: str, users: int):
+    stats = {'users': [
+        {
+            'user_id': user_id,
+            'username': f"user{user_id}",
+            'first_name': f"User {user_id}",
+            'joined': '2024-01-01T00:00:00',
+            'last_seen': '2024-01-01T00:00:00',
+        }
+        for user_id in range(1, users + 1)
+    ]}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(stats, f, ensure_ascii=False, indent=2)
+
+
+# --- Бенчмарки: имя -> (подготовка, число вызовов в замере) ---
+
+def bench_show_tracks_page():
+    loop = asyncio.new_event_loop()
+    message, tracks = FakeMessage(), make_tracks(20)
+    return lambda: loop.run_until_complete(bot.show_tracks_page(message, tracks, 1, None))
+
+
+def bench_format_duration():
+    downloader = YouTubeDownloader()
+    return lambda: downloader._format_duration(3725.0)
+
+
+def bench_search_mapping():
+    downloader, entries = YouTubeDownloader(), make_entries(20)
+    return lambda: downloader._entries_to_tracks(entries)
+
+
+def _bench_add_user(users: int):
+    path = os.path.join(WORKDIR, f'users_stats_{users}.json')
+    write_stats(path, users)
+    bot.STATS_FILE = path
+
+    # Существующий пользователь в конце списка - худший случай поиска
+    def run():
+        bot.STATS_FILE = path
+        bot.add_user(users, username=f"user{users}", first_name=f"User {users}")
+    return run
+
+
+def bench_add_user_10k():
+    return _bench_add_user(10_000)
+
+
+def bench_add_user_100k():
+    return _bench_add_user(100_000)
+
+
+def _bench_mp3wr(fixture: str):
+    with open(os.path.join(FIXTURES_DIR, fixture), encoding='utf-8') as f:
+        html = f.read()
+    return lambda: parse_search_results(html, 10, Mp3wrParser.BASE_URL)
+
+
+def bench_mp3wr_search():
+    return _bench_mp3wr('mp3wr_search.html')
+
+
+def bench_mp3wr_empty():
+    return _bench_mp3wr('mp3wr_empty.html')
+
+
+BENCHMARKS = {
+    'show_tracks_page': (bench_show_tracks_page, 2000),
+    'format_duration': (bench_format_duration, 200000),
+    'search_mapping_20': (bench_search_mapping, 20000),
+    'add_user_10k': (bench_add_user_10k, 5),
+    'add_user_100k': (bench_add_user_100k, 1),
+    'mp3wr_parse_search': (bench_mp3wr_search, 100),
+    'mp3wr_parse_empty': (bench_mp3wr_empty, 100),
+}
+
+
+def measure(setup, number: int, repeat: int) -> dict:
+    """Медиана и минимум времени одного вызова (мкс) по repeat замерам"""
+    func = setup()
+    func()  # прогрев
+    timings = [t / number * 1e6 for t in timeit.repeat(func, number=number, repeat=repeat, timer=time.perf_counter)]
+    return {'median_us': round(statistics.median(timings), 2), 'min_us': round(min(timings), 2)}
+
+
+def load_baselines() -> dict:
+    if not os.path.exists(BASELINE_FILE):
+        return {}
+    with open(BASELINE_FILE, encoding='utf-8') as f:
+        return json.load(f).get('benchmarks', {})
+
+
+def save_baselines(results: dict):
+    os.makedirs(os.path.dirname(BASELINE_FILE), exist_ok=True)
+    merged = {**load_baselines(), **results}
+    with open(BASELINE_FILE, 'w', encoding='utf-8') as f:
+        json.dump({
+            'python': sys.version.split()[0],
+            'platform': sys.platform,
+            'saved_at': datetime.now().isoformat(timespec='seconds'),
+            'benchmarks': merged,
+        }, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=7, help='число замеров каждого бенчмарка')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='допустимое замедление относительно базового значения (0.25 = 25%%)')
+    parser.add_argument('--retries', type=int, default=2,
+                        help='сколько раз перемерить бенчмарк, превысивший порог')
+    parser.add_argument('--only', nargs='*', help='запустить только эти бенчмарки (по префиксу имени)')
+    parser.add_argument('--save', action='store_true', help='сохранить результаты как базовые')
+    args = parser.parse_args()
+
+    baselines = load_baselines()
+    results = {}
+    regressions = []
+
+    print(f"{'Бенчмарк':<22}{'медиана, мкс':>14}{'минимум, мкс':>14}{'база, мкс':>12}{'изменение':>12}")
+    for name, (setup, number) in BENCHMARKS.items():
+        if args.only and not any(name.startswith(prefix) for prefix in args.only):
+            continue
+
+        result = measure(setup, number, args.repeat)
+        base = baselines.get(name)
+        if base and not args.save:
+            # Разовый всплеск нагрузки на машине - не регрессия
+            for _ in range(args.retries):
+                if result['min_us'] / base['min_us'] - 1 <= args.threshold:
+                    break
+                retry = measure(setup, number, args.repeat)
+                result = {
+                    'median_us': retry['median_us'],
+                    'min_us': min(result['min_us'], retry['min_us']),
+                }
+        results[name] = result
+
+        measured = f"{name:<22}{result['median_us']:>14.2f}{result['min_us']:>14.2f}"
+        if base:
+            change = result['min_us'] / base['min_us'] - 1
+            mark = ' ❌' if change > args.threshold else ''
+            if mark:
+                regressions.append(name)
+            print(f"{measured}{base['min_us']:>12.2f}{change:>+11.0%}{mark}")
+        else:
+            print(f"{measured}{'-':>12}{'-':>12}")
+
+    if args.save:
+        save_baselines(results)
+        print(f"\nБазовые значения сохранены в {os.path.relpath(BASELINE_FILE)}")
+        return
+
+    if regressions:
+        print(f"\nРегрессии (медленнее базы более чем на {args.threshold:.0%}): {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
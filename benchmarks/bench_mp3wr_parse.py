@@ -0,0 +1,112 @@
+"""
+Бенчмарк разбора страницы поиска mp3wr.com: прежняя реализация против быстрой
+
+Запуск из корня проекта:
+    python benchmarks/bench_mp3wr_parse.py [--repeat 200]
+"""
+import argparse
+import os
+import re
+import statistics
+import sys
+import time
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mp3wr_parser import Mp3wrParser, parse_search_results
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+FIXTURES = ['mp3wr_search.html', 'mp3wr_empty.html']
+
+
+def legacy_parse(html: str, limit: int, base_url: str) -> list:
+    """Прежний разбор из Mp3wrParser.search (полное дерево, шаблоны в цикле, отладочные проходы)"""
+    soup = BeautifulSoup(html, 'lxml')
+    results = []
+
+    track_blocks = soup.find_all(['div', 'li', 'article'],
+                                 class_=re.compile(r'track|song|music|item|result', re.I))
+    if not track_blocks:
+        track_blocks = soup.find_all('a', href=re.compile(r'/download/|/get/|\.mp3'))
+
+    for block in track_blocks[:limit]:
+        title = "Неизвестно"
+        artist = "Неизвестный исполнитель"
+        download_url = None
+
+        title_elem = block.find(['h2', 'h3', 'h4', 'span', 'div'], class_=re.compile(r'title|name', re.I))
+        if title_elem:
+            title = title_elem.get_text(strip=True)
+
+        artist_elem = block.find(['span', 'div', 'p'], class_=re.compile(r'artist|author', re.I))
+        if artist_elem:
+            artist = artist_elem.get_text(strip=True)
+
+        download_link = block.find('a', href=re.compile(r'/download/|/get/|\.mp3'))
+        if not download_link and block.name == 'a':
+            download_link = block
+        if download_link:
+            download_url = urljoin(base_url, download_link.get('href', ''))
+
+        if title == "Неизвестно" and download_link:
+            link_text = download_link.get_text(strip=True)
+            if link_text and len(link_text) > 3:
+                title = link_text
+
+        if download_url:
+            results.append({
+                'title': title,
+                'artist': artist,
+                'duration': "N/A",
+                'download_url': download_url,
+                'full_name': f"{artist} - {title}"
+            })
+
+    if not results:
+        # Отладочные проходы по всем ссылкам (без print, чтобы не мерить вывод)
+        _ = soup.title.string if soup.title else None
+        all_links = soup.find_all('a', href=True)
+        _ = [a for a in all_links if 'mp3' in a.get('href', '').lower()]
+        download_links = [a for a in all_links if any(word in a.get('href', '').lower()
+                          for word in ['download', 'get', 'track'])]
+        _ = [(link.get('href'), link.get_text(strip=True)[:50]) for link in download_links[:5]]
+
+    return results
+
+
+def measure(func, html: str, repeat: int) -> list:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(html, 10, Mp3wrParser.BASE_URL)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'Страница':<22}{'Размер':>9}{'Было, мс':>12}{'Стало, мс':>12}{'Ускорение':>12}")
+    for name in FIXTURES:
+        with open(os.path.join(FIXTURES_DIR, name), encoding='utf-8') as f:
+            html = f.read()
+
+        # Быстрый путь обязан давать тот же результат
+        expected = legacy_parse(html, 10, Mp3wrParser.BASE_URL)
+        actual = parse_search_results(html, 10, Mp3wrParser.BASE_URL)
+        if expected != actual:
+            print(f"❌ {name}: результаты разбора расходятся")
+            sys.exit(1)
+
+        legacy = statistics.median(measure(legacy_parse, html, args.repeat))
+        fast = statistics.median(measure(parse_search_results, html, args.repeat))
+        print(f"{name:<22}{len(html) // 1024:>7}КБ{legacy:>12.2f}{fast:>12.2f}{legacy / fast:>11.1f}x")
+
+
+if __name__ == '__main__':
+    main()
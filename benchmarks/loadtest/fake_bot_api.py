@@ -0,0 +1,199 @@
+"""
+Локальная замена Telegram Bot API для нагрузочного теста
+
+Бот подключается к серверу через TelegramAPIServer, обновления ему кладёт
+драйвер (push_update), а ответы бота складываются в очередь чата, из
+которой драйвер их ждёт (wait_for).
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+from aiohttp import web
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'LoadTestBot', 'username': 'loadtest_bot'}
+
+
+class BotCall:
+    """Один вызов метода Bot API"""
+
+    def __init__(self, method: str, params: dict, chat_id: Optional[int], size: int):
+        self.method = method
+        self.params = params
+        self.chat_id = chat_id
+        self.size = size
+        self.at = time.perf_counter()
+
+    @property
+    def callback_data(self) -> List[str]:
+        """callback_data всех кнопок клавиатуры из вызова"""
+        markup = self.params.get('reply_markup')
+        if not markup:
+            return []
+        if isinstance(markup, str):
+            markup = json.loads(markup)
+        return [
+            button.get('callback_data')
+            for row in markup.get('inline_keyboard', [])
+            for button in row
+        ]
+
+
+class FakeBotAPI:
+    """aiohttp-сервер с методами, которые вызывает bot.py"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, send_latency: float = 0.0):
+        self.host = host
+        self.port = port
+        # Имитация задержки сети Telegram для исходящих вызовов
+        self.send_latency = send_latency
+
+        self._updates: List[dict] = []
+        self._updates_event = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1000)
+        self._file_ids = itertools.count(1)
+        self._calls: Dict[int, asyncio.Queue] = defaultdict(asyncio.Queue)
+        self._runner: Optional[web.AppRunner] = None
+
+        # Статистика
+        self.calls_by_method: Dict[str, int] = defaultdict(int)
+        self.uploaded_bytes = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        app = web.Application(client_max_size=100 * 1024 * 1024)
+        app.router.add_post('/bot{token}/{method}', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    # --- Обновления для бота ---
+
+    def push_update(self, payload: dict) -> int:
+        update_id = next(self._update_ids)
+        self._updates.append({'update_id': update_id, **payload})
+        self._updates_event.set()
+        return update_id
+
+    def push_message(self, user_id: int, text: str) -> int:
+        return self.push_update({'message': {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+            'text': text,
+        }})
+
+    def push_callback(self, user_id: int, message_id: int, data: str) -> int:
+        return self.push_update({'callback_query': {
+            'id': f'cb{next(self._update_ids)}',
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': '...',
+            },
+        }})
+
+    async def wait_for(self, chat_id: int, predicate: Callable[[BotCall], bool], timeout: float = 60) -> BotCall:
+        """Ждёт вызов бота в чат, подходящий под условие (остальные пропускаются)"""
+        queue = self._calls[chat_id]
+        deadline = time.perf_counter() + timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise asyncio.TimeoutError
+            call = await asyncio.wait_for(queue.get(), remaining)
+            if predicate(call):
+                return call
+
+    # --- Методы Bot API ---
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        form = await request.post()
+
+        params = {}
+        size = 0
+        for key, value in form.items():
+            if isinstance(value, web.FileField):
+                data = value.file.read()
+                size += len(data)
+                params[key] = {'filename': value.filename, 'size': len(data)}
+            else:
+                params[key] = value
+
+        self.calls_by_method[method] += 1
+        handler = getattr(self, f'_method_{method}', None)
+        if handler is None:
+            return web.json_response({'ok': True, 'result': True})
+
+        if method == 'getUpdates':
+            return web.json_response({'ok': True, 'result': await handler(params)})
+
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+
+        chat_id = int(params['chat_id']) if 'chat_id' in params else None
+        result = handler(params, chat_id, size)
+        if chat_id is not None:
+            self._calls[chat_id].put_nowait(BotCall(method, params, chat_id, size))
+        return web.json_response({'ok': True, 'result': result})
+
+    async def _method_getUpdates(self, params: dict) -> List[dict]:
+        offset = int(params.get('offset') or 0)
+        self._updates = [u for u in self._updates if u['update_id'] >= offset]
+        if not self._updates:
+            self._updates_event.clear()
+            try:
+                await asyncio.wait_for(self._updates_event.wait(), float(params.get('timeout') or 1))
+            except asyncio.TimeoutError:
+                return []
+        return self._updates[:100]
+
+    def _method_getMe(self, params, chat_id, size):
+        return BOT_USER
+
+    def _message(self, chat_id: int, message_id: Optional[int] = None, **extra) -> dict:
+        return {
+            'message_id': message_id or next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            **extra,
+        }
+
+    def _method_sendMessage(self, params, chat_id, size):
+        return self._message(chat_id, text=params.get('text', ''))
+
+    def _method_editMessageText(self, params, chat_id, size):
+        return self._message(chat_id, int(params['message_id']), text=params.get('text', ''))
+
+    def _audio(self) -> dict:
+        file_number = next(self._file_ids)
+        return {'file_id': f'fake-audio-{file_number}', 'file_unique_id': f'u{file_number}', 'duration': 0}
+
+    def _method_sendAudio(self, params, chat_id, size):
+        self.uploaded_bytes += size
+        return self._message(chat_id, audio=self._audio())
+
+    def _method_sendMediaGroup(self, params, chat_id, size):
+        self.uploaded_bytes += size
+        return [self._message(chat_id, audio=self._audio()) for _ in json.loads(params['media'])]
@@ -0,0 +1,87 @@
+"""
+Замена YouTubeDownloader с настраиваемыми задержками и размером файлов
+"""
+import asyncio
+import hashlib
+import random
+from typing import Dict, List, Optional
+
+# Длительность обычного трека в выдаче (сек); задержка скачивания задана для неё
+BASE_DURATION = 210
+
+
+class FakeYouTubeDownloader:
+    """
+    Тот же интерфейс, что у YouTubeDownloader, без обращения к сети.
+
+    Параметры задаются на классе (configure), так как бот создаёт
+    новый экземпляр на каждый поиск и скачивание.
+    """
+
+    search_latency = 1.0
+    download_latency = 3.0
+    # Относительный разброс задержек (0.2 = ±20%)
+    jitter = 0.2
+    payload_bytes = 5 * 1024 * 1024
+    results = 20
+    # Доля запросов, у которых первый результат - длинный микс
+    long_share = 0.0
+    long_duration = 30 * 60
+
+    @classmethod
+    def configure(cls, **options):
+        for name, value in options.items():
+            if not hasattr(cls, name):
+                raise AttributeError(f"Неизвестный параметр: {name}")
+            setattr(cls, name, value)
+
+    @classmethod
+    async def _sleep(cls, seconds: float):
+        if seconds > 0:
+            await asyncio.sleep(seconds * random.uniform(1 - cls.jitter, 1 + cls.jitter))
+
+    async def search(self, query: str, limit: int = 10) -> List[Dict[str, str]]:
+        await self._sleep(self.search_latency)
+        prefix = hashlib.md5(query.encode('utf-8')).hexdigest()[:8]
+        # Детерминированно по запросу, чтобы повторы запроса давали ту же выдачу
+        long_first = int(prefix, 16) % 1000 < self.long_share * 1000
+
+        def duration(i: int) -> int:
+            return self.long_duration if long_first and i == 0 else BASE_DURATION
+
+        return [
+            {
+                'title': f"{query} #{i + 1}",
+                'artist': 'Load Test',
+                'duration': f"{duration(i) // 60}:{duration(i) % 60:02d}",
+                'duration_seconds': duration(i),
+                'url': f"https://youtube.com/watch?v={prefix}{i:03d}",
+                'video_id': f"{prefix}{i:03d}",
+                'full_name': f"Load Test - {query} #{i + 1}",
+            }
+            for i in range(min(limit, self.results))
+        ]
+
+    def peek_search(self, query: str, limit: int = 10) -> Optional[List[Dict[str, str]]]:
+        return None
+
+    @staticmethod
+    def playlist_id(text: str) -> Optional[str]:
+        from youtube_downloader import YouTubeDownloader
+        return YouTubeDownloader.playlist_id(text)
+
+    async def playlist(self, list_id: str, limit: int = 50) -> List[Dict[str, str]]:
+        return await self.search(f"playlist {list_id}", limit)
+
+    async def download_track(self, url: str, duration_seconds: Optional[int] = None) -> Optional[bytes]:
+        # Та же очередь, что у настоящего загрузчика; время скачивания растёт с длительностью
+        from download_scheduler import download_scheduler
+
+        async with download_scheduler.slot(duration_seconds):
+            await self._sleep(self.download_latency * (duration_seconds or BASE_DURATION) / BASE_DURATION)
+        # Заголовок ID3: media_processor отправит файл как MP3 без ffmpeg
+        return b'ID3' + bytes(self.payload_bytes - 3)
+
+    @staticmethod
+    def extract_video_id(url: str) -> str:
+        return url.split('v=')[-1]
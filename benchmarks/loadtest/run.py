@@ -0,0 +1,234 @@
+"""
+Нагрузочный тест bot.py без сети: фейковый Bot API и фейковый YouTube
+
+N пользователей проходят сценарий /start → поиск → следующая страница →
+скачивание. Для каждого шага считаются p50/p95/p99 задержки (от отправки
+обновления до ответа бота), а также пропускная способность и пиковый RSS
+процесса (бот и фейковый API работают в одном процессе).
+
+Запуск из корня проекта:
+    python benchmarks/loadtest/run.py --users 200 --ramp 10
+    python benchmarks/loadtest/run.py --users 50 --search-latency 0.5 --download-latency 2 --payload-mb 8
+    python benchmarks/loadtest/run.py --users 100 --shared-queries 10 --json result.json
+    python benchmarks/loadtest/run.py --users 100 --long-share 0.2 --download-workers 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+LOADTEST_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(os.path.dirname(LOADTEST_DIR))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, LOADTEST_DIR)
+
+from fake_bot_api import FakeBotAPI
+from fake_downloader import FakeYouTubeDownloader
+
+STEPS = ['start', 'search', 'page', 'download', 'flow']
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт КБ, macOS - байты
+    return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024
+
+
+def isolate_environment(workdir: str):
+    """Бот пишет в SQLite, кэш и логи - уводим всё во временный каталог"""
+    os.environ['BOT_DB_PATH'] = os.path.join(workdir, 'bot_data.db')
+    os.environ['AUDIO_CACHE_DIR'] = os.path.join(workdir, 'audio_cache')
+    os.environ.setdefault('LOG_FILE', '')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ.setdefault('TRACE_SAMPLE_RATE', '0')
+    # Сброс нагрузки отклонил бы часть сценариев - тест меряет саму очередь
+    os.environ.setdefault('SHED_QUEUE_DEPTH', '1000000')
+
+
+class LoadTest:
+    def __init__(self, args, api: FakeBotAPI):
+        self.args = args
+        self.api = api
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.failures: Dict[str, int] = defaultdict(int)
+        self.completed = 0
+
+    def query_for(self, user_id: int) -> str:
+        if self.args.shared_queries:
+            return f"shared{random.randrange(self.args.shared_queries):04d} song"
+        # Уникальный токен - запросы не находят чужие треки в локальном индексе
+        return f"user{user_id:06d} song"
+
+    async def step(self, name: str, user_id: int, push, predicate) -> object:
+        started = time.perf_counter()
+        push()
+        try:
+            call = await self.api.wait_for(user_id, predicate, timeout=self.args.timeout)
+        except asyncio.TimeoutError:
+            self.failures[name] += 1
+            raise
+        self.latencies[name].append(call.at - started)
+        return call
+
+    async def user_flow(self, user_id: int, delay: float):
+        await asyncio.sleep(delay)
+        started = time.perf_counter()
+        api = self.api
+
+        try:
+            await self.step(
+                'start', user_id,
+                lambda: api.push_message(user_id, '/start'),
+                lambda call: call.method == 'sendMessage'
+            )
+
+            results = await self.step(
+                'search', user_id,
+                lambda: api.push_message(user_id, self.query_for(user_id)),
+                lambda call: call.method == 'editMessageText'
+                and any(data and data.startswith('download_') for data in call.callback_data)
+            )
+            message_id = int(results.params['message_id'])
+
+            if 'page_1' in results.callback_data:
+                await self.step(
+                    'page', user_id,
+                    lambda: api.push_callback(user_id, message_id, 'page_1'),
+                    lambda call: call.method == 'editMessageText' and 'page_0' in call.callback_data
+                )
+
+            await self.step(
+                'download', user_id,
+                lambda: api.push_callback(user_id, message_id, 'download_0'),
+                lambda call: call.method == 'sendAudio'
+            )
+        except asyncio.TimeoutError:
+            return
+
+        self.latencies['flow'].append(time.perf_counter() - started)
+        self.completed += 1
+
+    async def run(self) -> float:
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            self.user_flow(user_id, self.args.ramp * index / max(1, self.args.users))
+            for index, user_id in enumerate(range(100001, 100001 + self.args.users))
+        ))
+        return time.perf_counter() - started
+
+    def report(self, elapsed: float) -> dict:
+        steps = {}
+        for name in STEPS:
+            values = self.latencies.get(name, [])
+            steps[name] = {
+                'count': len(values),
+                'failures': self.failures.get(name, 0),
+                'mean': sum(values) / len(values) if values else float('nan'),
+                'p50': percentile(values, 50),
+                'p95': percentile(values, 95),
+                'p99': percentile(values, 99),
+                'max': max(values) if values else float('nan'),
+            }
+        return {
+            'users': self.args.users,
+            'completed': self.completed,
+            'elapsed_seconds': elapsed,
+            'flows_per_second': self.completed / elapsed if elapsed else 0.0,
+            'downloads_per_minute': len(self.latencies['download']) / elapsed * 60 if elapsed else 0.0,
+            'peak_rss_mb': peak_rss_mb(),
+            'api_calls': dict(self.api.calls_by_method),
+            'uploaded_mb': self.api.uploaded_bytes / 1024 / 1024,
+            'steps': steps,
+        }
+
+
+def print_report(result: dict):
+    print(f"Пользователей: {result['users']}, завершили сценарий: {result['completed']}")
+    print(f"Время: {result['elapsed_seconds']:.1f} сек, "
+          f"{result['flows_per_second']:.2f} сценариев/сек, "
+          f"{result['downloads_per_minute']:.1f} скачиваний/мин")
+    print(f"Пиковый RSS: {result['peak_rss_mb']:.1f} МБ, загружено в фейковый API: {result['uploaded_mb']:.1f} МБ")
+    print()
+    print(f"{'шаг':<10}{'ok':>7}{'fail':>7}{'mean, с':>10}{'p50, с':>10}{'p95, с':>10}{'p99, с':>10}{'max, с':>10}")
+    for name, step in result['steps'].items():
+        print(f"{name:<10}{step['count']:>7}{step['failures']:>7}"
+              f"{step['mean']:>10.3f}{step['p50']:>10.3f}{step['p95']:>10.3f}{step['p99']:>10.3f}{step['max']:>10.3f}")
+
+
+async def main(args):
+    workdir = tempfile.mkdtemp(prefix='musicbot-loadtest-')
+    isolate_environment(workdir)
+    if args.download_workers:
+        os.environ['DOWNLOAD_WORKERS'] = str(args.download_workers)
+
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    import bot as bot_module
+
+    FakeYouTubeDownloader.configure(
+        search_latency=args.search_latency,
+        download_latency=args.download_latency,
+        payload_bytes=int(args.payload_mb * 1024 * 1024),
+        long_share=args.long_share,
+    )
+    bot_module.YouTubeDownloader = FakeYouTubeDownloader
+    bot_module.STATS_FILE = os.path.join(workdir, 'users_stats.json')
+
+    api = FakeBotAPI(send_latency=args.send_latency)
+    await api.start()
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(api.base_url))
+    test_bot = Bot(token='123456:LOADTEST', session=session)
+    polling = asyncio.create_task(
+        bot_module.dp.start_polling(test_bot, handle_signals=False, polling_timeout=1)
+    )
+
+    try:
+        load_test = LoadTest(args, api)
+        elapsed = await load_test.run()
+        result = load_test.report(elapsed)
+    finally:
+        await bot_module.dp.stop_polling()
+        await polling
+        await test_bot.session.close()
+        await api.stop()
+
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50, help='число пользователей')
+    parser.add_argument('--ramp', type=float, default=5.0, help='за сколько секунд подключаются все пользователи')
+    parser.add_argument('--search-latency', type=float, default=1.0, help='задержка поиска YouTube, сек')
+    parser.add_argument('--download-latency', type=float, default=3.0, help='задержка скачивания, сек')
+    parser.add_argument('--payload-mb', type=float, default=5.0, help='размер скачиваемого файла, МБ')
+    parser.add_argument('--send-latency', type=float, default=0.05, help='задержка ответа Bot API, сек')
+    parser.add_argument('--shared-queries', type=int, default=0,
+                        help='число разных запросов на всех (0 - у каждого свой, кэши не помогают)')
+    parser.add_argument('--long-share', type=float, default=0.0,
+                        help='доля запросов, где скачивается длинный микс (30 мин, задержка в 8.6 раза больше)')
+    parser.add_argument('--download-workers', type=int, help='одновременных скачиваний (DOWNLOAD_WORKERS)')
+    parser.add_argument('--timeout', type=float, default=120.0, help='таймаут одного шага, сек')
+    parser.add_argument('--json', help='сохранить результат в JSON-файл')
+    asyncio.run(main(parser.parse_args()))
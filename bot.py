@@ -6,33 +6,63 @@ import asyncio
 import os
 import logging
 import json
+import base64
+import html
+import time
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
 from io import BytesIO
-from typing import Optional
+from typing import Awaitable, Callable, List, Optional, Union
+from contextlib import contextmanager
 from datetime import datetime
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Первым делом: замер времени импортов и запуска
+from startup_timing import first_update_middleware, startup_timer
+
 from aiogram import Bot, Dispatcher, F
-from aiogram.filters import Command, CommandStart
-from aiogram.types import Message, BufferedInputFile, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command, CommandObject, CommandStart
+from aiogram.types import (
+    Message, BufferedInputFile, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery,
+    InlineQuery, InlineQueryResultArticle, InlineQueryResultCachedAudio, InlineQueryResultsButton,
+    InputMediaAudio, InputTextMessageContent
+)
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
 # from dotenv import load_dotenv
 from aiohttp import web
 
+startup_timer.mark('import aiogram')
+
 from youtube_downloader import YouTubeDownloader
+from media_processor import MediaProcessingError, media_processor
+from http_pool import start_http_pool, close_http_pool
+from health_monitor import health_monitor, warm_up_and_monitor
+from loop_monitor import loop_monitor
+from rate_limit import DOWNLOAD, RateLimitMiddleware
+from track_dedup import dedupe_tracks, track_duration
+from file_id_cache import file_id_cache
+from local_index import local_index
+from job_queue import download_jobs, finish_sent_job, report_interrupted
+import metrics
+from metrics import ERRORS, IN_FLIGHT, STAGE_SECONDS, UPLOADED_BYTES
+from tracing import TracingMiddleware, mark_error, span
+from logging_setup import setup_logging
+
+startup_timer.mark('import modules')
 
 # Загружаем переменные окружения
 # load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),  # Вывод в консоль
-        logging.FileHandler('bot.log', encoding='utf-8')  # Сохранение в файл
-    ]
-)
+# Настройка логирования: консоль и bot.log с ротацией, запись в отдельном потоке
+setup_logging('bot.log')
 logger = logging.getLogger(__name__)
 
 # Токен бота (замените на ваш)
@@ -42,10 +72,31 @@ BOT_TOKEN = "8353650126:AAGvR3EoPXWeyCMkDIB8gDR7NwXx1REMbwQ"
 bot = Bot(token=BOT_TOKEN)
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
+dp.update.outer_middleware(TracingMiddleware())
+dp.update.outer_middleware(first_update_middleware)
+
+# Лимиты на поиски и скачивания пользователя и отказ при перегрузке
+rate_limiter = RateLimitMiddleware()
+dp.message.outer_middleware(rate_limiter)
+dp.callback_query.outer_middleware(rate_limiter)
 
 # ID админа для доступа к статистике
 ADMIN_ID = 7850455999
 
+# Сколько результатов поиска запрашивать у YouTube
+SEARCH_LIMIT = 20
+TRACKS_PER_PAGE = 5
+
+# Пакетное скачивание (страница результатов или плейлист)
+BATCH_PARALLEL = int(os.getenv('BATCH_PARALLEL', 3))
+PLAYLIST_MAX_TRACKS = int(os.getenv('PLAYLIST_MAX_TRACKS', 50))
+# Telegram принимает в одной media group не больше 10 файлов
+MEDIA_GROUP_SIZE = 10
+
+# Параметры inline-режима
+INLINE_PAGE_SIZE = 10
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', 30))
+
 # Путь к файлу статистики
 STATS_FILE = os.path.join(os.path.dirname(__file__), 'users_stats.json')
 
@@ -71,8 +122,27 @@ def save_stats(stats):
         logger.error(f"Ошибка сохранения статистики: {e}")
 
 
+@contextmanager
+def stats_lock():
+    """Блокировка файла статистики: при запуске через supervisor.py его меняют несколько процессов"""
+    if fcntl is None:
+        yield
+        return
+    with open(STATS_FILE + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
 def add_user(user_id: int, username: str = None, first_name: str = None):
     """Добавляет пользователя в статистику"""
+    with stats_lock():
+        return _add_user(user_id, username, first_name)
+
+
+def _add_user(user_id: int, username: str = None, first_name: str = None):
     stats = load_stats()
     
     # Проверяем, есть ли уже такой пользователь
@@ -106,8 +176,8 @@ class MusicStates(StatesGroup):
 
 
 @dp.message(CommandStart())
-async def cmd_start(message: Message):
-    """Обработчик команды /start"""
+async def cmd_start(message: Message, command: CommandObject, state: FSMContext):
+    """Обработчик команды /start (в том числе с deep link из inline-режима)"""
     # Добавляем пользователя в статистику
     user = message.from_user
     is_new = add_user(
@@ -120,6 +190,22 @@ async def cmd_start(message: Message):
     if is_new:
         logger.info(f"Новый пользователь: {user.id} (@{user.username}) - {user.first_name}")
     
+    payload = command.args or ''
+    
+    # Ссылка на конкретный трек: /start dl_<id видео>
+    if payload.startswith('dl_'):
+        track = track_from_video_id(payload[3:])
+        progress_msg = await message.answer("⏳ Готовлю трек...")
+        await deliver_track(progress_msg, track, user.id)
+        return
+    
+    # Ссылка на поиск: /start q_<запрос в base64>
+    if payload.startswith('q_'):
+        query = decode_start_query(payload[2:])
+        if query:
+            await run_search(message, query, state)
+            return
+    
     await message.answer(
         "🎵 <b>Привет! Я @DownloaderSSMusicBot</b>\n\n"
         "💫 Я помогу тебе найти и скачать любую музыку\n\n"
@@ -197,7 +283,8 @@ async def cmd_search(message: Message, state: FSMContext):
 @dp.message(Command('cancel'))
 async def cmd_cancel(message: Message, state: FSMContext):
     """Обработчик команды /cancel"""
-    current_state = await state.get_state()
+    with span('fsm.get_state'):
+        current_state = await state.get_state()
     if current_state is None:
         await message.answer("❌ Нечего отменять")
         return
@@ -208,45 +295,44 @@ async def cmd_cancel(message: Message, state: FSMContext):
 
 @dp.message(Command('status'))
 async def cmd_status(message: Message):
-    """Проверка статуса источников музыки"""
-    status_msg = await message.answer("🔍 Проверяю доступность источников...")
+    """Статус источников музыки по данным фонового мониторинга"""
+    snapshot = health_monitor.snapshot()
     
-    try:
-        downloader = MusicDownloader()
-        results = await downloader.test_sources()
-        
-        text = "📊 <b>Статус источников музыки:</b>\n\n"
-        
-        sources_info = {
-            'youtube': {'name': 'YouTube', 'emoji': '📺'},
-            'mp3wr': {'name': 'MP3WR', 'emoji': '🎵'},
-            'sefon': {'name': 'Sefon', 'emoji': '🎶'}
-        }
-        
-        for source, available in results.items():
-            info = sources_info.get(source, {'name': source, 'emoji': '❓'})
-            status = "✅ Доступен" if available else "❌ Недоступен"
-            text += f"{info['emoji']} <b>{info['name']}:</b> {status}\n"
-        
-        # Добавляем информацию о прокси
-        proxy = os.getenv('PROXY')
-        if proxy:
-            text += f"\n🔒 <b>Прокси:</b> Настроен"
+    text = "📊 <b>Статус источников музыки:</b>\n\n"
+    
+    sources_info = {
+        'youtube': {'name': 'YouTube', 'emoji': '📺'},
+        'mp3wr': {'name': 'MP3WR', 'emoji': '🎵'},
+        'sefon': {'name': 'Sefon', 'emoji': '🎶'}
+    }
+    
+    for source, health in snapshot.items():
+        info = sources_info.get(source, {'name': source, 'emoji': '❓'})
+        if health['available'] is None:
+            status = "⏳ Ещё не проверялся"
+        elif health['available']:
+            status = f"✅ Доступен ({health['latency_ms']} мс)"
         else:
-            text += f"\n🔒 <b>Прокси:</b> Не настроен"
-            if not results.get('youtube', False):
-                text += f"\n💡 <i>Для работы с YouTube в России нужен прокси</i>"
-        
-        await status_msg.edit_text(text, parse_mode="HTML")
+            status = "❌ Недоступен"
+        text += f"{info['emoji']} <b>{info['name']}:</b> {status}\n"
         
-    except Exception as e:
-        logger.error(f"Ошибка проверки статуса: {e}")
-        await status_msg.edit_text("❌ Ошибка при проверке статуса источников")
+        if health['uptime'] is not None:
+            text += f"   <i>Доступность: {health['uptime']:.0%}, проверка: {health['checked_at']}</i>\n"
+    
+    # Добавляем информацию о прокси
+    proxy = os.getenv('PROXY')
+    if proxy:
+        text += f"\n🔒 <b>Прокси:</b> Настроен"
+    else:
+        text += f"\n🔒 <b>Прокси:</b> Не настроен"
+        if snapshot.get('youtube', {}).get('available') is False:
+            text += f"\n💡 <i>Для работы с YouTube в России нужен прокси</i>"
+    
+    await message.answer(text, parse_mode="HTML")
 
 
 async def show_tracks_page(message: Message, tracks: list, page: int, state: FSMContext):
     """Показывает страницу с треками"""
-    TRACKS_PER_PAGE = 5
     total_pages = (len(tracks) + TRACKS_PER_PAGE - 1) // TRACKS_PER_PAGE
     
     # Вычисляем индексы треков для текущей страницы
@@ -270,13 +356,20 @@ async def show_tracks_page(message: Message, tracks: list, page: int, state: FSM
         if len(title) > max_title_length:
             title = title[:max_title_length] + "..."
         
-        button_text = f"{global_idx + 1}. {title} • {duration}"
+        button_text = f"{global_idx + 1}. {track.get('note', '')}{title} • {duration}"
         
         keyboard.append([InlineKeyboardButton(
             text=button_text,
             callback_data=f"download_{global_idx}"
         )])
     
+    # Вся страница одним альбомом
+    if len(page_tracks) > 1:
+        keyboard.append([InlineKeyboardButton(
+            text=f"📥 Скачать страницу ({len(page_tracks)})",
+            callback_data=f"batch_{page}"
+        )])
+    
     # Кнопки навигации
     nav_buttons = []
     
@@ -333,18 +426,67 @@ async def search_music(message: Message, state: FSMContext):
         await message.answer("❌ Пожалуйста, отправь корректный запрос")
         return
     
+    # Ссылка на плейлист или альбом YouTube - скачиваем целиком
+    list_id = YouTubeDownloader.playlist_id(query)
+    if list_id:
+        await run_playlist(message, list_id)
+        return
+    
+    await run_search(message, query, state)
+
+
+async def search_is_current(state: FSMContext, search_id: int, expected_state: Optional[str]) -> bool:
+    """
+    Результаты поиска search_id ещё можно перерисовать: пользователь не начал
+    новый поиск, не отменил его и не начал скачивание из этого сообщения.
+    """
+    if await state.get_state() != expected_state:
+        return False
+    data = await state.get_data()
+    return data.get('search_id') == search_id and not data.get('delivering')
+
+
+async def run_search(message: Message, query: str, state: FSMContext):
+    """Выполняет поиск и показывает первую страницу результатов"""
     # Отправляем сообщение о начале поиска
     search_msg = await message.answer("🔍 Ищу музыку...")
+    local_tracks = []
+    
+    # Поиск, запущенный позже, заменяет токен - результаты этого уже не покажутся поверх
+    search_id = search_msg.message_id
+    await state.set_data({'search_id': search_id})
+    shown_state = await state.get_state()
     
     try:
         logger.info(f"Поиск музыки: '{query}' от пользователя {message.from_user.id}")
         
+        # Сначала показываем то, что бот уже отправлял раньше
+        local_tracks = dedupe_tracks(await local_index.asearch(query, limit=SEARCH_LIMIT))
+        if local_tracks:
+            logger.info(f"Локальный индекс: {len(local_tracks)} треков для запроса: '{query}'")
+            await state.update_data(tracks=local_tracks, page=0)
+            await state.set_state(MusicStates.choosing_track)
+            shown_state = MusicStates.choosing_track.state
+            await show_tracks_page(search_msg, local_tracks, 0, state)
+        
         # Поиск треков (увеличим лимит до 20)
         downloader = YouTubeDownloader()
-        tracks = await downloader.search(query, limit=20)
+        remote_tracks = await downloader.search(query, limit=SEARCH_LIMIT)
+        
+        # Локальные результаты остаются первыми, чтобы номера кнопок не сдвигались
+        tracks = dedupe_tracks(local_tracks + remote_tracks)[:SEARCH_LIMIT]
         
         logger.info(f"Найдено {len(tracks)} треков для запроса: '{query}'")
         
+        if tracks == local_tracks:
+            # Удалённый поиск ничего не добавил - страница уже показана
+            return
+        
+        if not await search_is_current(state, search_id, shown_state):
+            # Пока шёл поиск, пользователь начал новый или уже скачивает трек
+            logger.info(f"Результаты поиска '{query}' устарели, страница не обновляется")
+            return
+        
         if not tracks:
             logger.warning(f"Треки не найдены для запроса: '{query}'")
             await search_msg.edit_text(
@@ -363,11 +505,32 @@ async def search_music(message: Message, state: FSMContext):
         
     except Exception as e:
         logger.error(f"Ошибка при поиске: {e}")
+        ERRORS.inc(stage='search', error=e.__class__.__name__)
+        if local_tracks:
+            # Локальные результаты уже показаны - оставляем их
+            return
         await search_msg.edit_text(
             "❌ Произошла ошибка при поиске\n\n"
             "Попробуй еще раз позже"
         )
-        await state.clear()
+        if await search_is_current(state, search_id, shown_state):
+            await state.clear()
+
+
+async def run_playlist(message: Message, list_id: str):
+    """Скачивает треки плейлиста и отправляет их альбомами"""
+    status = await message.answer("🔍 Загружаю плейлист...")
+    logger.info(f"Плейлист {list_id} от пользователя {message.from_user.id}")
+    
+    tracks = await YouTubeDownloader().playlist(list_id, limit=PLAYLIST_MAX_TRACKS)
+    if not tracks:
+        await status.edit_text(
+            "❌ Плейлист пуст или недоступен\n\n"
+            "Проверь ссылку или найди треки поиском"
+        )
+        return
+    
+    await deliver_batch(message, tracks, message.from_user.id, status)
 
 
 @dp.callback_query(F.data == "cancel")
@@ -389,7 +552,8 @@ async def callback_page(callback: CallbackQuery, state: FSMContext):
     page = int(callback.data.split("_")[1])
     
     # Получаем треки из состояния
-    data = await state.get_data()
+    with span('fsm.get_data'):
+        data = await state.get_data()
     tracks = data.get('tracks', [])
     
     if not tracks:
@@ -409,29 +573,173 @@ async def callback_download(callback: CallbackQuery, state: FSMContext):
     """Обработчик скачивания выбранного трека"""
     await callback.answer("⏳ Скачиваю...")
     
-    try:
-        # Получаем индекс трека
-        track_idx = int(callback.data.split("_")[1])
-        
-        # Получаем список треков из состояния
+    # Получаем индекс трека
+    track_idx = int(callback.data.split("_")[1])
+    
+    # Получаем список треков из состояния
+    with span('fsm.get_data'):
         data = await state.get_data()
-        tracks = data.get('tracks', [])
+    tracks = data.get('tracks', [])
+    
+    # Очищаем до скачивания: поиск, который ещё идёт, не перерисует сообщение
+    # поверх прогресса, а очистка после не сотрёт поиск, начатый за это время
+    await state.clear()
+    
+    if track_idx >= len(tracks):
+        await callback.message.edit_text("❌ Трек не найден")
+        return
+    
+    await deliver_track(callback.message, tracks[track_idx], callback.from_user.id)
+
+
+@dp.callback_query(F.data.startswith("batch_"))
+async def callback_batch(callback: CallbackQuery, state: FSMContext):
+    """Скачивание всех треков страницы одним пакетом"""
+    page = int(callback.data.split("_")[1])
+    
+    with span('fsm.get_data'):
+        data = await state.get_data()
+    page_tracks = data.get('tracks', [])[page * TRACKS_PER_PAGE:(page + 1) * TRACKS_PER_PAGE]
+    
+    if not page_tracks:
+        await callback.answer("❌ Треки не найдены", show_alert=True)
+        return
+    
+    await callback.answer("⏳ Скачиваю страницу...")
+    # Результаты остаются в состоянии, но перерисовывать их поверх пакета нельзя
+    await state.update_data(delivering=True)
+    # Результаты поиска остаются: можно скачать и другие страницы
+    # Первое скачивание страницы оплачено токеном, который middleware списал за нажатие
+    await deliver_batch(callback.message, page_tracks, callback.from_user.id, prepaid=1)
+
+
+TOO_LARGE_TEXT = (
+    "❌ <b>Файл слишком большой!</b>\n\n"
+    "📦 Размер файла превышает лимит Telegram (50 МБ)\n\n"
+    "💡 <b>Попробуй:</b>\n"
+    "• Выбрать другую версию трека\n"
+    "• Найти короткую версию песни"
+)
+
+
+@lru_cache(maxsize=1)
+def load_thumbnail() -> Optional[bytes]:
+    """Обложка для аудио: файл читается один раз, а не при каждой отправке"""
+    thumbnail_path = os.path.join(os.path.dirname(__file__), 'thumbnail.jpg')
+    if not os.path.exists(thumbnail_path):
+        return None
+    with open(thumbnail_path, 'rb') as thumb_file:
+        return thumb_file.read()
+
+
+def thumbnail_file() -> Optional[BufferedInputFile]:
+    data = load_thumbnail()
+    return BufferedInputFile(data, filename='thumbnail.jpg') if data else None
+
+
+def audio_tags(track: dict) -> dict:
+    """Название и исполнитель для загружаемого аудио: с эмодзи и именем бота"""
+    return {
+        'title': f"♫ {track['title']}",
+        'performer': f"{track['artist']} ✦ @DownloaderSSMusicBot",
+    }
+
+
+def audio_caption(track: dict) -> str:
+    return (
+        f"🎵 <b>{html.escape(track['title'])}</b>\n"
+        f"👤 <i>{html.escape(track['artist'])}</i>\n"
+        f"⏱ {track['duration']}\n\n"
+        f"📥 Downloaded by @DownloaderSSMusicBot"
+    )
+
+
+async def send_cached_audio(message: Message, track: dict, job_id: Optional[int] = None) -> bool:
+    """Отправляет трек по сохранённому file_id, если он есть"""
+    file_id = file_id_cache.get(track)
+    if not file_id:
+        return False
+    
+    try:
+        await message.answer_audio(audio=file_id, caption=audio_caption(track), parse_mode="HTML")
+    except TelegramBadRequest as e:
+        logger.warning(f"file_id больше не действителен для '{track['title']}': {e}")
+        file_id_cache.invalidate(track)
+        return False
+    
+    if job_id is not None:
+        download_jobs.mark_sent(job_id)
+    
+    logger.info(f"Трек отправлен по file_id: '{track['title']}'")
+    local_index.record(track, file_id)
+    return True
+
+
+async def deliver_track(message: Message, track: dict, user_id: int) -> bool:
+    """
+    Скачивает и отправляет трек в чат сообщения.
+    
+    Сообщение используется для прогресс-бара и ошибок и удаляется после отправки.
+    Задание сохраняется в очереди, чтобы после перезапуска бота его можно
+    было возобновить; повторное нажатие на тот же трек игнорируется.
+    
+    Returns:
+        True, если трек отправлен
+    """
+    job = download_jobs.start(message.chat.id, message.message_id, user_id, track)
+    if job is None:
+        logger.info(f"Трек '{track['title']}' уже отправлен или отправляется в чат {message.chat.id}")
+        return False
+    
+    started = time.perf_counter()
+    delivered = False
+    try:
+        with IN_FLIGHT.track_inprogress(kind='delivery'):
+            delivered = await _deliver_track(message, track, user_id, job.id)
+    except asyncio.CancelledError:
+        # Бот останавливается: задание остаётся незавершённым и возобновится после перезапуска
+        logger.info(f"Задание {job.id} прервано остановкой бота: '{track['title']}'")
+        raise
+    except Exception:
+        # Ошибка после отправки аудио (например, при удалении прогресса) - задание всё равно выполнено
+        if not download_jobs.fail(job.id, 'delivery failed'):
+            download_jobs.complete(job.id)
+        raise
+    
+    if delivered or not download_jobs.fail(job.id, 'delivery failed'):
+        download_jobs.complete(job.id)
+    if delivered:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage='end_to_end')
+    return delivered
+
+
+async def _deliver_track(message: Message, track: dict, user_id: int, job_id: int) -> bool:
+    stage = 'resolve'
+    try:
+        logger.info(f"Начало скачивания трека: '{track['title']}' ({track['url']}) для пользователя {user_id}")
         
-        if track_idx >= len(tracks):
-            await callback.message.edit_text("❌ Трек не найден")
-            await state.clear()
-            return
+        # Трек уже загружался в Telegram - скачивать не нужно
+        with STAGE_SECONDS.time(stage='resolve'), span('resolve') as resolve_span:
+            sent_cached = await send_cached_audio(message, track, job_id)
+            resolve_span['cached'] = sent_cached
+        if sent_cached:
+            await message.delete()
+            return True
         
-        track = tracks[track_idx]
+        # Поиск уже оценил, что трек не поместится в лимит - не тратим время на скачивание
+        if track.get('unsendable'):
+            logger.info(f"Трек больше лимита Telegram, скачивание пропущено: '{track['title']}'")
+            await message.edit_text(TOO_LARGE_TEXT, parse_mode="HTML")
+            return False
         
-        logger.info(f"Начало скачивания трека: '{track['title']}' ({track['url']}) для пользователя {callback.from_user.id}")
+        # Название и длительность приходят из источника - экранируем для HTML
+        track_line = f"🎵 {html.escape(track['title'])}\n⏱ {html.escape(str(track['duration']))}"
         
         # Прогресс бар при скачивании
-        progress_msg = await callback.message.edit_text(
+        progress_msg = await message.edit_text(
             f"⬜⬜⬜⬜⬜⬜⬜⬜⬜⬜ 0%\n"
             f"📥 <b>Подготовка...</b>\n\n"
-            f"🎵 {track['title']}\n"
-            f"⏱ {track['duration']}",
+            f"{track_line}",
             parse_mode="HTML"
         )
         
@@ -440,99 +748,443 @@ async def callback_download(callback: CallbackQuery, state: FSMContext):
         await progress_msg.edit_text(
             f"🟦🟦⬜⬜⬜⬜⬜⬜⬜⬜ 25%\n"
             f"📥 <b>Скачивание...</b>\n\n"
-            f"🎵 {track['title']}\n"
-            f"⏱ {track['duration']}",
+            f"{track_line}",
             parse_mode="HTML"
         )
         
         # Скачиваем трек
+        stage = 'download'
         downloader = YouTubeDownloader()
-        audio_data = await downloader.download_track(track['url'])
+        with STAGE_SECONDS.time(stage='download'), span('download'):
+            audio_data = await downloader.download_track(track['url'], track_duration(track))
         
         if not audio_data:
             logger.error(f"Не удалось скачать трек: '{track['title']}' ({track['url']})")
-            await callback.message.edit_text(
+            ERRORS.inc(stage='download', error='DownloadFailed')
+            mark_error('DownloadFailed')
+            await message.edit_text(
                 "❌ Не удалось скачать трек\n\n"
                 "Возможно, ссылка устарела. Попробуй выполнить новый поиск."
             )
-            await state.clear()
-            return
+            return False
         
         file_size_mb = len(audio_data) / 1024 / 1024
         logger.info(f"Трек скачан успешно: '{track['title']}', размер: {file_size_mb:.2f} МБ")
         
+        # Приводим аудио к формату и размеру, которые принимает Telegram
+        stage = 'transcode'
+        with STAGE_SECONDS.time(stage='transcode'), span('transcode') as transcode_span:
+            processed = await media_processor.process(audio_data, track.get('duration_seconds'))
+            transcode_span['mode'] = processed.mode if processed else None
+        
+        if not processed:
+            logger.warning(f"Трек не удалось уложить в лимит Telegram: '{track['title']}'")
+            ERRORS.inc(stage='transcode', error='TooLarge')
+            mark_error('TooLarge')
+            await message.edit_text(TOO_LARGE_TEXT, parse_mode="HTML")
+            return False
+        
+        logger.info(f"Аудио обработано ({processed.mode}): {processed.ext}, {len(processed.data) / 1024 / 1024:.2f} МБ")
+        
         # Обновляем прогресс - 75%
         await progress_msg.edit_text(
             f"🟦🟦🟦🟦🟦🟦🟦⬜⬜⬜ 75%\n"
             f"📤 <b>Отправка...</b>\n\n"
-            f"🎵 {track['title']}\n"
-            f"⏱ {track['duration']}",
+            f"{track_line}",
             parse_mode="HTML"
         )
         
         # Отправляем аудио файл
         audio_file = BufferedInputFile(
-            file=audio_data,
-            filename=f"{track['artist']} - {track['title']}.mp3"
+            file=processed.data,
+            filename=f"{track['artist']} - {track['title']}.{processed.ext}"
         )
         
-        # Форматируем название трека красиво
-        # Добавляем эмодзи и форматирование
-        formatted_title = f"♫ {track['title']}"
+        # Загружаем обложку
+        with span('thumbnail'):
+            thumbnail = thumbnail_file()
         
-        # Добавляем название бота к исполнителю с красивым форматированием
-        performer_with_bot = f"{track['artist']} ✦ @DownloaderSSMusicBot"
+        stage = 'upload'
+        with STAGE_SECONDS.time(stage='upload'), span('answer_audio', bytes=len(processed.data)):
+            sent = await message.answer_audio(
+                audio=audio_file,
+                thumbnail=thumbnail,
+                caption=audio_caption(track),
+                parse_mode="HTML",
+                **audio_tags(track)
+            )
+        download_jobs.mark_sent(job_id)
+        UPLOADED_BYTES.inc(len(processed.data))
         
-        # Загружаем обложку
-        thumbnail_path = os.path.join(os.path.dirname(__file__), 'thumbnail.jpg')
-        if os.path.exists(thumbnail_path):
-            with open(thumbnail_path, 'rb') as thumb_file:
-                thumbnail = BufferedInputFile(thumb_file.read(), filename='thumbnail.jpg')
-        else:
-            thumbnail = None
-        
-        await callback.message.answer_audio(
-            audio=audio_file,
-            title=formatted_title,
-            performer=performer_with_bot,
-            thumbnail=thumbnail,
-            caption=f"🎵 <b>{track['title']}</b>\n"
-                   f"👤 <i>{track['artist']}</i>\n"
-                   f"⏱ {track['duration']}\n\n"
-                   f"📥 Downloaded by @DownloaderSSMusicBot",
-            parse_mode="HTML"
-        )
+        # Запоминаем file_id для повторных отправок и inline-режима
+        if sent.audio:
+            file_id_cache.put(track, sent.audio.file_id)
+            local_index.record(track, sent.audio.file_id)
         
         # Удаляем сообщение с прогресс баром
         await progress_msg.delete()
         
-        logger.info(f"Трек успешно отправлен пользователю {callback.from_user.id}: '{track['title']}'")
-        
-        await state.clear()
+        logger.info(f"Трек успешно отправлен пользователю {user_id}: '{track['title']}'")
+        return True
         
     except Exception as e:
         logger.error(f"Ошибка при скачивании/отправке трека: {e}", exc_info=True)
+        ERRORS.inc(stage=stage, error=e.__class__.__name__)
+        mark_error(e.__class__.__name__)
         
         # Проверяем, не слишком ли большой файл
         error_msg = str(e)
         if "Request Entity Too Large" in error_msg or "too large" in error_msg.lower():
             logger.warning(f"Файл слишком большой для Telegram: '{track['title']}'")
-            await callback.message.edit_text(
-                "❌ <b>Файл слишком большой!</b>\n\n"
-                "📦 Размер файла превышает лимит Telegram (50 МБ)\n\n"
-                "💡 <b>Попробуй:</b>\n"
-                "• Выбрать другую версию трека\n"
-                "• Найти короткую версию песни",
+            await message.edit_text(TOO_LARGE_TEXT, parse_mode="HTML")
+        elif isinstance(e, MediaProcessingError):
+            await message.edit_text(
+                "❌ <b>Не удалось обработать аудио</b>\n\n"
+                "Попробуй выбрать другую версию трека",
                 parse_mode="HTML"
             )
         else:
-            await callback.message.edit_text(
+            await message.edit_text(
                 "❌ <b>Произошла ошибка</b>\n\n"
                 "Попробуй выбрать другой трек\n"
                 "или выполни новый поиск",
                 parse_mode="HTML"
             )
-        await state.clear()
+        return False
+
+
+@dataclass
+class BatchItem:
+    """Трек пакета: file_id или загружаемый файл, либо причина неудачи"""
+    track: dict
+    audio: Union[str, BufferedInputFile, None] = None
+    size: int = 0
+    error: Optional[str] = None
+    
+    @property
+    def uploading(self) -> bool:
+        return isinstance(self.audio, BufferedInputFile)
+    
+    def send_fields(self) -> dict:
+        fields = {'caption': audio_caption(self.track), 'parse_mode': "HTML"}
+        if self.uploading:
+            # Уже загруженный файл отправляется со своими тегами
+            fields.update(audio_tags(self.track), thumbnail=thumbnail_file())
+        return fields
+
+
+async def prepare_batch_item(
+    track: dict,
+    semaphore: asyncio.Semaphore,
+    charge: Callable[[], Awaitable[None]]
+) -> BatchItem:
+    """Находит file_id трека или скачивает и обрабатывает его"""
+    file_id = file_id_cache.get(track)
+    if file_id:
+        return BatchItem(track, audio=file_id)
+    if track.get('unsendable'):
+        return BatchItem(track, error="больше 50 МБ")
+    
+    # Каждое скачивание пакета расходует лимит пользователя, как отдельное нажатие
+    await charge()
+    async with semaphore:
+        stage = 'download'
+        try:
+            with STAGE_SECONDS.time(stage='download'), span('download'):
+                audio_data = await YouTubeDownloader().download_track(track['url'], track_duration(track))
+            if not audio_data:
+                ERRORS.inc(stage='download', error='DownloadFailed')
+                return BatchItem(track, error="не удалось скачать")
+            
+            stage = 'transcode'
+            with STAGE_SECONDS.time(stage='transcode'), span('transcode'):
+                processed = await media_processor.process(audio_data, track.get('duration_seconds'))
+        except Exception as e:
+            logger.error(f"Ошибка подготовки трека '{track['title']}' для пакета: {e}", exc_info=True)
+            ERRORS.inc(stage=stage, error=e.__class__.__name__)
+            if isinstance(e, MediaProcessingError):
+                return BatchItem(track, error="ошибка обработки аудио")
+            return BatchItem(track, error="ошибка скачивания")
+    
+    if not processed:
+        ERRORS.inc(stage='transcode', error='TooLarge')
+        return BatchItem(track, error="больше 50 МБ")
+    
+    audio_file = BufferedInputFile(
+        file=processed.data,
+        filename=f"{track['artist']} - {track['title']}.{processed.ext}"
+    )
+    return BatchItem(track, audio=audio_file, size=len(processed.data))
+
+
+async def send_batch_group(message: Message, items: List[BatchItem]) -> List[BatchItem]:
+    """
+    Отправляет до 10 треков одной media group
+    
+    Если Telegram отклонил группу, треки отправляются по одному, чтобы
+    один неудачный файл не потерял остальные.
+    
+    Returns:
+        Треки, которые отправить не удалось
+    """
+    try:
+        with STAGE_SECONDS.time(stage='upload'), span('send_media_group', items=len(items)):
+            if len(items) == 1:
+                sent = [await message.answer_audio(audio=items[0].audio, **items[0].send_fields())]
+            else:
+                sent = await message.bot.send_media_group(
+                    message.chat.id,
+                    media=[InputMediaAudio(media=item.audio, **item.send_fields()) for item in items]
+                )
+    except Exception as e:
+        ERRORS.inc(stage='upload', error=e.__class__.__name__)
+        if len(items) > 1:
+            logger.warning(f"Telegram не принял группу из {len(items)} треков ({e}), отправляем по одному")
+            failed = []
+            for item in items:
+                failed.extend(await send_batch_group(message, [item]))
+            return failed
+        
+        item = items[0]
+        logger.warning(f"Не удалось отправить '{item.track['title']}' в пакете: {e}")
+        if not item.uploading:
+            # Сохранённый file_id больше не действителен
+            file_id_cache.invalidate(item.track)
+        item.error = "Telegram не принял файл"
+        return [item]
+    
+    for item, sent_message in zip(items, sent):
+        UPLOADED_BYTES.inc(item.size)
+        if item.uploading and sent_message.audio:
+            file_id_cache.put(item.track, sent_message.audio.file_id)
+            local_index.record(item.track, sent_message.audio.file_id)
+    return []
+
+
+def batch_report(total: int, sent: int, failed: List[BatchItem]) -> str:
+    text = f"✅ <b>Отправлено {sent} из {total} треков</b>"
+    if failed:
+        lines = [f"• {html.escape(item.track['title'])} - {item.error}" for item in failed[:10]]
+        if len(failed) > 10:
+            lines.append(f"• ...и ещё {len(failed) - 10}")
+        text += "\n\n❌ <b>Не удалось отправить:</b>\n" + "\n".join(lines)
+    return text
+
+
+async def deliver_batch(
+    message: Message,
+    tracks: list,
+    user_id: int,
+    status: Optional[Message] = None,
+    prepaid: int = 0
+) -> int:
+    """
+    Скачивает несколько треков и отправляет их альбомами по 10
+    
+    Скачивается не больше BATCH_PARALLEL треков одновременно, а в памяти
+    держится не больше одной группы сверх этого. Треки отправляются в
+    исходном порядке; неудачные не прерывают пакет, а перечисляются в итоговом
+    сообщении.
+    
+    Каждый скачиваемый трек (без file_id) забирает токен из лимита скачиваний
+    пользователя; когда токены кончаются, пакет ждёт их, а не отклоняется.
+    prepaid - сколько токенов уже списал middleware за само нажатие.
+    
+    Returns:
+        Число отправленных треков
+    """
+    total = len(tracks)
+    progress_text = f"📥 <b>Скачиваю {total} треков...</b>"
+    if status is None:
+        status = await message.answer(progress_text, parse_mode="HTML")
+    else:
+        await status.edit_text(progress_text, parse_mode="HTML")
+    logger.info(f"Пакет из {total} треков для пользователя {user_id}")
+    
+    started = time.perf_counter()
+    semaphore = asyncio.Semaphore(BATCH_PARALLEL)
+    window = BATCH_PARALLEL + MEDIA_GROUP_SIZE
+    
+    async def charge():
+        nonlocal prepaid
+        if prepaid:
+            prepaid -= 1
+            return
+        await rate_limiter.limiters[DOWNLOAD].acquire(user_id)
+    
+    pending = deque()
+    next_idx = 0
+    group: List[BatchItem] = []
+    failed: List[BatchItem] = []
+    sent = 0
+    
+    try:
+        with IN_FLIGHT.track_inprogress(kind='batch'):
+            while pending or next_idx < total:
+                while next_idx < total and len(pending) < window:
+                    pending.append(asyncio.create_task(prepare_batch_item(tracks[next_idx], semaphore, charge)))
+                    next_idx += 1
+                
+                item = await pending.popleft()
+                if item.error:
+                    failed.append(item)
+                else:
+                    group.append(item)
+                
+                finished = not pending and next_idx >= total
+                if group and (len(group) == MEDIA_GROUP_SIZE or finished):
+                    group_failed = await send_batch_group(message, group)
+                    sent += len(group) - len(group_failed)
+                    failed.extend(group_failed)
+                    group = []
+                    
+                    if not finished:
+                        await status.edit_text(
+                            f"📥 <b>Скачиваю {total} треков...</b>\n📤 Отправлено: {sent}",
+                            parse_mode="HTML"
+                        )
+    finally:
+        for task in pending:
+            task.cancel()
+    
+    STAGE_SECONDS.observe(time.perf_counter() - started, stage='batch')
+    logger.info(f"Пакет для пользователя {user_id}: отправлено {sent} из {total}")
+    await status.edit_text(batch_report(total, sent, failed), parse_mode="HTML")
+    return sent
+
+
+async def resume_download_jobs(job_filter=None):
+    """
+    Возобновляет скачивания, прерванные перезапуском бота, или сообщает о них
+    
+    Args:
+        job_filter: какие задания брать (воркер supervisor.py берёт только чаты своей доли)
+    """
+    download_jobs.prune()
+    resumed = []
+    
+    for job in download_jobs.unfinished():
+        if job_filter and not job_filter(job):
+            continue
+        if job.state == download_jobs.SENT:
+            await finish_sent_job(bot, job)
+        elif download_jobs.can_resume(job):
+            logger.info(f"Возобновляем задание {job.id}: '{job.track.get('title')}' для пользователя {job.user_id}")
+            resumed.append(resume_job(job))
+        else:
+            logger.warning(f"Задание {job.id} прервано перезапуском: '{job.track.get('title')}'")
+            await report_interrupted(bot, job)
+    
+    await asyncio.gather(*resumed)
+
+
+async def resume_job(job):
+    try:
+        await deliver_track(job.message(bot), job.track, job.user_id)
+    except Exception as e:
+        # Сообщение с прогрессом могло быть удалено - отправить некуда
+        logger.error(f"Не удалось возобновить задание {job.id}: {e}")
+        download_jobs.fail(job.id, str(e))
+
+
+def track_from_video_id(video_id: str) -> dict:
+    """Трек для ссылки вида /start dl_<id>: метаданные берём из кэша file_id, если есть"""
+    known = file_id_cache.get_by_key(f"youtube:{video_id}") or {}
+    return {
+        'title': known.get('title') or f"YouTube {video_id}",
+        'artist': known.get('artist') or "Неизвестный исполнитель",
+        'duration': known.get('duration') or "N/A",
+        'url': f"https://youtube.com/watch?v={video_id}",
+        'video_id': video_id,
+        'source': 'youtube',
+    }
+
+
+def encode_start_query(query: str) -> Optional[str]:
+    """Параметр /start для поиска (не длиннее 64 символов) или None"""
+    encoded = base64.urlsafe_b64encode(query.encode('utf-8')).decode('ascii').rstrip('=')
+    payload = f"q_{encoded}"
+    return payload if len(payload) <= 64 else None
+
+
+def decode_start_query(encoded: str) -> Optional[str]:
+    try:
+        padded = encoded + '=' * (-len(encoded) % 4)
+        return base64.urlsafe_b64decode(padded).decode('utf-8').strip() or None
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+@dp.inline_query()
+async def inline_search(inline_query: InlineQuery):
+    """
+    Inline-режим: @DownloaderSSMusicBot запрос
+    
+    Отвечает только из кэшей, чтобы уложиться в дедлайн Telegram: треки с
+    известным file_id отправляются сразу, остальные - ссылкой в бота.
+    """
+    query = inline_query.query.strip()
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    
+    if not query:
+        await inline_query.answer([], cache_time=INLINE_CACHE_TIME)
+        return
+    
+    tracks = YouTubeDownloader().peek_search(query, limit=SEARCH_LIMIT)
+    
+    if tracks is None:
+        # В кэше ничего нет - предлагаем выполнить поиск в самом боте
+        await inline_query.answer(
+            [],
+            cache_time=INLINE_CACHE_TIME,
+            is_personal=False,
+            button=InlineQueryResultsButton(
+                text="🔍 Найти в боте",
+                start_parameter=encode_start_query(query) or "inline"
+            )
+        )
+        return
+    
+    tracks = dedupe_tracks(tracks)
+    page_tracks = tracks[offset:offset + INLINE_PAGE_SIZE]
+    bot_username = (await inline_query.bot.me()).username
+    
+    results = []
+    for track in page_tracks:
+        # canonical_id не уникален: одноимённые версии разной длины не схлопываются
+        result_id = track['video_id']
+        file_id = file_id_cache.get(track)
+        
+        if file_id:
+            results.append(InlineQueryResultCachedAudio(
+                id=result_id,
+                audio_file_id=file_id,
+                caption=audio_caption(track),
+                parse_mode="HTML"
+            ))
+        else:
+            deep_link = f"https://t.me/{bot_username}?start=dl_{track['video_id']}"
+            results.append(InlineQueryResultArticle(
+                id=result_id,
+                title=track['title'],
+                description=f"👤 {track['artist']} • ⏱ {track['duration']}",
+                input_message_content=InputTextMessageContent(
+                    message_text=f"🎵 <b>{html.escape(track['title'])}</b>\n👤 <i>{html.escape(track['artist'])}</i>",
+                    parse_mode="HTML"
+                ),
+                reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
+                    InlineKeyboardButton(text="📥 Скачать в боте", url=deep_link)
+                ]])
+            ))
+    
+    next_offset = str(offset + INLINE_PAGE_SIZE) if offset + INLINE_PAGE_SIZE < len(tracks) else ""
+    
+    await inline_query.answer(
+        results,
+        cache_time=INLINE_CACHE_TIME,
+        is_personal=False,
+        next_offset=next_offset
+    )
 
 
 # HTTP endpoint для пинга (чтобы бот не засыпал на хостинге)
@@ -541,11 +1193,28 @@ async def health_check(request):
     return web.Response(text="Bot is alive! 🎵", status=200)
 
 
+async def health_endpoint(request):
+    """Состояние бота и источников из кэша мониторинга"""
+    return web.json_response({
+        'status': 'alive',
+        'sources': health_monitor.snapshot(),
+        'startup': startup_timer.snapshot(),
+        'loop': loop_monitor.snapshot(),
+        'timestamp': datetime.now().isoformat()
+    })
+
+
+async def metrics_endpoint(request):
+    """Метрики в формате Prometheus"""
+    return web.Response(body=metrics.render().encode('utf-8'), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
 async def start_web_server():
     """Запуск веб-сервера для keep-alive пингов"""
     app = web.Application()
     app.router.add_get('/', health_check)
-    app.router.add_get('/health', health_check)
+    app.router.add_get('/health', health_endpoint)
+    app.router.add_get('/metrics', metrics_endpoint)
     
     # Порт из переменной окружения или 8080 по умолчанию
     port = int(os.getenv('PORT', 8080))
@@ -563,18 +1232,42 @@ async def main():
     """Главная функция запуска бота"""
     logger.info("🚀 Запуск бота...")
     
+    web_runner = None
+    background = []
+    
     try:
+        # Задержка цикла событий и блокирующие вызовы - для /health и /metrics
+        loop_monitor.start()
+        
         # Запускаем HTTP сервер для пингов
         web_runner = await start_web_server()
+        startup_timer.mark('web server')
+        
+        # Общий пул HTTP-соединений для парсеров
+        await start_http_pool()
         
         # Удаляем старые обновления
         await bot.delete_webhook(drop_pending_updates=True)
+        startup_timer.mark('delete webhook')
+        
+        # Скачивания, прерванные прошлым перезапуском
+        background.append(asyncio.create_task(resume_download_jobs()))
+        
+        # yt-dlp и bs4 загружаются в фоне, затем стартует проверка источников для /status и /health
+        background.append(asyncio.create_task(warm_up_and_monitor()))
+        
+        startup_timer.report()
         
         # Запускаем polling
         await dp.start_polling(bot)
         
     finally:
+        for task in background:
+            task.cancel()
+        await health_monitor.stop()
+        await loop_monitor.stop()
         await bot.session.close()
+        await close_http_pool()
         if web_runner:
             await web_runner.cleanup()
 
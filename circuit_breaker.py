@@ -0,0 +1,140 @@
+"""
+Автоматические выключатели (circuit breaker) для источников музыки
+"""
+import os
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Выключатель для одного источника.
+
+    closed    - запросы идут как обычно, ошибки считаются в скользящем окне;
+    open      - после N ошибок за окно источник пропускается до конца паузы;
+    half_open - после паузы пропускается один пробный запрос: успех
+                закрывает выключатель, ошибка открывает его снова.
+                Успех любого запроса после паузы тоже закрывает его -
+                источник уже ответил; успехи во время паузы игнорируются.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = None, window: float = None, cooldown: float = None):
+        self.name = name
+        self.failure_threshold = failure_threshold or int(os.getenv('BREAKER_FAILURES', 3))
+        self.window = window or float(os.getenv('BREAKER_WINDOW', 120))
+        self.cooldown = cooldown or float(os.getenv('BREAKER_COOLDOWN', 60))
+
+        self._state = self.CLOSED
+        self._failures = deque()
+        self._opened_at = 0.0
+        self._probe_started_at = 0.0
+        self._lock = threading.Lock()
+
+        # Метрики
+        self.rejected = 0
+        self.opened_count = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def is_open(self) -> bool:
+        """Источник сейчас нужно пропускать (без побочных эффектов)"""
+        with self._lock:
+            if self._state == self.OPEN:
+                return time.monotonic() - self._opened_at < self.cooldown
+            if self._state == self.HALF_OPEN:
+                # Пробный запрос уже выполняется
+                return time.monotonic() - self._probe_started_at < self.cooldown
+            return False
+
+    def allow_request(self) -> bool:
+        """Можно ли выполнить запрос; в half_open пропускает ровно один пробный"""
+        with self._lock:
+            now = time.monotonic()
+
+            if self._state == self.CLOSED:
+                return True
+
+            if self._state == self.OPEN and now - self._opened_at >= self.cooldown:
+                self._state = self.HALF_OPEN
+                self._probe_started_at = now
+                logger.info(f"Источник {self.name}: пробный запрос после паузы")
+                return True
+
+            # Пробный запрос завис - разрешаем ещё один
+            if self._state == self.HALF_OPEN and now - self._probe_started_at >= self.cooldown:
+                self._probe_started_at = now
+                return True
+
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state == self.OPEN:
+                # Запоздавший ответ запроса, начатого до отключения:
+                # пауза не прошла, выключатель остаётся открытым
+                return
+            if self._state == self.HALF_OPEN:
+                logger.info(f"Источник {self.name} снова доступен")
+            self._state = self.CLOSED
+            self._failures.clear()
+
+    def record_failure(self):
+        with self._lock:
+            now = time.monotonic()
+
+            if self._state == self.HALF_OPEN:
+                self._open(now)
+                return
+
+            self._failures.append(now)
+            while self._failures and now - self._failures[0] > self.window:
+                self._failures.popleft()
+
+            if self._state == self.CLOSED and len(self._failures) >= self.failure_threshold:
+                self._open(now)
+
+    def _open(self, now: float):
+        self._state = self.OPEN
+        self._opened_at = now
+        self._failures.clear()
+        self.opened_count += 1
+        logger.warning(f"Источник {self.name} отключён на {self.cooldown:.0f} сек после серии ошибок")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'state': self._state,
+                'recent_failures': len(self._failures),
+                'rejected': self.rejected,
+                'opened_count': self.opened_count,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(source: str) -> CircuitBreaker:
+    """Общий выключатель источника на весь процесс"""
+    with _registry_lock:
+        if source not in _breakers:
+            _breakers[source] = CircuitBreaker(source)
+        return _breakers[source]
+
+
+def all_breakers() -> Dict[str, CircuitBreaker]:
+    with _registry_lock:
+        return dict(_breakers)
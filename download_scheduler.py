@@ -0,0 +1,115 @@
+"""
+Очередь скачиваний с приоритетом коротких треков (shortest job first) и старением
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional, Tuple
+
+from media_processor import SOURCE_BITRATE, estimate_size
+from metrics import STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Длительность, если она неизвестна (сек) - типичная песня
+DEFAULT_DURATION = 240
+
+
+class DownloadScheduler:
+    """
+    Ограничивает число одновременных скачиваний; ожидающие получают слот
+    в порядке ожидаемой стоимости, а не прихода.
+
+    Стоимость - ожидаемый размер скачивания: длительность × битрейт (МБ).
+    Чтобы длинные треки не ждали бесконечно, за каждую секунду ожидания
+    стоимость уменьшается на aging МБ. Все ожидающие стареют одинаково,
+    поэтому порядок задаётся постоянным ключом cost + aging × время постановки.
+    """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        bitrate_kbps: Optional[float] = None,
+        aging: Optional[float] = None
+    ):
+        self.max_workers = max_workers or int(os.getenv('DOWNLOAD_WORKERS', 4))
+        self.bitrate_kbps = bitrate_kbps or SOURCE_BITRATE
+        self.aging = aging or float(os.getenv('DOWNLOAD_AGING', 1.0))
+
+        self._waiting: List[Tuple[float, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+
+        # Метрики очереди
+        self.active = 0
+        self.completed = 0
+        self.total_wait_time = 0.0
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for _, _, future in self._waiting if not future.done())
+
+    def expected_cost(self, duration_seconds: Optional[float]) -> float:
+        """Ожидаемый размер скачивания в МБ"""
+        return estimate_size(duration_seconds or DEFAULT_DURATION, self.bitrate_kbps) / 1024 / 1024
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.max_workers,
+            'queued': self.queued,
+            'active': self.active,
+            'completed': self.completed,
+            'avg_wait': self.total_wait_time / self.completed if self.completed else 0.0,
+        }
+
+    async def acquire(self, duration_seconds: Optional[float] = None):
+        if self.active < self.max_workers and not self.queued:
+            self.active += 1
+            return
+
+        cost = self.expected_cost(duration_seconds)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (cost + self.aging * time.monotonic(), next(self._counter), future))
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Слот уже передан этому ожидающему - отдаём следующему
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        """Передаёт слот самому дешёвому ожидающему или освобождает его"""
+        while self._waiting:
+            _, _, future = heapq.heappop(self._waiting)
+            if not future.done():
+                # active не меняется: слот переходит к следующему
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, duration_seconds: Optional[float] = None):
+        """Слот для одного скачивания; ждёт, пока подойдёт очередь трека"""
+        queued_at = time.monotonic()
+        await self.acquire(duration_seconds)
+
+        waited = time.monotonic() - queued_at
+        self.total_wait_time += waited
+        STAGE_SECONDS.observe(waited, stage='download_queue')
+        if waited > 1:
+            logger.info(f"Скачивание ждало в очереди {waited:.1f} сек (длительность {duration_seconds or '?'} сек)")
+
+        try:
+            yield
+        finally:
+            self.completed += 1
+            self.release()
+
+
+# Общая очередь скачиваний на процесс
+download_scheduler = DownloadScheduler()
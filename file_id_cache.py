@@ -0,0 +1,138 @@
+"""
+Кэш Telegram file_id уже отправленных треков
+"""
+import os
+import logging
+import sqlite3
+import time
+from typing import Dict, Optional
+
+from track_dedup import parse_duration, same_duration, track_duration
+from youtube_downloader import YouTubeDownloader
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.getenv('BOT_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot_data.db'))
+
+# Сколько ждать, пока другой процесс пишет в базу (сек)
+DB_BUSY_TIMEOUT = float(os.getenv('BOT_DB_BUSY_TIMEOUT', 5))
+
+
+def connect_db(path: str = DB_PATH) -> sqlite3.Connection:
+    """
+    Соединение с базой бота.
+
+    При запуске через supervisor.py в базу пишут все воркеры: в режиме WAL
+    чтение не ждёт записи, а занятая база ожидается до DB_BUSY_TIMEOUT
+    вместо ошибки 'database is locked'.
+    """
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=DB_BUSY_TIMEOUT)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
+
+
+def track_key(track: Dict) -> str:
+    """Ключ трека внутри источника: для YouTube - ID видео, для остальных - ссылка"""
+    source = track.get('source', 'youtube')
+    if source == 'youtube':
+        return f"youtube:{track.get('video_id') or YouTubeDownloader.extract_video_id(track['url'])}"
+    return f"{source}:{track.get('url') or track.get('track_url')}"
+
+
+class FileIdCache:
+    """
+    Соответствие трека и file_id загруженного в Telegram аудио.
+
+    Повторная отправка по file_id не требует ни скачивания, ни загрузки файла.
+    Поиск идёт по ключу трека, а затем по canonical_id, чтобы копия того же
+    трека из другого источника тоже находилась.
+    """
+
+    def __init__(self, path: str = DB_PATH):
+        self.path = path
+        self._conn = connect_db(path)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS file_ids (
+                track_key TEXT PRIMARY KEY,
+                canonical_id TEXT,
+                file_id TEXT NOT NULL,
+                title TEXT,
+                artist TEXT,
+                duration TEXT,
+                updated_at REAL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_file_ids_canonical ON file_ids (canonical_id)')
+        self._conn.commit()
+
+        # Метрики
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, track: Dict) -> Optional[str]:
+        """file_id для трека или None"""
+        row = self._conn.execute(
+            'SELECT file_id FROM file_ids WHERE track_key = ?', (track_key(track),)
+        ).fetchone()
+
+        if row is None:
+            row = next(self._same_canonical(track), None)
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return row['file_id']
+
+    def _same_canonical(self, track: Dict):
+        """Записи копий того же трека: тот же canonical_id и известная длительность в пределах допуска"""
+        seconds = track_duration(track)
+        if not track.get('canonical_id') or not seconds:
+            return
+        rows = self._conn.execute(
+            'SELECT track_key, file_id, duration FROM file_ids WHERE canonical_id = ? ORDER BY updated_at DESC',
+            (track['canonical_id'],)
+        )
+        for row in rows:
+            if same_duration(seconds, parse_duration(row['duration']), strict=True):
+                yield row
+
+    def get_by_key(self, key: str) -> Optional[dict]:
+        """Запись по ключу трека (вместе с метаданными)"""
+        row = self._conn.execute('SELECT * FROM file_ids WHERE track_key = ?', (key,)).fetchone()
+        return dict(row) if row else None
+
+    def put(self, track: Dict, file_id: str):
+        self._conn.execute(
+            '''
+            INSERT INTO file_ids (track_key, canonical_id, file_id, title, artist, duration, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(track_key) DO UPDATE SET
+                canonical_id = excluded.canonical_id,
+                file_id = excluded.file_id,
+                title = excluded.title,
+                artist = excluded.artist,
+                duration = excluded.duration,
+                updated_at = excluded.updated_at
+            ''',
+            (
+                track_key(track), track.get('canonical_id'), file_id,
+                track.get('title'), track.get('artist'), track.get('duration'), time.time()
+            )
+        )
+        self._conn.commit()
+
+    def invalidate(self, track: Dict):
+        """Удаляет file_id, который Telegram больше не принимает"""
+        keys = [(track_key(track),)] + [(row['track_key'],) for row in self._same_canonical(track)]
+        self._conn.executemany('DELETE FROM file_ids WHERE track_key = ?', keys)
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+# Общий кэш на процесс
+file_id_cache = FileIdCache()
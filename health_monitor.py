@@ -0,0 +1,167 @@
+"""
+Фоновая проверка доступности источников музыки
+"""
+import asyncio
+import importlib.util
+import os
+import logging
+import time
+from collections import deque
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional
+
+import mp3wr_parser
+from circuit_breaker import get_breaker
+from mp3wr_parser import Mp3wrParser
+from youtube_downloader import YouTubeDownloader
+
+logger = logging.getLogger(__name__)
+
+PROBE_QUERY = "test"
+
+# Через сколько секунд после запуска polling прогревать yt-dlp и bs4
+WARMUP_DELAY = float(os.getenv('WARMUP_DELAY', 1))
+
+
+async def probe_youtube() -> bool:
+    # Мимо кэша поиска: иначе проверка почти всегда отвечала бы из кэша
+    tracks = await YouTubeDownloader().search(PROBE_QUERY, limit=1, use_cache=False)
+    return len(tracks) > 0
+
+
+async def probe_mp3wr() -> bool:
+    async with Mp3wrParser() as mp3wr:
+        tracks = await mp3wr.search(PROBE_QUERY, limit=1)
+    return len(tracks) > 0
+
+
+async def probe_sefon() -> bool:
+    from sefon_parser import SefonParser
+
+    async with SefonParser() as sefon:
+        tracks = await sefon.search(PROBE_QUERY, limit=1)
+    return len(tracks) > 0
+
+
+DEFAULT_PROBES = {
+    'youtube': probe_youtube,
+    'mp3wr': probe_mp3wr,
+}
+
+# Sefon проверяем, только если его парсер есть в сборке: иначе он всегда «недоступен»
+if importlib.util.find_spec('sefon_parser') is not None:
+    DEFAULT_PROBES['sefon'] = probe_sefon
+
+
+class SourceHealthMonitor:
+    """Периодически проверяет источники и хранит историю доступности и задержек"""
+
+    def __init__(
+        self,
+        probes: Optional[Dict[str, Callable[[], Awaitable[bool]]]] = None,
+        interval: Optional[float] = None,
+        timeout: Optional[float] = None,
+        history_size: Optional[int] = None
+    ):
+        self.probes = probes or DEFAULT_PROBES
+        self.interval = interval or float(os.getenv('HEALTH_CHECK_INTERVAL', 300))
+        self.timeout = timeout or float(os.getenv('HEALTH_CHECK_TIMEOUT', 30))
+        history_size = history_size or int(os.getenv('HEALTH_HISTORY', 20))
+
+        self._history = {source: deque(maxlen=history_size) for source in self.probes}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Запускает фоновые проверки"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"🩺 Мониторинг источников запущен (каждые {self.interval:.0f} сек)")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.check_all()
+            except Exception as e:
+                logger.error(f"Ошибка мониторинга источников: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def check_all(self):
+        """Проверяет все источники параллельно"""
+        await asyncio.gather(*(self._check(source, probe) for source, probe in self.probes.items()))
+
+    async def _check(self, source: str, probe: Callable[[], Awaitable[bool]]):
+        started = time.monotonic()
+        error = None
+        try:
+            available = await asyncio.wait_for(probe(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            available = False
+            error = f"таймаут {self.timeout:.0f} сек"
+        except Exception as e:
+            available = False
+            error = str(e) or e.__class__.__name__
+
+        latency = time.monotonic() - started
+        self._history[source].append({
+            'available': available,
+            'latency_ms': round(latency * 1000),
+            'checked_at': datetime.now().isoformat(timespec='seconds'),
+            'error': error,
+        })
+
+        if available:
+            logger.debug(f"Источник {source} доступен ({latency:.2f} сек)")
+        else:
+            logger.warning(f"Источник {source} недоступен: {error or 'пустой ответ'}")
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Последнее известное состояние источников (без сетевых запросов)"""
+        result = {}
+        for source, history in self._history.items():
+            last = history[-1] if history else None
+            checks = len(history)
+            result[source] = {
+                'available': last['available'] if last else None,
+                'latency_ms': last['latency_ms'] if last else None,
+                'checked_at': last['checked_at'] if last else None,
+                'error': last['error'] if last else None,
+                'uptime': sum(1 for item in history if item['available']) / checks if checks else None,
+                'breaker': get_breaker(source).state,
+                'history': list(history),
+            }
+        return result
+
+
+# Общий монитор на процесс
+health_monitor = SourceHealthMonitor()
+
+
+async def warm_up_and_monitor(delay: float = WARMUP_DELAY):
+    """
+    Фоновый прогрев после запуска бота, затем проверки источников.
+
+    yt-dlp и bs4 импортируются лениво, чтобы бот начал отвечать сразу после
+    запуска; здесь они загружаются заранее, до первого поиска. Первая
+    проверка источников тоже ждёт прогрева, а не конкурирует с запуском.
+    """
+    await asyncio.sleep(delay)
+    loop = asyncio.get_running_loop()
+
+    started = time.perf_counter()
+    try:
+        await loop.run_in_executor(None, YouTubeDownloader.warm_up)
+        await loop.run_in_executor(None, mp3wr_parser.warm_up)
+        logger.info(f"⏱ Прогрев yt-dlp и bs4: {time.perf_counter() - started:.2f} сек")
+    except Exception as e:
+        logger.warning(f"Не удалось прогреть загрузчики: {e}")
+
+    health_monitor.start()
@@ -0,0 +1,55 @@
+"""
+Общий пул HTTP-соединений для парсеров музыкальных сайтов
+"""
+import os
+import logging
+from typing import Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
+}
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def create_session() -> aiohttp.ClientSession:
+    """Создаёт сессию с пулом соединений, keep-alive и кэшем DNS"""
+    connector = aiohttp.TCPConnector(
+        limit=int(os.getenv('HTTP_POOL_LIMIT', 50)),
+        limit_per_host=int(os.getenv('HTTP_POOL_LIMIT_PER_HOST', 8)),
+        ttl_dns_cache=int(os.getenv('HTTP_DNS_TTL', 300)),
+        keepalive_timeout=float(os.getenv('HTTP_KEEPALIVE', 30)),
+    )
+    timeout = aiohttp.ClientTimeout(total=None, connect=15, sock_read=60)
+    return aiohttp.ClientSession(connector=connector, headers=DEFAULT_HEADERS, timeout=timeout)
+
+
+async def start_http_pool() -> aiohttp.ClientSession:
+    """Создаёт общую сессию при запуске бота"""
+    global _session
+    if _session is None or _session.closed:
+        _session = create_session()
+        logger.info("🌐 Общий пул HTTP-соединений создан")
+    return _session
+
+
+def get_http_session() -> Optional[aiohttp.ClientSession]:
+    """Возвращает общую сессию, если пул запущен"""
+    if _session is not None and not _session.closed:
+        return _session
+    return None
+
+
+async def close_http_pool():
+    """Закрывает общую сессию при остановке бота"""
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+        logger.info("🌐 Общий пул HTTP-соединений закрыт")
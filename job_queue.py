@@ -0,0 +1,223 @@
+"""
+Очередь заданий на скачивание в SQLite: задания переживают перезапуск бота
+"""
+import json
+import os
+import logging
+import sqlite3
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.types import Chat, Message
+
+from file_id_cache import DB_PATH, connect_db, track_key
+
+logger = logging.getLogger(__name__)
+
+# Задания старше этого (сек) после перезапуска не возобновляются
+JOB_RESUME_MAX_AGE = float(os.getenv('JOB_RESUME_MAX_AGE', 900))
+# Сколько раз всего пытаться выполнить задание
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 2))
+# Сколько хранить завершённые задания (сек)
+JOB_RETENTION = 7 * 24 * 3600
+
+INTERRUPTED_TEXT = (
+    "❌ <b>Загрузка прервана</b>\n\n"
+    "Бот перезапускался во время скачивания.\n"
+    "Выполни поиск заново и выбери трек ещё раз."
+)
+
+
+@dataclass
+class DownloadJob:
+    id: int
+    chat_id: int
+    message_id: int
+    user_id: int
+    track: dict
+    state: str
+    attempts: int
+    created_at: float
+    updated_at: float
+
+    def message(self, bot: Bot) -> Message:
+        """Сообщение с прогрессом, к которому привязано задание"""
+        return Message(
+            message_id=self.message_id,
+            date=datetime.fromtimestamp(self.created_at),
+            chat=Chat(id=self.chat_id, type='private')
+        ).as_(bot)
+
+
+class DownloadJobQueue:
+    """
+    Задания на скачивание: чат, сообщение с прогрессом, трек и состояние.
+
+    Состояния: running -> sent -> done или running -> failed. sent ставится
+    сразу после того, как Telegram принял аудио, поэтому задание, прерванное
+    после отправки, не отправляется повторно. Переходы в done и failed
+    идемпотентны.
+    """
+
+    RUNNING = 'running'
+    SENT = 'sent'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, path: str = DB_PATH):
+        self.path = path
+        self._conn = connect_db(path)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS download_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_key TEXT NOT NULL UNIQUE,
+                chat_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                user_id INTEGER,
+                track TEXT NOT NULL,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                created_at REAL,
+                updated_at REAL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_download_jobs_state ON download_jobs (state)')
+        self._conn.commit()
+
+        # Задания, которые выполняет этот процесс
+        self._active = set()
+
+    @staticmethod
+    def _job(row: sqlite3.Row) -> DownloadJob:
+        return DownloadJob(
+            id=row['id'],
+            chat_id=row['chat_id'],
+            message_id=row['message_id'],
+            user_id=row['user_id'],
+            track=json.loads(row['track']),
+            state=row['state'],
+            attempts=row['attempts'],
+            created_at=row['created_at'],
+            updated_at=row['updated_at'],
+        )
+
+    def start(self, chat_id: int, message_id: int, user_id: int, track: Dict) -> Optional[DownloadJob]:
+        """
+        Регистрирует задание перед скачиванием.
+
+        Returns:
+            Задание или None, если этот трек в это сообщение уже отправлен
+            или отправляется прямо сейчас (повторное нажатие кнопки)
+        """
+        key = f"{chat_id}:{message_id}:{track_key(track)}"
+        now = time.time()
+
+        with self._conn:
+            row = self._conn.execute('SELECT * FROM download_jobs WHERE job_key = ?', (key,)).fetchone()
+            if row is not None:
+                if row['state'] in (self.SENT, self.DONE) or row['id'] in self._active:
+                    return None
+                self._conn.execute(
+                    'UPDATE download_jobs SET state = ?, attempts = attempts + 1, error = NULL, updated_at = ? WHERE id = ?',
+                    (self.RUNNING, now, row['id'])
+                )
+                job_id = row['id']
+            else:
+                job_id = self._conn.execute(
+                    '''
+                    INSERT INTO download_jobs (job_key, chat_id, message_id, user_id, track, state,
+                                               attempts, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?)
+                    ''',
+                    (key, chat_id, message_id, user_id, json.dumps(track, ensure_ascii=False), self.RUNNING, now, now)
+                ).lastrowid
+
+        self._active.add(job_id)
+        return self.get(job_id)
+
+    def get(self, job_id: int) -> Optional[DownloadJob]:
+        row = self._conn.execute('SELECT * FROM download_jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._job(row) if row else None
+
+    def _set_state(self, job_id: int, state: str, allowed_from: tuple, error: Optional[str] = None) -> bool:
+        placeholders = ','.join('?' * len(allowed_from))
+        with self._conn:
+            cursor = self._conn.execute(
+                f'UPDATE download_jobs SET state = ?, error = ?, updated_at = ? '
+                f'WHERE id = ? AND state IN ({placeholders})',
+                (state, error, time.time(), job_id, *allowed_from)
+            )
+        return cursor.rowcount > 0
+
+    def mark_sent(self, job_id: int) -> bool:
+        """Telegram принял аудио - повторно это задание не выполняется"""
+        return self._set_state(job_id, self.SENT, (self.RUNNING,))
+
+    def complete(self, job_id: int) -> bool:
+        """Завершает задание; повторный вызов ничего не меняет"""
+        self._active.discard(job_id)
+        return self._set_state(job_id, self.DONE, (self.RUNNING, self.SENT))
+
+    def fail(self, job_id: int, error: str) -> bool:
+        """Помечает задание неудачным, если оно ещё не завершено"""
+        self._active.discard(job_id)
+        return self._set_state(job_id, self.FAILED, (self.RUNNING,), error)
+
+    def unfinished(self) -> List[DownloadJob]:
+        """Задания, не завершённые прошлым запуском бота"""
+        rows = self._conn.execute(
+            'SELECT * FROM download_jobs WHERE state IN (?, ?) ORDER BY created_at',
+            (self.RUNNING, self.SENT)
+        ).fetchall()
+        return [self._job(row) for row in rows if row['id'] not in self._active]
+
+    def can_resume(self, job: DownloadJob) -> bool:
+        return job.attempts < JOB_MAX_ATTEMPTS and time.time() - job.created_at < JOB_RESUME_MAX_AGE
+
+    def prune(self, max_age: float = JOB_RETENTION) -> int:
+        with self._conn:
+            cursor = self._conn.execute(
+                'DELETE FROM download_jobs WHERE state IN (?, ?) AND updated_at < ?',
+                (self.DONE, self.FAILED, time.time() - max_age)
+            )
+        return cursor.rowcount
+
+    def close(self):
+        self._conn.close()
+
+
+# Общая очередь заданий на процесс
+download_jobs = DownloadJobQueue()
+
+
+async def finish_sent_job(bot: Bot, job: DownloadJob):
+    """Задание прервано уже после отправки аудио: осталось убрать прогресс-бар"""
+    download_jobs.complete(job.id)
+    try:
+        await job.message(bot).delete()
+    except Exception as e:
+        logger.debug(f"Не удалось удалить прогресс задания {job.id}: {e}")
+
+
+async def report_interrupted(bot: Bot, job: DownloadJob):
+    """Сообщает пользователю, что скачивание прервано, вместо зависшего прогресс-бара"""
+    download_jobs.fail(job.id, 'interrupted')
+    try:
+        await job.message(bot).edit_text(INTERRUPTED_TEXT, parse_mode="HTML")
+    except Exception as e:
+        logger.debug(f"Не удалось сообщить о прерванном задании {job.id}: {e}")
+
+
+async def report_interrupted_jobs(bot: Bot):
+    """Завершает все задания прошлого запуска без возобновления"""
+    download_jobs.prune()
+    for job in download_jobs.unfinished():
+        if job.state == DownloadJobQueue.SENT:
+            await finish_sent_job(bot, job)
+        else:
+            logger.warning(f"Задание {job.id} прервано перезапуском: '{job.track.get('title')}'")
+            await report_interrupted(bot, job)
@@ -9,6 +9,10 @@ import json
 from io import BytesIO
 from typing import Optional
 from datetime import datetime
+
+# Первым делом: замер времени импортов и запуска
+from startup_timing import first_update_middleware, startup_timer
+
 import aiohttp
 from aiohttp import web
 
@@ -19,14 +23,24 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
 
+startup_timer.mark('import aiogram')
+
 from youtube_downloader import YouTubeDownloader
+from media_processor import media_processor
+from http_pool import start_http_pool, close_http_pool
+from health_monitor import health_monitor, warm_up_and_monitor
+from loop_monitor import loop_monitor
+from rate_limit import RateLimitMiddleware
+from track_dedup import dedupe_tracks, track_duration
+import metrics
+from job_queue import download_jobs, report_interrupted_jobs
+from tracing import TracingMiddleware, span
+from logging_setup import setup_logging
+
+startup_timer.mark('import modules')
 
 # Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[logging.StreamHandler()]  # Только консоль для Koyeb
-)
+setup_logging(log_file=None)  # Только консоль для Koyeb
 logger = logging.getLogger(__name__)
 
 # Токен бота (замените на ваш)
@@ -48,6 +62,13 @@ session = AiohttpSession(
 bot = Bot(token=BOT_TOKEN, session=session)
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
+dp.update.outer_middleware(TracingMiddleware())
+dp.update.outer_middleware(first_update_middleware)
+
+# Лимиты на поиски и скачивания пользователя и отказ при перегрузке
+rate_limiter = RateLimitMiddleware()
+dp.message.outer_middleware(rate_limiter)
+dp.callback_query.outer_middleware(rate_limiter)
 
 # ID админа для доступа к статистике
 ADMIN_ID = 7850455999
@@ -179,7 +200,8 @@ async def cmd_search(message: Message, state: FSMContext):
 @dp.message(Command('cancel'))
 async def cmd_cancel(message: Message, state: FSMContext):
     """Обработчик команды /cancel"""
-    current_state = await state.get_state()
+    with span('fsm.get_state'):
+        current_state = await state.get_state()
     if current_state is None:
         await message.answer("❌ Нечего отменять")
         return
@@ -214,7 +236,7 @@ async def show_tracks_page(message: Message, tracks: list, page: int, state: FSM
         if len(title) > max_title_length:
             title = title[:max_title_length] + "..."
         
-        button_text = f"{global_idx + 1}. {title} • {duration}"
+        button_text = f"{global_idx + 1}. {track.get('note', '')}{title} • {duration}"
         
         keyboard.append([InlineKeyboardButton(
             text=button_text,
@@ -285,7 +307,7 @@ async def search_music(message: Message, state: FSMContext):
         
         # Поиск треков (увеличим лимит до 20)
         downloader = YouTubeDownloader()
-        tracks = await downloader.search(query, limit=20)
+        tracks = dedupe_tracks(await downloader.search(query, limit=20))
         
         logger.info(f"Найдено {len(tracks)} треков для запроса: '{query}'")
         
@@ -333,7 +355,8 @@ async def callback_page(callback: CallbackQuery, state: FSMContext):
     page = int(callback.data.split("_")[1])
     
     # Получаем треки из состояния
-    data = await state.get_data()
+    with span('fsm.get_data'):
+        data = await state.get_data()
     tracks = data.get('tracks', [])
     
     if not tracks:
@@ -352,13 +375,15 @@ async def callback_page(callback: CallbackQuery, state: FSMContext):
 async def callback_download(callback: CallbackQuery, state: FSMContext):
     """Обработчик скачивания выбранного трека"""
     await callback.answer("⏳ Скачиваю...")
+    job = None
     
     try:
         # Получаем индекс трека
         track_idx = int(callback.data.split("_")[1])
         
         # Получаем список треков из состояния
-        data = await state.get_data()
+        with span('fsm.get_data'):
+            data = await state.get_data()
         tracks = data.get('tracks', [])
         
         if track_idx >= len(tracks):
@@ -368,6 +393,12 @@ async def callback_download(callback: CallbackQuery, state: FSMContext):
         
         track = tracks[track_idx]
         
+        # Задание сохраняется, чтобы после перезапуска не оставлять зависший прогресс-бар
+        job = download_jobs.start(callback.message.chat.id, callback.message.message_id, callback.from_user.id, track)
+        if job is None:
+            logger.info(f"Трек '{track['title']}' уже отправлен или отправляется в чат {callback.message.chat.id}")
+            return
+        
         logger.info(f"Начало скачивания трека: '{track['title']}' ({track['url']}) для пользователя {callback.from_user.id}")
         
         # Прогресс бар при скачивании
@@ -391,10 +422,11 @@ async def callback_download(callback: CallbackQuery, state: FSMContext):
         
         # Скачиваем трек
         downloader = YouTubeDownloader()
-        audio_data = await downloader.download_track(track['url'])
+        audio_data = await downloader.download_track(track['url'], track_duration(track))
         
         if not audio_data:
             logger.error(f"Не удалось скачать трек: '{track['title']}' ({track['url']})")
+            download_jobs.fail(job.id, 'download failed')
             await callback.message.edit_text(
                 "❌ <b>YouTube недоступен</b>\n\n"
                 "🔍 YouTube блокирует запросы с серверов\n"
@@ -411,6 +443,25 @@ async def callback_download(callback: CallbackQuery, state: FSMContext):
         file_size_mb = len(audio_data) / 1024 / 1024
         logger.info(f"Трек скачан успешно: '{track['title']}', размер: {file_size_mb:.2f} МБ")
         
+        # Приводим аудио к формату и размеру, которые принимает Telegram
+        processed = await media_processor.process(audio_data, track.get('duration_seconds'))
+        
+        if not processed:
+            logger.warning(f"Трек не удалось уложить в лимит Telegram: '{track['title']}'")
+            download_jobs.fail(job.id, 'too large')
+            await callback.message.edit_text(
+                "❌ <b>Файл слишком большой!</b>\n\n"
+                "📦 Размер файла превышает лимит Telegram (50 МБ)\n\n"
+                "💡 <b>Попробуй:</b>\n"
+                "• Выбрать другую версию трека\n"
+                "• Найти короткую версию песни",
+                parse_mode="HTML"
+            )
+            await state.clear()
+            return
+        
+        logger.info(f"Аудио обработано ({processed.mode}): {processed.ext}, {len(processed.data) / 1024 / 1024:.2f} МБ")
+        
         # Обновляем прогресс - 75%
         await progress_msg.edit_text(
             f"🟦🟦🟦🟦🟦🟦🟦⬜⬜⬜ 75%\n"
@@ -422,8 +473,8 @@ async def callback_download(callback: CallbackQuery, state: FSMContext):
         
         # Отправляем аудио файл
         audio_file = BufferedInputFile(
-            file=audio_data,
-            filename=f"{track['artist']} - {track['title']}.mp3"
+            file=processed.data,
+            filename=f"{track['artist']} - {track['title']}.{processed.ext}"
         )
         
         # Форматируем название трека красиво
@@ -432,27 +483,31 @@ async def callback_download(callback: CallbackQuery, state: FSMContext):
         
         # Загружаем обложку
         thumbnail_path = os.path.join(os.path.dirname(__file__), 'thumbnail.jpg')
-        if os.path.exists(thumbnail_path):
-            with open(thumbnail_path, 'rb') as thumb_file:
-                thumbnail = BufferedInputFile(thumb_file.read(), filename='thumbnail.jpg')
-        else:
-            thumbnail = None
-        
-        await callback.message.answer_audio(
-            audio=audio_file,
-            title=formatted_title,
-            performer=performer_with_bot,
-            thumbnail=thumbnail,
-            caption=f"🎵 <b>{track['title']}</b>\n"
-                   f"👤 <i>{track['artist']}</i>\n"
-                   f"⏱ {track['duration']}\n\n"
-                   f"📥 Downloaded by @DownloaderSSMusicBot\n"
-                   f"🌐 Powered by Koyeb",
-            parse_mode="HTML"
-        )
+        with span('thumbnail'):
+            if os.path.exists(thumbnail_path):
+                with open(thumbnail_path, 'rb') as thumb_file:
+                    thumbnail = BufferedInputFile(thumb_file.read(), filename='thumbnail.jpg')
+            else:
+                thumbnail = None
+        
+        with span('answer_audio'):
+            await callback.message.answer_audio(
+                audio=audio_file,
+                title=formatted_title,
+                performer=performer_with_bot,
+                thumbnail=thumbnail,
+                caption=f"🎵 <b>{track['title']}</b>\n"
+                       f"👤 <i>{track['artist']}</i>\n"
+                       f"⏱ {track['duration']}\n\n"
+                       f"📥 Downloaded by @DownloaderSSMusicBot\n"
+                       f"🌐 Powered by Koyeb",
+                parse_mode="HTML"
+            )
+        download_jobs.mark_sent(job.id)
         
         # Удаляем сообщение с прогресс баром
         await progress_msg.delete()
+        download_jobs.complete(job.id)
         
         logger.info(f"Трек успешно отправлен пользователю {callback.from_user.id}: '{track['title']}'")
         
@@ -460,6 +515,9 @@ async def callback_download(callback: CallbackQuery, state: FSMContext):
         
     except Exception as e:
         logger.error(f"Ошибка при скачивании/отправке трека: {e}", exc_info=True)
+        # Ошибка после отправки аудио - задание всё равно выполнено
+        if job and not download_jobs.fail(job.id, str(e)):
+            download_jobs.complete(job.id)
         
         # Проверяем, не слишком ли большой файл
         error_msg = str(e)
@@ -498,10 +556,18 @@ async def stats_endpoint(request):
     return web.json_response({
         'status': 'alive',
         'users_count': len(users_stats['users']),
+        'sources': health_monitor.snapshot(),
+        'startup': startup_timer.snapshot(),
+        'loop': loop_monitor.snapshot(),
         'timestamp': datetime.now().isoformat()
     })
 
 
+async def metrics_endpoint(request):
+    """Метрики в формате Prometheus"""
+    return web.Response(body=metrics.render().encode('utf-8'), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
 # Keep-alive функция для предотвращения засыпания
 async def keep_alive():
     """Периодически пингует сам себя для предотвращения засыпания"""
@@ -520,6 +586,7 @@ async def start_web_server():
     app.router.add_get('/', health_check)
     app.router.add_get('/health', health_check)
     app.router.add_get('/stats', stats_endpoint)
+    app.router.add_get('/metrics', metrics_endpoint)
     
     # Порт из переменной окружения или 8080 по умолчанию
     port = int(os.getenv('PORT', 8080))
@@ -539,10 +606,18 @@ async def main():
     
     web_runner = None
     keep_alive_task = None
+    warm_up_task = None
     
     try:
+        # Задержка цикла событий и блокирующие вызовы - для /stats и /metrics
+        loop_monitor.start()
+        
         # Запускаем HTTP сервер для пингов
         web_runner = await start_web_server()
+        startup_timer.mark('web server')
+        
+        # Общий пул HTTP-соединений для парсеров
+        await start_http_pool()
         
         # Запускаем keep-alive в фоне
         keep_alive_task = asyncio.create_task(keep_alive())
@@ -569,7 +644,15 @@ async def main():
             logger.warning("⚠️ Таймаут при удалении webhook, продолжаем...")
         except Exception as e:
             logger.warning(f"⚠️ Ошибка при удалении webhook: {e}, продолжаем...")
+        startup_timer.mark('telegram')
+        
+        # Скачивания, прерванные прошлым перезапуском: убираем зависшие прогресс-бары
+        await report_interrupted_jobs(bot)
+        
+        # yt-dlp и bs4 загружаются в фоне, затем стартует проверка источников для /stats
+        warm_up_task = asyncio.create_task(warm_up_and_monitor())
         
+        startup_timer.report()
         logger.info("✅ Бот готов к работе!")
         
         # Запускаем polling с обработкой ошибок
@@ -588,6 +671,9 @@ async def main():
     finally:
         logger.info("🛑 Завершение работы бота...")
         
+        if warm_up_task:
+            warm_up_task.cancel()
+        
         if keep_alive_task:
             keep_alive_task.cancel()
             try:
@@ -599,6 +685,18 @@ async def main():
             await bot.session.close()
         except:
             pass
+        
+        try:
+            await close_http_pool()
+        except:
+            pass
+        
+        try:
+            await health_monitor.stop()
+        except:
+            pass
+        
+        await loop_monitor.stop()
             
         if web_runner:
             try:
@@ -0,0 +1,152 @@
+"""
+Локальный полнотекстовый индекс уже отправленных треков (SQLite FTS5)
+"""
+import asyncio
+import logging
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+from file_id_cache import DB_PATH, connect_db, track_key
+from query_normalizer import canonicalize_query
+
+logger = logging.getLogger(__name__)
+
+# Сколько кандидатов брать из FTS перед ранжированием по популярности
+CANDIDATES = 50
+
+
+def search_text(track: Dict) -> str:
+    """Текст для индекса: и исходное написание, и транслитерация"""
+    text = f"{track.get('artist') or ''} {track.get('title') or ''}"
+    original = canonicalize_query(text, translit=False)
+    latin = canonicalize_query(text, translit=True)
+    return original if original == latin else f"{original} {latin}"
+
+
+def fts_query(query: str) -> Optional[str]:
+    """Запрос FTS5: все слова запроса как префиксы"""
+    tokens = canonicalize_query(query).split()
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+class LocalTrackIndex:
+    """
+    Индекс треков, которые бот уже отправлял.
+
+    Позволяет показать результаты сразу, без обращения к YouTube, и
+    продолжать отвечать на популярные запросы, когда YouTube недоступен.
+    """
+
+    def __init__(self, path: str = DB_PATH):
+        self.path = path
+        self._conn = connect_db(path)
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS tracks (
+                track_key TEXT PRIMARY KEY,
+                video_id TEXT,
+                url TEXT,
+                title TEXT,
+                artist TEXT,
+                duration TEXT,
+                duration_seconds INTEGER,
+                file_id TEXT,
+                popularity INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5(
+                track_key UNINDEXED,
+                search_text,
+                tokenize = 'unicode61 remove_diacritics 2'
+            );
+        ''')
+        self._conn.commit()
+
+        # Метрики
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, track: Dict, file_id: Optional[str] = None):
+        """Добавляет отправленный трек в индекс или увеличивает его популярность"""
+        key = track_key(track)
+        with self._conn:
+            self._conn.execute(
+                '''
+                INSERT INTO tracks (track_key, video_id, url, title, artist, duration,
+                                    duration_seconds, file_id, popularity, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1, ?)
+                ON CONFLICT(track_key) DO UPDATE SET
+                    file_id = COALESCE(excluded.file_id, tracks.file_id),
+                    popularity = tracks.popularity + 1,
+                    updated_at = excluded.updated_at
+                ''',
+                (
+                    key, track.get('video_id'), track.get('url'), track.get('title'),
+                    track.get('artist'), track.get('duration'), track.get('duration_seconds'),
+                    file_id, time.time()
+                )
+            )
+            self._conn.execute('DELETE FROM tracks_fts WHERE track_key = ?', (key,))
+            self._conn.execute(
+                'INSERT INTO tracks_fts (track_key, search_text) VALUES (?, ?)',
+                (key, search_text(track))
+            )
+
+    def search(self, query: str, limit: int = 10) -> List[Dict]:
+        """Треки из индекса по запросу, самые релевантные и популярные первыми"""
+        match = fts_query(query)
+        if not match:
+            return []
+
+        try:
+            rows = self._conn.execute(
+                '''
+                SELECT t.*, bm25(tracks_fts) AS score
+                FROM tracks_fts JOIN tracks t ON t.track_key = tracks_fts.track_key
+                WHERE tracks_fts MATCH ?
+                ORDER BY score
+                LIMIT ?
+                ''',
+                (match, CANDIDATES)
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Ошибка поиска в локальном индексе: {e}")
+            return []
+
+        if not rows:
+            self.misses += 1
+            return []
+
+        self.hits += 1
+
+        # bm25 отрицательный (чем меньше, тем релевантнее), популярность усиливает его
+        rows = sorted(rows, key=lambda row: row['score'] * (1 + 0.1 * row['popularity']))
+
+        return [
+            {
+                'title': row['title'],
+                'artist': row['artist'],
+                'duration': row['duration'] or 'N/A',
+                'duration_seconds': row['duration_seconds'] or 0,
+                'url': row['url'],
+                'video_id': row['video_id'],
+                'full_name': f"{row['artist']} - {row['title']}",
+                'source': row['track_key'].split(':', 1)[0],
+                'local': True,
+            }
+            for row in rows[:limit]
+        ]
+
+    async def asearch(self, query: str, limit: int = 10) -> List[Dict]:
+        """search() в пуле потоков: запрос к SQLite не блокирует цикл событий"""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.search, query, limit)
+
+    def close(self):
+        self._conn.close()
+
+
+# Общий индекс на процесс
+local_index = LocalTrackIndex()
@@ -0,0 +1,127 @@
+"""
+Настройка логирования: запись в файл и консоль в отдельном потоке, ротация логов
+"""
+import atexit
+import os
+import logging
+import logging.handlers
+import queue
+from typing import Dict, List, Optional
+
+from tracing import current_request_id
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_configured = False
+
+
+class RequestIdFilter(logging.Filter):
+    """Добавляет к записи ID запроса из трассировки (или '-')"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = current_request_id() or '-'
+        return True
+
+
+def parse_levels(spec: str) -> Dict[str, int]:
+    """'youtube_downloader=WARNING,aiogram.event=WARNING' -> {имя логгера: уровень}"""
+    levels = {}
+    for item in (spec or '').split(','):
+        name, sep, level = item.partition('=')
+        if not sep or not name.strip():
+            continue
+        value = logging.getLevelName(level.strip().upper())
+        if isinstance(value, int):
+            levels[name.strip()] = value
+    return levels
+
+
+def _file_handler(path: str) -> logging.Handler:
+    if os.getenv('LOG_ROTATE', 'size') == 'time':
+        return logging.handlers.TimedRotatingFileHandler(
+            path,
+            when=os.getenv('LOG_ROTATE_WHEN', 'midnight'),
+            backupCount=int(os.getenv('LOG_BACKUPS', 5)),
+            encoding='utf-8'
+        )
+    return logging.handlers.RotatingFileHandler(
+        path,
+        maxBytes=int(float(os.getenv('LOG_MAX_MB', 10)) * 1024 * 1024),
+        backupCount=int(os.getenv('LOG_BACKUPS', 5)),
+        encoding='utf-8'
+    )
+
+
+def _attach_queue(log_queue):
+    """Направляет все записи корневого логгера в очередь"""
+    global _configured
+
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # ID запроса нужно взять в потоке, где запись создана, а не в потоке записи
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+
+    for name, level in parse_levels(os.getenv('LOG_LEVELS', '')).items():
+        logging.getLogger(name).setLevel(level)
+
+    _configured = True
+
+
+def setup_worker_logging(log_queue):
+    """
+    Логирование в процессе-воркере: записи уходят в очередь супервизора,
+    файл лога пишет только он. Последующие вызовы setup_logging ничего не делают.
+    """
+    if not _configured:
+        _attach_queue(log_queue)
+
+
+def setup_logging(log_file: Optional[str] = 'bot.log', log_queue=None):
+    """
+    Настраивает корневой логгер.
+
+    Обработчики вызывают только QueueHandler: запись кладётся в очередь,
+    а в консоль и файл её пишет поток QueueListener, поэтому дисковый
+    ввод-вывод не блокирует цикл событий.
+
+    Args:
+        log_file: файл лога по умолчанию (LOG_FILE переопределяет, пустая строка - без файла)
+        log_queue: очередь записей (multiprocessing.Queue, если в неё пишут и воркеры)
+    """
+    global _listener
+
+    if _configured:
+        return
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers: List[logging.Handler] = [logging.StreamHandler()]
+
+    log_file = os.getenv('LOG_FILE', log_file or '')
+    if log_file:
+        handlers.append(_file_handler(log_file))
+
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    if log_queue is None:
+        log_queue = queue.SimpleQueue()
+    _attach_queue(log_queue)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Дописывает оставшиеся записи и останавливает поток логирования"""
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
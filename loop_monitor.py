@@ -0,0 +1,172 @@
+"""
+Задержка цикла событий и поиск вызовов, которые его блокируют
+"""
+import asyncio
+import os
+import logging
+import statistics
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Сколько кадров стека сохранять для заблокировавшего вызова
+STACK_LIMIT = 20
+ASYNCIO_DIR = os.path.dirname(asyncio.__file__)
+
+
+class LoopMonitor:
+    """
+    Замеряет задержку цикла событий и ловит блокирующие вызовы.
+
+    Задача в цикле засыпает на interval и замеряет, насколько позже она
+    проснулась - это задержка (lag). Отдельный поток-сторож следит, когда
+    задача просыпалась в последний раз: если цикл не отвечает дольше
+    threshold, сторож снимает стек потока цикла через sys._current_frames(),
+    то есть показывает вызов, который занимает цикл прямо сейчас.
+    """
+
+    def __init__(
+        self,
+        interval: Optional[float] = None,
+        threshold: Optional[float] = None,
+        history_size: Optional[int] = None
+    ):
+        self.interval = interval or float(os.getenv('LOOP_LAG_INTERVAL', 0.25))
+        self.threshold = threshold or float(os.getenv('LOOP_BLOCK_THRESHOLD', 0.25))
+        history_size = history_size or int(os.getenv('LOOP_BLOCK_HISTORY', 10))
+
+        # Задержки за последнюю минуту
+        self._lags = deque(maxlen=max(1, int(60 / self.interval)))
+        self._blocks = deque(maxlen=history_size)
+        self._blocked_total = 0
+        self._current_block: Optional[dict] = None
+
+        self._heartbeat = time.perf_counter()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Запускает замеры в текущем цикле событий"""
+        if self._task is not None and not self._task.done():
+            return
+
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.perf_counter()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._sample())
+        self._watchdog = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._watchdog.start()
+        logger.info(
+            f"⏱ Мониторинг цикла событий запущен "
+            f"(замер каждые {self.interval:.2f} сек, блокировка от {self.threshold:.2f} сек)"
+        )
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _sample(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            self._heartbeat = now
+
+            lag = max(0.0, now - expected)
+            self._lags.append(lag)
+            metrics.LOOP_LAG.observe(lag)
+
+    def _stalled(self) -> float:
+        """Сколько цикл не отвечает сверх ожидаемого интервала"""
+        return max(0.0, time.perf_counter() - self._heartbeat - self.interval)
+
+    def _watch(self):
+        check_every = min(self.interval, self.threshold) / 2
+        while not self._stopped.wait(check_every):
+            stalled = self._stalled()
+            block = self._current_block
+
+            if stalled >= self.threshold:
+                if block is None:
+                    self._begin_block(stalled)
+                else:
+                    block['duration_ms'] = round(stalled * 1000)
+            elif block is not None:
+                self._end_block(block)
+
+    def _capture_stack(self) -> List[str]:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return []
+
+        summary = traceback.extract_stack(frame, limit=STACK_LIMIT)
+        # Кадры самого asyncio (run_forever, _run_once) ничего не говорят - оставляем вызванный код
+        frames = [item for item in summary if not item.filename.startswith(ASYNCIO_DIR)]
+        return [line.rstrip() for line in traceback.format_list(frames or summary)]
+
+    def _begin_block(self, stalled: float):
+        stack = self._capture_stack()
+        self._current_block = {
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'duration_ms': round(stalled * 1000),
+            'stack': stack,
+        }
+        self._blocked_total += 1
+        metrics.LOOP_BLOCKS.inc()
+        logger.warning(
+            f"🐢 Цикл событий заблокирован дольше {self.threshold:.2f} сек, выполняется:\n" + '\n'.join(stack)
+        )
+
+    def _end_block(self, block: dict):
+        # Окончательная длительность: последнее значение до пробуждения цикла
+        self._blocks.append(block)
+        self._current_block = None
+        metrics.LOOP_BLOCK_SECONDS.observe(block['duration_ms'] / 1000)
+        logger.warning(f"🐢 Цикл событий был заблокирован {block['duration_ms']} мс")
+
+    def lag(self) -> float:
+        """Текущая задержка цикла (сек): последний замер или время текущей блокировки"""
+        if self._task is None:
+            return 0.0
+        last = self._lags[-1] if self._lags else 0.0
+        return max(last, self._stalled())
+
+    def snapshot(self) -> Dict[str, object]:
+        lags = sorted(self._lags)
+        current = self._current_block
+
+        def percentile(p: float) -> Optional[float]:
+            if not lags:
+                return None
+            return round(lags[min(len(lags) - 1, int(p * len(lags)))] * 1000, 1)
+
+        return {
+            'lag_ms': round(self.lag() * 1000, 1),
+            'lag_p50_ms': percentile(0.5),
+            'lag_p99_ms': percentile(0.99),
+            'lag_max_ms': round(lags[-1] * 1000, 1) if lags else None,
+            'lag_mean_ms': round(statistics.fmean(lags) * 1000, 1) if lags else None,
+            'blocked_total': self._blocked_total,
+            'blocked_now': dict(current) if current else None,
+            'recent_blocks': list(self._blocks),
+        }
+
+
+# Общий монитор на процесс
+loop_monitor = LoopMonitor()
@@ -0,0 +1,263 @@
+"""
+Модуль обработки аудио через ffmpeg: ремукс и перекодирование перед отправкой
+"""
+import asyncio
+import os
+import shutil
+import logging
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Лимит Telegram на отправку файлов ботом
+TELEGRAM_UPLOAD_LIMIT = 50 * 1024 * 1024
+
+# Битрейты для перекодирования в MP3 (от лучшего к худшему), кбит/с
+BITRATE_TIERS = [320, 256, 192, 128, 96, 64]
+
+# Битрейт по умолчанию, если длительность трека неизвестна
+DEFAULT_BITRATE = 192
+
+# Запас на заголовки и метаданные контейнера
+SIZE_SAFETY_MARGIN = 0.95
+
+# Ожидаемый битрейт скачиваемого аудио (bestaudio YouTube: m4a 128 кбит/с + контейнер), кбит/с
+SOURCE_BITRATE = float(os.getenv('DOWNLOAD_EXPECTED_KBPS', 130))
+
+
+class MediaProcessingError(Exception):
+    """ffmpeg не смог обработать аудио, а исходный файл в лимит не помещается"""
+
+
+@dataclass
+class ProcessedAudio:
+    """Результат обработки аудио"""
+    data: bytes
+    ext: str
+    mode: str  # passthrough / remux / transcode
+    bitrate: Optional[int] = None
+
+
+def detect_container(data: bytes) -> str:
+    """Определяет контейнер аудио по сигнатуре файла"""
+    if not data:
+        return 'unknown'
+    if data[:3] == b'ID3':
+        return 'mp3'
+    if len(data) > 1 and data[0] == 0xFF and (data[1] & 0xE0) == 0xE0:
+        # MPEG audio frame sync (ADTS AAC тоже начинается с 0xFFF)
+        return 'aac' if (data[1] & 0x06) == 0 else 'mp3'
+    if data[4:8] == b'ftyp':
+        return 'm4a'
+    if data[:4] == b'\x1a\x45\xdf\xa3':
+        return 'webm'
+    if data[:4] == b'OggS':
+        return 'ogg'
+    return 'unknown'
+
+
+def moov_after_mdat(data: bytes) -> bool:
+    """
+    Индекс MP4 (moov) записан после самих данных (mdat).
+
+    Такой файл ffmpeg не может прочитать из stdin: без перемотки
+    до moov он не знает, где в mdat лежат кадры.
+    """
+    offset = 0
+    while offset + 8 <= len(data):
+        size = int.from_bytes(data[offset:offset + 4], 'big')
+        box = data[offset + 4:offset + 8]
+        if box == b'moov':
+            return False
+        if box == b'mdat':
+            return True
+        if size == 1:
+            # 64-битный размер сразу после типа
+            size = int.from_bytes(data[offset + 8:offset + 16], 'big')
+        if size < 8:
+            # size 0 - бокс до конца файла, меньшее значение - повреждённый заголовок
+            return False
+        offset += size
+    return False
+
+
+def estimate_size(duration_seconds: float, bitrate: float = SOURCE_BITRATE) -> int:
+    """Ожидаемый размер аудио в байтах по длительности и битрейту"""
+    return int(duration_seconds * bitrate * 1000 / 8)
+
+
+def pick_bitrate(duration_seconds: Optional[int], max_bytes: int = TELEGRAM_UPLOAD_LIMIT) -> Optional[int]:
+    """
+    Выбирает максимальный битрейт, при котором трек поместится в лимит
+
+    Returns:
+        Битрейт в кбит/с или None, если трек не влезет даже в минимальный
+    """
+    if not duration_seconds:
+        return DEFAULT_BITRATE
+
+    budget = max_bytes * SIZE_SAFETY_MARGIN
+    for bitrate in BITRATE_TIERS:
+        if duration_seconds * bitrate * 1000 / 8 <= budget:
+            return bitrate
+    return None
+
+
+class MediaProcessor:
+    """Пул ffmpeg-процессов с ограничением параллельности и метриками очереди"""
+
+    def __init__(self, max_workers: Optional[int] = None, timeout: Optional[float] = None):
+        self.max_workers = max_workers or int(os.getenv('FFMPEG_WORKERS', 2))
+        self.timeout = timeout or float(os.getenv('FFMPEG_TIMEOUT', 180))
+        self.ffmpeg_path = shutil.which(os.getenv('FFMPEG_PATH', 'ffmpeg'))
+        self._semaphore = asyncio.Semaphore(self.max_workers)
+
+        # Метрики очереди
+        self.queued = 0
+        self.active = 0
+        self.processed = 0
+        self.failed = 0
+        self.total_wait_time = 0.0
+        self.total_process_time = 0.0
+
+        if not self.ffmpeg_path:
+            logger.warning("ffmpeg не найден, аудио будет отправляться без обработки")
+
+    @property
+    def available(self) -> bool:
+        return self.ffmpeg_path is not None
+
+    def stats(self) -> dict:
+        """Текущее состояние пула"""
+        done = self.processed + self.failed
+        return {
+            'workers': self.max_workers,
+            'queued': self.queued,
+            'active': self.active,
+            'processed': self.processed,
+            'failed': self.failed,
+            'avg_wait': self.total_wait_time / done if done else 0.0,
+            'avg_process': self.total_process_time / done if done else 0.0,
+        }
+
+    async def process(
+        self,
+        data: bytes,
+        duration_seconds: Optional[int] = None,
+        max_bytes: int = TELEGRAM_UPLOAD_LIMIT
+    ) -> Optional[ProcessedAudio]:
+        """
+        Приводит аудио к формату, который Telegram воспроизводит и принимает по размеру
+
+        Args:
+            data: исходные байты аудио
+            duration_seconds: длительность трека, если известна
+            max_bytes: максимальный размер результата
+
+        Returns:
+            Обработанное аудио или None, если трек не удалось уложить в лимит
+
+        Raises:
+            MediaProcessingError: ffmpeg завершился с ошибкой, а исходный файл больше лимита
+        """
+        container = detect_container(data)
+        fits = len(data) <= max_bytes
+        # Исходный файл как есть: если ffmpeg нет или он не справился
+        original = ProcessedAudio(data=data, ext=container if container != 'unknown' else 'mp3', mode='passthrough')
+
+        # MP3 в пределах лимита отправляем как есть
+        if container == 'mp3' and fits:
+            return original
+
+        if not self.available:
+            return original if fits else None
+
+        # AAC в MP4 можно переупаковать без перекодирования
+        if container == 'm4a' and fits:
+            if moov_after_mdat(data):
+                # Из stdin такой файл не переупаковать, а в лимит он и так помещается
+                return original
+            args = ['-vn', '-c:a', 'copy', '-f', 'ipod', '-movflags', '+frag_keyframe+empty_moov']
+            output = await self._run(data, args)
+            if output and len(output) <= max_bytes:
+                return ProcessedAudio(data=output, ext='m4a', mode='remux')
+            logger.warning("Ремукс не удался, отправляем исходный файл")
+            return original
+
+        bitrate = pick_bitrate(duration_seconds, max_bytes)
+        if bitrate is None:
+            logger.warning(f"Трек длительностью {duration_seconds} сек не помещается в лимит")
+            return original if fits else None
+
+        args = ['-vn', '-c:a', 'libmp3lame', '-b:a', f'{bitrate}k', '-f', 'mp3']
+        output = await self._run(data, args)
+        if output is None:
+            if fits:
+                logger.warning("Перекодирование не удалось, отправляем исходный файл")
+                return original
+            raise MediaProcessingError(f"ffmpeg не смог перекодировать аудио ({container}, {len(data)} байт)")
+        if len(output) > max_bytes:
+            return original if fits else None
+
+        return ProcessedAudio(data=output, ext='mp3', mode='transcode', bitrate=bitrate)
+
+    async def _run(self, data: bytes, output_args: list) -> Optional[bytes]:
+        """Запускает ffmpeg с чтением из stdin и записью в stdout"""
+        queued_at = time.monotonic()
+        self.queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            # Уменьшаем очередь и при отмене ожидания
+            self.queued -= 1
+
+        self.active += 1
+        started_at = time.monotonic()
+        self.total_wait_time += started_at - queued_at
+        try:
+            output = await self._exec(data, output_args)
+        finally:
+            self.active -= 1
+            self.total_process_time += time.monotonic() - started_at
+            self._semaphore.release()
+
+        if output is None:
+            self.failed += 1
+        else:
+            self.processed += 1
+        return output
+
+    async def _exec(self, data: bytes, output_args: list) -> Optional[bytes]:
+        cmd = [
+            self.ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-nostdin',
+            '-i', 'pipe:0', *output_args, 'pipe:1'
+        ]
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(data), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            logger.error(f"ffmpeg превысил таймаут {self.timeout} сек")
+            return None
+        except asyncio.CancelledError:
+            process.kill()
+            await process.wait()
+            raise
+
+        if process.returncode != 0:
+            logger.error(f"ffmpeg завершился с кодом {process.returncode}: {stderr.decode(errors='ignore')[:500]}")
+            return None
+
+        return stdout
+
+
+# Общий пул на процесс
+media_processor = MediaProcessor()
@@ -0,0 +1,262 @@
+"""
+Метрики бота в текстовом формате Prometheus (эндпоинт /metrics)
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# yt-dlp работает в стандартном пуле asyncio: min(32, CPU + 4) потоков
+DEFAULT_EXECUTOR_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+# Границы корзин гистограмм задержек (сек)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    TYPE = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.TYPE}']
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик"""
+
+    TYPE = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}' for key, value in items]
+
+
+class Gauge(_Metric):
+    """Текущее значение; может вычисляться функцией в момент опроса"""
+
+    TYPE = 'gauge'
+
+    def __init__(self, *args, function: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function = function
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def collect(self) -> List[str]:
+        if self._function is not None:
+            items = sorted(self._function().items())
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}' for key, value in items]
+
+
+class CallbackCounter(Gauge):
+    """Счётчик, значение которого ведёт другой модуль (например, попадания в кэш)"""
+
+    TYPE = 'counter'
+
+
+class Histogram(_Metric):
+    """Распределение значений по корзинам"""
+
+    TYPE = 'histogram'
+
+    def __init__(self, *args, buckets: Iterable[float] = LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][idx] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+# --- Метрики бота ---
+
+STAGE_SECONDS = Histogram(
+    'musicbot_stage_seconds',
+    'Длительность этапов обработки: search, resolve, download, transcode, upload, end_to_end',
+    ['stage']
+)
+
+ERRORS = Counter('musicbot_errors_total', 'Ошибки по этапам и классам исключений', ['stage', 'error'])
+
+DOWNLOADED_BYTES = Counter('musicbot_downloaded_bytes_total', 'Байт аудио скачано из источников')
+UPLOADED_BYTES = Counter('musicbot_uploaded_bytes_total', 'Байт аудио загружено в Telegram')
+
+IN_FLIGHT = Gauge('musicbot_in_flight_jobs', 'Выполняющиеся задачи', ['kind'])
+
+REJECTED = Counter(
+    'musicbot_rejected_total', 'Отклонённые запросы: лимит пользователя (user) или перегрузка (overload)',
+    ['action', 'reason']
+)
+
+LOOP_LAG = Histogram(
+    'musicbot_event_loop_lag_seconds',
+    'Задержка цикла событий: насколько позже запланированного просыпается задача',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+LOOP_BLOCKS = Counter('musicbot_event_loop_blocked_total', 'Случаи, когда один вызов занял цикл событий дольше порога')
+LOOP_BLOCK_SECONDS = Histogram(
+    'musicbot_event_loop_block_seconds', 'Длительность блокировок цикла событий',
+    buckets=(0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+
+
+def _cache_stats() -> Dict[Tuple[str, ...], float]:
+    from audio_cache import audio_cache
+    from file_id_cache import file_id_cache
+    from local_index import local_index
+    from search_cache import search_cache
+
+    values = {}
+    for name, cache in (
+        ('audio', audio_cache), ('search', search_cache),
+        ('file_id', file_id_cache), ('local_index', local_index)
+    ):
+        values[(name, 'hit')] = cache.hits
+        values[(name, 'miss')] = cache.misses
+    return values
+
+
+def _queue_depths() -> Dict[Tuple[str, ...], float]:
+    from download_scheduler import download_scheduler
+    from media_processor import media_processor
+    return {('ffmpeg',): media_processor.queued, ('download',): download_scheduler.queued}
+
+
+def _executor_saturation() -> Dict[Tuple[str, ...], float]:
+    from media_processor import media_processor
+
+    ytdlp_busy = IN_FLIGHT.value(kind='ytdlp')
+
+    return {
+        ('ffmpeg',): media_processor.active / media_processor.max_workers,
+        ('ytdlp',): min(1.0, ytdlp_busy / DEFAULT_EXECUTOR_WORKERS),
+    }
+
+
+CACHE_REQUESTS = CallbackCounter(
+    'musicbot_cache_requests_total', 'Обращения к кэшам', ['cache', 'result'], function=_cache_stats
+)
+QUEUE_DEPTH = Gauge('musicbot_queue_depth', 'Задачи, ожидающие исполнителя', ['queue'], function=_queue_depths)
+EXECUTOR_SATURATION = Gauge(
+    'musicbot_executor_saturation', 'Доля занятых исполнителей пула (0..1)', ['executor'], function=_executor_saturation
+)
+
+
+def render() -> str:
+    return REGISTRY.render()
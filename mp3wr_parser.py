@@ -1,12 +1,325 @@
 """
 Парсер для mp3wr.com - поиск и скачивание музыки
 """
-import aiohttp
+import asyncio
+import codecs
+import os
+import logging
 import re
-from bs4 import BeautifulSoup
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+import aiohttp
 from typing import List, Dict, Optional
 from urllib.parse import quote, urljoin
 
+from audio_cache import audio_cache
+from circuit_breaker import get_breaker
+from http_pool import create_session, get_http_session
+from media_processor import TELEGRAM_UPLOAD_LIMIT
+from metrics import DOWNLOADED_BYTES, ERRORS
+
+logger = logging.getLogger(__name__)
+
+# Шаблоны компилируются один раз на модуль, а не на каждый блок страницы
+BLOCK_TAGS = ('div', 'li', 'article')
+BLOCK_CLASS_RE = re.compile(r'track|song|music|item|result', re.I)
+DOWNLOAD_HREF_RE = re.compile(r'/download/|/get/|\.mp3')
+TITLE_CLASS_RE = re.compile(r'title|name', re.I)
+ARTIST_CLASS_RE = re.compile(r'artist|author', re.I)
+DOWNLOAD_CLASS_RE = re.compile(r'download', re.I)
+
+# Размер кусков при потоковом скачивании аудио
+STREAM_CHUNK_BYTES = 256 * 1024
+
+# Страницы больше этого размера не разбираем
+MAX_HTML_BYTES = int(os.getenv('MAX_HTML_KB', 2048)) * 1024
+
+# Кодировка из <meta charset> ищется в начале страницы
+META_CHARSET_SCAN_BYTES = 2048
+META_CHARSET_RE = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.I)
+
+_parse_executor: Optional[Executor] = None
+
+
+def get_parse_executor() -> Executor:
+    """
+    Отдельный небольшой пул для разбора HTML, чтобы не блокировать event loop.
+    HTML_PARSE_EXECUTOR=process переносит разбор в отдельные процессы (без GIL).
+    """
+    global _parse_executor
+    if _parse_executor is None:
+        workers = int(os.getenv('HTML_PARSE_WORKERS', 2))
+        if os.getenv('HTML_PARSE_EXECUTOR', 'thread') == 'process':
+            _parse_executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            _parse_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='html-parse')
+    return _parse_executor
+
+
+async def run_parser(func, *args):
+    """Выполняет функцию разбора в пуле и возвращает её результат"""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(get_parse_executor(), func, *args)
+
+
+async def read_html(response: aiohttp.ClientResponse) -> Optional[str]:
+    """Читает HTML ответа, если он не превышает MAX_HTML_BYTES"""
+    if response.content_length and response.content_length > MAX_HTML_BYTES:
+        logger.warning(f"Страница слишком большая: {response.content_length} байт")
+        return None
+    
+    chunks = []
+    size = 0
+    async for chunk in response.content.iter_chunked(64 * 1024):
+        size += len(chunk)
+        if size > MAX_HTML_BYTES:
+            logger.warning(f"Страница превысила лимит {MAX_HTML_BYTES} байт, прерываем")
+            return None
+        chunks.append(chunk)
+    
+    body = b''.join(chunks)
+    return body.decode(html_encoding(response, body), errors='replace')
+
+
+def html_encoding(response: aiohttp.ClientResponse, body: bytes) -> str:
+    """
+    Кодировка страницы: charset из Content-Type, затем из <meta>, иначе utf-8.
+    
+    response.get_encoding() здесь не подходит: без charset в заголовке он
+    определяет кодировку по телу ответа, а тело уже прочитано через iter_chunked.
+    """
+    encoding = response.charset
+    if not encoding:
+        match = META_CHARSET_RE.search(body[:META_CHARSET_SCAN_BYTES])
+        if match:
+            encoding = match.group(1).decode('ascii')
+    
+    try:
+        codecs.lookup(encoding or '')
+    except LookupError:
+        return 'utf-8'
+    return encoding
+
+
+def is_html(content_type: str) -> bool:
+    return 'text/html' in content_type
+
+
+def is_audio(content_type: str) -> bool:
+    return 'audio' in content_type or 'octet-stream' in content_type
+
+
+async def stream_audio(response: aiohttp.ClientResponse, max_bytes: int = TELEGRAM_UPLOAD_LIMIT) -> Optional[bytes]:
+    """
+    Потоково скачивает аудио в память.
+    
+    Запрос прерывается, как только заявленный или фактический размер
+    превышает max_bytes, либо если сервер отдаёт не аудио, поэтому в памяти
+    не бывает больше max_bytes.
+    
+    Returns:
+        Байты аудио файла или None
+    """
+    content_type = response.headers.get('content-type', '')
+    if not is_audio(content_type):
+        logger.warning(f"Источник вернул не аудио: {content_type}")
+        return None
+    
+    if response.content_length and response.content_length > max_bytes:
+        logger.warning(f"Файл больше лимита: {response.content_length} байт")
+        return None
+    
+    buffer = bytearray()
+    async for chunk in response.content.iter_chunked(STREAM_CHUNK_BYTES):
+        if len(buffer) + len(chunk) > max_bytes:
+            logger.warning(f"Файл превысил лимит {max_bytes} байт во время скачивания, прерываем")
+            return None
+        buffer += chunk
+    
+    if not buffer:
+        return None
+    
+    DOWNLOADED_BYTES.inc(len(buffer))
+    return bytes(buffer)
+
+
+# lxml не принимает str с XML-объявлением кодировки: текст уже декодирован, объявление лишнее
+XML_DECLARATION_RE = re.compile(r'^\s*<\?xml[^>]*\?>')
+
+# Теги и XPath для разбора результатов поиска
+TITLE_TAGS = ('h2', 'h3', 'h4', 'span', 'div')
+ARTIST_TAGS = ('span', 'div', 'p')
+
+
+@lru_cache(maxsize=None)
+def _text_xpath():
+    """Текст элемента без скриптов и стилей, как bs4 get_text()"""
+    from lxml import etree
+    return etree.XPath('.//text()[not(parent::script or parent::style)]')
+
+
+def _text(element) -> str:
+    return ''.join(text.strip() for text in _text_xpath()(element))
+
+
+def _find(block, tags, class_re):
+    """Первый потомок блока с одним из тегов и подходящим классом"""
+    for element in block.iterdescendants(*tags):
+        if class_re.search(element.get('class') or ''):
+            return element
+    return None
+
+
+def _find_download_link(block):
+    for link in block.iterdescendants('a'):
+        if DOWNLOAD_HREF_RE.search(link.get('href') or ''):
+            return link
+    return None
+
+
+def warm_up():
+    """Заранее импортирует lxml, чтобы первый поиск не ждал импорта"""
+    _text_xpath()
+
+
+def parse_search_results(html: str, limit: int, base_url: str) -> List[Dict[str, str]]:
+    """
+    Разбор страницы результатов поиска mp3wr.com
+    
+    Args:
+        html: HTML страницы поиска
+        limit: максимальное количество результатов
+        base_url: адрес сайта для абсолютных ссылок
+        
+    Returns:
+        Список словарей с информацией о треках
+    """
+    # Разбираем напрямую через lxml: без построения дерева bs4 и обратных вызовов на каждый тег
+    from lxml import etree
+    
+    root = etree.HTML(XML_DECLARATION_RE.sub('', html, count=1))
+    if root is None:
+        return []
+    
+    # Вариант 1: блоки с классами track, song, music и т.д.
+    track_blocks = [
+        block for block in root.iter(*BLOCK_TAGS)
+        if BLOCK_CLASS_RE.search(block.get('class') or '')
+    ]
+    
+    if not track_blocks:
+        # Вариант 2: все ссылки на скачивание
+        track_blocks = [
+            link for link in root.iter('a')
+            if DOWNLOAD_HREF_RE.search(link.get('href') or '')
+        ]
+    
+    logger.debug(f"Найдено блоков: {len(track_blocks)}")
+    
+    results = []
+    for block in track_blocks[:limit]:
+        try:
+            title = "Неизвестно"
+            artist = "Неизвестный исполнитель"
+            download_url = None
+            duration = "N/A"
+            
+            title_elem = _find(block, TITLE_TAGS, TITLE_CLASS_RE)
+            if title_elem is not None:
+                title = _text(title_elem)
+            
+            artist_elem = _find(block, ARTIST_TAGS, ARTIST_CLASS_RE)
+            if artist_elem is not None:
+                artist = _text(artist_elem)
+            
+            # Ищем ссылку на скачивание
+            download_link = _find_download_link(block)
+            if download_link is None and block.tag == 'a':
+                download_link = block
+            
+            if download_link is not None:
+                download_url = urljoin(base_url, download_link.get('href', ''))
+            
+            # Если не нашли через классы, пробуем из текста ссылки
+            if title == "Неизвестно" and download_link is not None:
+                link_text = _text(download_link)
+                if link_text and len(link_text) > 3:
+                    title = link_text
+            
+            if download_url:
+                results.append({
+                    'title': title,
+                    'artist': artist,
+                    'duration': duration,
+                    'download_url': download_url,
+                    'full_name': f"{artist} - {title}"
+                })
+            
+        except Exception as e:
+            logger.debug(f"Ошибка при парсинге трека: {e}")
+            continue
+    
+    # Полный разбор структуры страницы нужен только при отладке
+    if not results and logger.isEnabledFor(logging.DEBUG):
+        _log_page_structure(html)
+    
+    return results
+
+
+def _log_page_structure(html: str):
+    """Выводит в отладочный лог структуру страницы без результатов"""
+    from bs4 import BeautifulSoup
+    
+    soup = BeautifulSoup(html, 'lxml')
+    logger.debug(f"Title: {soup.title.string if soup.title else 'Нет'}")
+    
+    all_links = soup.find_all('a', href=True)
+    mp3_links = [a for a in all_links if 'mp3' in a['href'].lower()]
+    download_links = [a for a in all_links if any(word in a['href'].lower()
+                      for word in ['download', 'get', 'track'])]
+    logger.debug(f"Всего ссылок: {len(all_links)}, с mp3: {len(mp3_links)}, на скачивание: {len(download_links)}")
+    
+    for link in download_links[:5]:
+        logger.debug(f"  - {link.get('href')}: {link.get_text(strip=True)[:50]}")
+
+
+def extract_audio_link(html: str, base_url: str) -> Optional[str]:
+    """
+    Поиск прямой ссылки на MP3 на странице трека
+    
+    Returns:
+        Абсолютная ссылка на аудио или None
+    """
+    from bs4 import BeautifulSoup
+    
+    soup = BeautifulSoup(html, 'lxml')
+    mp3_link = None
+    
+    # Вариант 1: audio source
+    audio = soup.find('audio')
+    if audio:
+        source = audio.find('source')
+        if source and source.get('src'):
+            mp3_link = source['src']
+    
+    # Вариант 2: кнопка скачивания
+    if not mp3_link:
+        download_btn = soup.find('a', class_=DOWNLOAD_CLASS_RE)
+        if download_btn:
+            mp3_link = download_btn.get('href')
+    
+    # Вариант 3: любая ссылка на .mp3
+    if not mp3_link:
+        for link in soup.find_all('a', href=True):
+            if link['href'].endswith('.mp3'):
+                mp3_link = link['href']
+                break
+    
+    if mp3_link and not mp3_link.startswith('http'):
+        mp3_link = urljoin(base_url, mp3_link)
+    
+    return mp3_link
+
 
 class Mp3wrParser:
     """Класс для работы с mp3wr.com"""
@@ -15,20 +328,22 @@ class Mp3wrParser:
     
     def __init__(self):
         self.session: Optional[aiohttp.ClientSession] = None
+        self._owns_session = False
+        self.breaker = get_breaker('mp3wr')
         
     async def __aenter__(self):
-        self.session = aiohttp.ClientSession(
-            headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-                'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
-            }
-        )
+        # Берём общий пул соединений, а без него создаём собственную сессию
+        self.session = get_http_session()
+        if self.session is None:
+            self.session = create_session()
+            self._owns_session = True
         return self
         
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if self.session:
+        if self.session and self._owns_session:
             await self.session.close()
+        self.session = None
+        self._owns_session = False
     
     async def search(self, query: str, limit: int = 10) -> List[Dict[str, str]]:
         """
@@ -44,105 +359,46 @@ class Mp3wrParser:
         if not self.session:
             raise RuntimeError("Используйте 'async with Mp3wrParser()' для создания сессии")
         
+        if not self.breaker.allow_request():
+            logger.warning("MP3WR временно отключён после серии ошибок, пропускаем поиск")
+            return []
+        
         # Формируем URL для поиска
         search_url = f"{self.BASE_URL}/search/{quote(query)}"
         
         try:
             async with self.session.get(search_url) as response:
                 if response.status != 200:
-                    print(f"Статус: {response.status}")
+                    logger.warning(f"MP3WR вернул статус {response.status}")
+                    self.breaker.record_failure()
                     return []
                 
-                html = await response.text()
-                soup = BeautifulSoup(html, 'lxml')
-                
-                results = []
-                
-                # Ищем блоки с треками - попробуем разные варианты
-                # Вариант 1: ищем div с классами track, song, music и т.д.
-                track_blocks = soup.find_all(['div', 'li', 'article'], 
-                                            class_=re.compile(r'track|song|music|item|result', re.I))
-                
-                if not track_blocks:
-                    # Вариант 2: ищем все ссылки на скачивание
-                    track_blocks = soup.find_all('a', href=re.compile(r'/download/|/get/|\.mp3'))
-                
-                print(f"Найдено блоков: {len(track_blocks)}")
-                
-                for block in track_blocks[:limit]:
-                    try:
-                        # Пытаемся извлечь информацию
-                        title = "Неизвестно"
-                        artist = "Неизвестный исполнитель"
-                        download_url = None
-                        duration = "N/A"
-                        
-                        # Ищем название и исполнителя
-                        title_elem = block.find(['h2', 'h3', 'h4', 'span', 'div'], 
-                                               class_=re.compile(r'title|name', re.I))
-                        if title_elem:
-                            title = title_elem.get_text(strip=True)
-                        
-                        artist_elem = block.find(['span', 'div', 'p'], 
-                                                class_=re.compile(r'artist|author', re.I))
-                        if artist_elem:
-                            artist = artist_elem.get_text(strip=True)
-                        
-                        # Ищем ссылку на скачивание
-                        download_link = block.find('a', href=re.compile(r'/download/|/get/|\.mp3'))
-                        if not download_link and block.name == 'a':
-                            download_link = block
-                        
-                        if download_link:
-                            download_url = urljoin(self.BASE_URL, download_link.get('href', ''))
-                        
-                        # Если не нашли через классы, пробуем из текста ссылки
-                        if title == "Неизвестно" and download_link:
-                            link_text = download_link.get_text(strip=True)
-                            if link_text and len(link_text) > 3:
-                                title = link_text
-                        
-                        if download_url:
-                            results.append({
-                                'title': title,
-                                'artist': artist,
-                                'duration': duration,
-                                'download_url': download_url,
-                                'full_name': f"{artist} - {title}"
-                            })
-                        
-                    except Exception as e:
-                        print(f"Ошибка при парсинге трека: {e}")
-                        continue
-                
-                # Если ничего не нашли стандартными методами, выведем структуру страницы
-                if not results:
-                    print("\n=== Анализ структуры страницы ===")
-                    print(f"Title: {soup.title.string if soup.title else 'Нет'}")
-                    
-                    # Ищем все ссылки
-                    all_links = soup.find_all('a', href=True)
-                    print(f"Всего ссылок: {len(all_links)}")
-                    
-                    mp3_links = [a for a in all_links if 'mp3' in a.get('href', '').lower()]
-                    print(f"Ссылок с mp3: {len(mp3_links)}")
-                    
-                    download_links = [a for a in all_links if any(word in a.get('href', '').lower() 
-                                     for word in ['download', 'get', 'track'])]
-                    print(f"Ссылок на скачивание: {len(download_links)}")
-                    
-                    if download_links:
-                        print("\nПримеры ссылок:")
-                        for link in download_links[:5]:
-                            print(f"  - {link.get('href')}: {link.get_text(strip=True)[:50]}")
-                
-                return results
+                html = await read_html(response)
                 
         except Exception as e:
-            print(f"Ошибка поиска: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.error(f"Ошибка поиска в MP3WR: {e}", exc_info=True)
+            self.breaker.record_failure()
+            return []
+        
+        self.breaker.record_success()
+        
+        if html is None:
             return []
+        
+        return await self._parse(parse_search_results, html, limit, self.BASE_URL) or []
+    
+    @staticmethod
+    async def _parse(func, *args):
+        """
+        Разбор страницы в пуле. Ошибка разбора - проблема парсера, а не
+        недоступность сайта, поэтому выключатель она не размыкает.
+        """
+        try:
+            return await run_parser(func, *args)
+        except Exception as e:
+            logger.error(f"Ошибка разбора страницы MP3WR: {e}", exc_info=True)
+            ERRORS.inc(stage='parse', error=e.__class__.__name__)
+            return None
     
     async def download_track(self, download_url: str) -> Optional[bytes]:
         """
@@ -157,65 +413,61 @@ class Mp3wrParser:
         if not self.session:
             raise RuntimeError("Используйте 'async with Mp3wrParser()' для создания сессии")
         
+        # Сначала проверяем локальный кэш
+        cache_key = audio_cache.make_key('mp3wr', download_url, 'original')
+        cached = await audio_cache.aget(cache_key)
+        if cached:
+            return cached
+        
+        if not self.breaker.allow_request():
+            logger.warning("MP3WR временно отключён после серии ошибок, пропускаем скачивание")
+            return None
+        
+        audio_data = await self._fetch_track(download_url)
+        if audio_data:
+            await audio_cache.aput(cache_key, audio_data)
+        return audio_data
+    
+    async def _fetch_track(self, download_url: str) -> Optional[bytes]:
+        """Скачивание трека из сети"""
         try:
-            print(f"Скачиваю с: {download_url}")
+            logger.info(f"Скачиваю с MP3WR: {download_url}")
             
-            # Скачиваем файл
             async with self.session.get(download_url, allow_redirects=True) as response:
-                print(f"Статус: {response.status}")
-                print(f"Content-Type: {response.headers.get('content-type')}")
+                if response.status != 200:
+                    logger.warning(f"MP3WR вернул статус {response.status}")
+                    self.breaker.record_failure()
+                    return None
                 
-                if response.status == 200:
-                    content_type = response.headers.get('content-type', '')
-                    
-                    # Если это HTML страница, нужно искать реальную ссылку
-                    if 'text/html' in content_type:
-                        html = await response.text()
-                        soup = BeautifulSoup(html, 'lxml')
-                        
-                        # Ищем прямую ссылку на MP3
-                        mp3_link = None
-                        
-                        # Вариант 1: audio source
-                        audio = soup.find('audio')
-                        if audio:
-                            source = audio.find('source')
-                            if source and source.get('src'):
-                                mp3_link = source['src']
-                        
-                        # Вариант 2: кнопка скачивания
-                        if not mp3_link:
-                            download_btn = soup.find('a', class_=re.compile(r'download', re.I))
-                            if download_btn:
-                                mp3_link = download_btn.get('href')
-                        
-                        # Вариант 3: любая ссылка на .mp3
-                        if not mp3_link:
-                            for link in soup.find_all('a', href=True):
-                                if link['href'].endswith('.mp3'):
-                                    mp3_link = link['href']
-                                    break
-                        
-                        if mp3_link:
-                            if not mp3_link.startswith('http'):
-                                mp3_link = urljoin(self.BASE_URL, mp3_link)
-                            
-                            print(f"Найдена прямая ссылка: {mp3_link}")
-                            # Скачиваем по прямой ссылке
-                            async with self.session.get(mp3_link, allow_redirects=True) as mp3_response:
-                                if mp3_response.status == 200:
-                                    return await mp3_response.read()
-                        
-                        return None
-                    
-                    # Если это аудио файл
-                    elif 'audio' in content_type or 'octet-stream' in content_type:
-                        return await response.read()
-                    
+                self.breaker.record_success()
+                content_type = response.headers.get('content-type', '')
+                
+                # Если это аудио файл, скачиваем его потоково
+                if not is_html(content_type):
+                    return await stream_audio(response)
+                
+                # Если это HTML страница, нужно искать реальную ссылку
+                html = await read_html(response)
+            
+            if html is None:
                 return None
+            
+            mp3_link = await self._parse(extract_audio_link, html, self.BASE_URL)
+            if not mp3_link:
+                logger.warning(f"Прямая ссылка на MP3 не найдена: {download_url}")
+                return None
+            
+            logger.info(f"Найдена прямая ссылка: {mp3_link}")
+            
+            # По прямой ссылке принимаем только аудио, без дальнейших переходов по HTML
+            async with self.session.get(mp3_link, allow_redirects=True) as mp3_response:
+                if mp3_response.status != 200:
+                    logger.warning(f"MP3WR вернул статус {mp3_response.status}")
+                    self.breaker.record_failure()
+                    return None
+                return await stream_audio(mp3_response)
                     
         except Exception as e:
-            print(f"Ошибка скачивания: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.error(f"Ошибка скачивания с MP3WR: {e}", exc_info=True)
+            self.breaker.record_failure()
             return None
@@ -0,0 +1,50 @@
+"""
+Нормализация поисковых запросов для ключей кэша
+"""
+import os
+import re
+import unicodedata
+
+PUNCTUATION_RE = re.compile(r'[^\w\s]+|_+')
+SPACES_RE = re.compile(r'\s+')
+
+# Транслитерация кириллицы в латиницу в том виде, как её обычно набирают пользователи
+TRANSLIT_TABLE = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ж': 'zh',
+    'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n',
+    'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f',
+    'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch', 'ъ': '', 'ы': 'y',
+    'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+    # Украинские и белорусские буквы
+    'і': 'i', 'ї': 'i', 'є': 'e', 'ґ': 'g', 'ў': 'u',
+}
+
+TRANSLITERATE = os.getenv('SEARCH_TRANSLITERATE', '1') != '0'
+
+
+def clean_query(query: str) -> str:
+    """Запрос с нормальными пробелами - в таком виде он уходит в поиск"""
+    return SPACES_RE.sub(' ', query or '').strip()
+
+
+def transliterate(text: str) -> str:
+    return ''.join(TRANSLIT_TABLE.get(char, char) for char in text)
+
+
+def canonicalize_query(query: str, translit: bool = None) -> str:
+    """
+    Канонический вид запроса для ключа кэша.
+
+    "Моргенштерн", "morgenshtern" и "MORGENSHTERN " дают одно и то же:
+    регистр, пробелы и пунктуация схлопываются, ё заменяется на е,
+    кириллица (если не отключено) транслитерируется в латиницу.
+    """
+    text = unicodedata.normalize('NFKC', query or '').casefold()
+    text = text.replace('ё', 'е')
+    text = PUNCTUATION_RE.sub(' ', text)
+    text = SPACES_RE.sub(' ', text).strip()
+
+    if TRANSLITERATE if translit is None else translit:
+        text = transliterate(text)
+
+    return text
@@ -0,0 +1,212 @@
+"""
+Ограничение частоты поисков и скачиваний: лимиты на пользователя и сброс нагрузки
+"""
+import asyncio
+import math
+import os
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from download_scheduler import download_scheduler
+from loop_monitor import loop_monitor
+from media_processor import media_processor
+from metrics import DEFAULT_EXECUTOR_WORKERS, IN_FLIGHT, REJECTED
+
+logger = logging.getLogger(__name__)
+
+SEARCH = 'search'
+DOWNLOAD = 'download'
+
+# Сколько пользователей помнить; самые давние вытесняются
+MAX_TRACKED_USERS = 10_000
+
+
+class TokenBucket:
+    """Корзина токенов: capacity запросов подряд, затем rate запросов в секунду"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        # До какого момента пользователь уже предупреждён об ограничении
+        self.warned_until = 0.0
+
+    def take(self, now: Optional[float] = None) -> float:
+        """
+        Забирает токен.
+
+        Returns:
+            0, если запрос разрешён, иначе через сколько секунд появится токен
+        """
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class UserRateLimiter:
+    """Корзины токенов по пользователям для одного вида запросов"""
+
+    def __init__(self, action: str, per_minute: float, burst: float):
+        self.action = action
+        self.rate = per_minute / 60
+        self.burst = burst
+        self._buckets: 'OrderedDict[int, TokenBucket]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, user_id: int, now: Optional[float] = None) -> float:
+        """0, если запрос разрешён, иначе сколько секунд подождать"""
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+                if len(self._buckets) > MAX_TRACKED_USERS:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(user_id)
+            return bucket.take(now)
+
+    async def acquire(self, user_id: int):
+        """Ждёт токен вместо отказа: для пакетов, где каждый трек - отдельное скачивание"""
+        while True:
+            retry_after = self.check(user_id)
+            if not retry_after:
+                return
+            logger.debug(f"Лимит {self.action} для {user_id}: пакет ждёт {retry_after:.1f} сек")
+            await asyncio.sleep(retry_after)
+
+    def should_warn(self, user_id: int, retry_after: float, now: Optional[float] = None) -> bool:
+        """Предупреждать один раз за период ожидания, а не на каждое сообщение флуда"""
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            now = time.monotonic() if now is None else now
+            if bucket is None or now < bucket.warned_until:
+                return False
+            bucket.warned_until = now + retry_after
+            return True
+
+
+def queue_depth() -> int:
+    """Работа, которая ждёт исполнителя: очереди скачиваний и ffmpeg, вызовы yt-dlp сверх размера пула"""
+    ytdlp_waiting = max(0, int(IN_FLIGHT.value(kind='ytdlp')) - DEFAULT_EXECUTOR_WORKERS)
+    return download_scheduler.queued + media_processor.queued + ytdlp_waiting
+
+
+class LoadShedder:
+    """
+    Отклоняет новые поиски и скачивания, пока процесс перегружен: очередь
+    исполнителей длиннее max_queue или цикл событий отстаёт больше max_lag.
+    Лучше сразу попросить повторить позже, чем принять работу, которую
+    бот не успеет сделать.
+    """
+
+    def __init__(
+        self,
+        max_queue: Optional[int] = None,
+        max_lag: Optional[float] = None,
+        retry_after: Optional[float] = None
+    ):
+        self.max_queue = max_queue or int(os.getenv('SHED_QUEUE_DEPTH', 10))
+        self.max_lag = max_lag or float(os.getenv('SHED_LOOP_LAG', 1.0))
+        self.retry_after = retry_after or float(os.getenv('SHED_RETRY_AFTER', 10))
+
+    def check(self) -> float:
+        """0, если нагрузка в норме, иначе через сколько секунд повторить"""
+        overload = max(queue_depth() / self.max_queue, loop_monitor.lag() / self.max_lag)
+        if overload < 1:
+            return 0.0
+        # Чем сильнее перегрузка, тем дольше просим подождать
+        return min(60.0, self.retry_after * overload)
+
+
+def action_of(event: TelegramObject) -> Optional[str]:
+    """Вид запроса: поиск, скачивание или None для остальных обновлений"""
+    if isinstance(event, CallbackQuery):
+        return DOWNLOAD if (event.data or '').startswith(('download_', 'batch_')) else None
+
+    if isinstance(event, Message) and event.text:
+        text = event.text
+        # Deep link из inline-режима: /start dl_<id> и /start q_<запрос>
+        if text.startswith('/start dl_'):
+            return DOWNLOAD
+        if text.startswith('/start q_'):
+            return SEARCH
+        if not text.startswith('/'):
+            return SEARCH
+    return None
+
+
+class RateLimitMiddleware(BaseMiddleware):
+    """
+    Внешний middleware для message и callback_query: лимиты на пользователя
+    для поисков и скачиваний и общий сброс нагрузки.
+
+    При запуске через supervisor.py обновления одного чата всегда попадают в
+    один воркер, поэтому лимиты пользователя в памяти процесса достаточно.
+    """
+
+    def __init__(self, shedder: Optional[LoadShedder] = None):
+        self.shedder = shedder or LoadShedder()
+        self.limiters = {
+            SEARCH: UserRateLimiter(
+                SEARCH,
+                per_minute=float(os.getenv('RATE_SEARCH_PER_MIN', 10)),
+                burst=float(os.getenv('RATE_SEARCH_BURST', 5))
+            ),
+            DOWNLOAD: UserRateLimiter(
+                DOWNLOAD,
+                per_minute=float(os.getenv('RATE_DOWNLOAD_PER_MIN', 10)),
+                burst=float(os.getenv('RATE_DOWNLOAD_BURST', 5))
+            ),
+        }
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        action = action_of(event)
+        user = getattr(event, 'from_user', None)
+        if action is None or user is None:
+            return await handler(event, data)
+
+        retry_after = self.shedder.check()
+        if retry_after:
+            REJECTED.inc(action=action, reason='overload')
+            logger.warning(f"Перегрузка: {action} от {user.id} отклонён, повтор через {retry_after:.0f} сек")
+            await self._reject(event, f"⏳ Бот сейчас перегружен, попробуй через {math.ceil(retry_after)} сек")
+            return None
+
+        limiter = self.limiters[action]
+        retry_after = limiter.check(user.id)
+        if retry_after:
+            REJECTED.inc(action=action, reason='user')
+            logger.debug(f"Лимит {action} для {user.id}: повтор через {retry_after:.0f} сек")
+            if limiter.should_warn(user.id, retry_after) or isinstance(event, CallbackQuery):
+                await self._reject(event, f"⏳ Слишком много запросов, попробуй через {math.ceil(retry_after)} сек")
+            return None
+
+        return await handler(event, data)
+
+    @staticmethod
+    async def _reject(event: TelegramObject, text: str):
+        try:
+            if isinstance(event, CallbackQuery):
+                # На нажатие кнопки всё равно нужно ответить, иначе она «крутится»
+                await event.answer(text, show_alert=False)
+            else:
+                await event.answer(text)
+        except Exception as e:
+            logger.debug(f"Не удалось отправить отказ: {e}")
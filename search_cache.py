@@ -0,0 +1,109 @@
+"""
+Кэш результатов поиска с объединением одинаковых одновременных запросов
+"""
+import asyncio
+import copy
+import os
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SearchCache:
+    """
+    LRU-кэш результатов поиска с временем жизни записей.
+
+    Пока поиск по ключу выполняется, повторные запросы с тем же ключом
+    ждут его результат, а не запускают свой.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, ttl: Optional[float] = None):
+        self.max_entries = max_entries or int(os.getenv('SEARCH_CACHE_SIZE', 500))
+        self.ttl = ttl or float(os.getenv('SEARCH_CACHE_TTL', 1800))
+
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+        # Метрики
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def peek(self, key: str) -> Optional[List[dict]]:
+        """Результат из кэша без запуска поиска"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        stored_at, tracks = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return copy.deepcopy(tracks)
+
+    def put(self, key: str, tracks: List[dict]):
+        self._entries[key] = (time.monotonic(), copy.deepcopy(tracks))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_search(self, key: str, search: Callable[[], Awaitable[List[dict]]]) -> List[dict]:
+        """Возвращает результат из кэша или выполняет поиск (один на ключ)"""
+        cached = self.peek(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.coalesced += 1
+            try:
+                tracks = await asyncio.shield(in_flight)
+            except asyncio.CancelledError:
+                # Отменили исходный поиск, а не нас - ищем сами
+                if not in_flight.cancelled():
+                    raise
+                return await self.get_or_search(key, search)
+            return copy.deepcopy(tracks)
+
+        self.misses += 1
+        future = asyncio.get_event_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            tracks = await search()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передано ожидающим, не оставляем его "неполученным"
+            future.exception()
+            raise
+        else:
+            future.set_result(tracks)
+            # Пустой результат может быть следствием ошибки источника - не кэшируем
+            if tracks:
+                self.put(key, tracks)
+        finally:
+            self._in_flight.pop(key, None)
+
+        return copy.deepcopy(tracks)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+# Общий кэш поиска на процесс
+search_cache = SearchCache()
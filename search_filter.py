@@ -0,0 +1,108 @@
+"""
+Фильтрация и ранжирование результатов поиска YouTube до показа пользователю
+"""
+import os
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from media_processor import (
+    BITRATE_TIERS, SIZE_SAFETY_MARGIN, SOURCE_BITRATE, TELEGRAM_UPLOAD_LIMIT, estimate_size, media_processor
+)
+
+logger = logging.getLogger(__name__)
+
+# Ранги результатов: внутри ранга сохраняется порядок релевантности YouTube
+FITS = 0          # помещается в лимит Telegram как есть
+COMPRESSED = 1    # поместится после перекодирования - дольше
+UNKNOWN = 2       # длительность неизвестна
+UNSENDABLE = 3    # заведомо больше лимита (только при SEARCH_UNSENDABLE=label)
+RANKS = 4
+
+UNSENDABLE_NOTE = '🚫 '
+
+LIVE_STATUSES = ('is_live', 'is_upcoming', 'post_live')
+
+
+@dataclass
+class Verdict:
+    rank: int
+    # Причина, по которой результат не показывается
+    reason: Optional[str] = None
+
+
+# Вердикты без причины одинаковы - не создаём их на каждый результат
+_FITS, _COMPRESSED, _UNKNOWN, _LABELED = Verdict(FITS), Verdict(COMPRESSED), Verdict(UNKNOWN), Verdict(UNSENDABLE)
+
+
+def max_duration_for(bitrate: float) -> float:
+    """Самый длинный трек (сек), который при этом битрейте помещается в лимит Telegram"""
+    return TELEGRAM_UPLOAD_LIMIT * SIZE_SAFETY_MARGIN / (bitrate * 1000 / 8)
+
+
+def is_live(entry: dict) -> bool:
+    return bool(entry.get('is_live')) or entry.get('live_status') in LIVE_STATUSES
+
+
+def is_playlist(entry: dict) -> bool:
+    """Плейлист или канал в выдаче ytsearch: скачать их одним треком нельзя"""
+    if entry.get('_type') in ('playlist', 'multi_video') or entry.get('ie_key') == 'YoutubeTab':
+        return True
+    url = entry.get('url') or ''
+    return '/playlist?' in url or '/channel/' in url or '/@' in url
+
+
+class SearchFilter:
+    """
+    Отбрасывает результаты, которые бот не сможет отправить, и ставит
+    в конец те, что отправятся медленно.
+
+    Размер оценивается по длительности и ожидаемому битрейту (без запросов
+    к YouTube). Трек больше лимита Telegram остаётся, только если ffmpeg
+    может его пережать; иначе он отбрасывается или, при
+    SEARCH_UNSENDABLE=label, помечается и показывается последним.
+    """
+
+    def __init__(
+        self,
+        min_duration: Optional[int] = None,
+        max_duration: Optional[int] = None,
+        exclude_live: Optional[bool] = None,
+        unsendable: Optional[str] = None
+    ):
+        self.min_duration = min_duration if min_duration is not None else int(os.getenv('SEARCH_MIN_DURATION', 30))
+        # 0 - длительность ограничивает только лимит Telegram
+        self.max_duration = max_duration if max_duration is not None else int(os.getenv('SEARCH_MAX_DURATION', 0))
+        self.exclude_live = exclude_live if exclude_live is not None else os.getenv('SEARCH_EXCLUDE_LIVE', '1') != '0'
+        self.unsendable = unsendable or os.getenv('SEARCH_UNSENDABLE', 'drop')
+
+        # Границы по длительности вместо оценки размера каждого результата
+        self.fits_duration = max_duration_for(SOURCE_BITRATE)
+        self.compressible_duration = max_duration_for(BITRATE_TIERS[-1])
+
+    def check(self, entry: dict) -> Verdict:
+        if is_playlist(entry):
+            return Verdict(UNSENDABLE, reason='плейлист или канал')
+        if self.exclude_live and is_live(entry):
+            return Verdict(UNSENDABLE, reason='трансляция')
+
+        duration = entry.get('duration')
+        if not duration:
+            return _UNKNOWN
+        if duration < self.min_duration:
+            return Verdict(UNSENDABLE, reason=f'короче {self.min_duration} сек')
+        if self.max_duration and duration > self.max_duration:
+            return Verdict(UNSENDABLE, reason=f'длиннее {self.max_duration} сек')
+
+        if duration <= self.fits_duration:
+            return _FITS
+        if media_processor.available and duration <= self.compressible_duration:
+            return _COMPRESSED
+
+        if self.unsendable == 'label':
+            return _LABELED
+        return Verdict(UNSENDABLE, reason=f'~{estimate_size(duration) / 1024 / 1024:.0f} МБ, больше лимита Telegram')
+
+
+# Общий фильтр на процесс
+search_filter = SearchFilter()
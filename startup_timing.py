@@ -0,0 +1,69 @@
+"""
+Замеры времени запуска бота: импорты, инициализация, первый ответ
+"""
+import os
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _process_age() -> float:
+    """Сколько секунд назад запущен процесс (0, если узнать нельзя)"""
+    try:
+        with open('/proc/self/stat') as f:
+            # starttime - 22-е поле, после имени процесса в скобках
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class StartupTimer:
+    """Последовательные этапы запуска: каждый mark() закрывает этап, начатый предыдущим"""
+
+    def __init__(self):
+        now = time.perf_counter()
+        self._origin = now - _process_age()
+        self._last = now
+        self.phases: List[Tuple[str, float]] = [('interpreter', now - self._origin)]
+        self.first_response: Optional[float] = None
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def since_start(self) -> float:
+        return time.perf_counter() - self._origin
+
+    def report(self, title: str = "Время запуска"):
+        breakdown = ', '.join(f"{name} {seconds:.2f}с" for name, seconds in self.phases)
+        logger.info(f"⏱ {title}: {self.since_start():.2f} сек ({breakdown})")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'phases': {name: round(seconds, 3) for name, seconds in self.phases},
+            'first_response': round(self.first_response, 3) if self.first_response is not None else None,
+        }
+
+
+# Создаётся при первом импорте - bot.py импортирует модуль раньше тяжёлых зависимостей
+startup_timer = StartupTimer()
+
+
+async def first_update_middleware(
+    handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+    event: Any,
+    data: Dict[str, Any]
+) -> Any:
+    """Запоминает, через сколько после запуска процесса бот ответил на первое обновление"""
+    try:
+        return await handler(event, data)
+    finally:
+        if startup_timer.first_response is None:
+            startup_timer.first_response = startup_timer.since_start()
+            logger.info(f"⏱ Первое обновление обработано через {startup_timer.first_response:.2f} сек после запуска")
@@ -0,0 +1,418 @@
+"""
+Запуск бота в нескольких процессах с разделением чатов по воркерам
+
+Супервизор один получает обновления (polling) и раздаёт их воркерам по
+хэшу ID чата, поэтому состояние FSM чата всегда живёт в одном процессе.
+Каждый воркер - отдельный процесс со своим циклом событий и Dispatcher из
+bot.py, так что yt-dlp, разбор HTML и запись статистики не делят один GIL.
+
+Запуск:
+    python supervisor.py --workers 4
+
+Сигналы:
+    SIGTERM, SIGINT - остановка: воркеры дорабатывают уже полученные обновления
+    SIGHUP          - поочерёдный перезапуск воркеров без потери обновлений
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import logging
+import queue
+import signal
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Как часто воркеры сообщают о себе (сек) и через сколько без сообщений воркер считается зависшим
+HEARTBEAT_INTERVAL = float(os.getenv('WORKER_HEARTBEAT_INTERVAL', 5))
+HEARTBEAT_TIMEOUT = float(os.getenv('WORKER_HEARTBEAT_TIMEOUT', 30))
+# Сколько ждать завершения обработки обновлений при остановке воркера (сек)
+SHUTDOWN_GRACE = float(os.getenv('WORKER_SHUTDOWN_GRACE', 60))
+# Максимальная пауза перед повторным запуском упавшего воркера (сек)
+RESTART_BACKOFF_MAX = 60
+
+# Сигнал воркеру: дообработать очередь и завершиться
+STOP = None
+
+
+def chat_id_of(update: Dict[str, Any]) -> int:
+    """ID чата обновления (или пользователя, если чата у события нет)"""
+    for key, event in update.items():
+        if not isinstance(event, dict):
+            continue
+        chat = event.get('chat') or (event.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+        user = event.get('from') or event.get('user')
+        if user:
+            return user['id']
+    return 0
+
+
+def shard_of(chat_id: int, workers: int) -> int:
+    # hash() от int в Python - само число, crc32 равномернее для соседних ID
+    return zlib.crc32(str(chat_id).encode()) % workers
+
+
+# --- Воркер ---
+
+def worker_main(index: int, workers: int, updates: multiprocessing.Queue, status: multiprocessing.Queue, log_queue):
+    os.environ['BOT_WORKER_INDEX'] = str(index)
+
+    # До импорта bot.py: он сам настроил бы запись в bot.log, а файл пишет только супервизор
+    from logging_setup import setup_worker_logging
+    setup_worker_logging(log_queue)
+
+    try:
+        asyncio.run(_worker(index, workers, updates, status))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _worker(index: int, workers: int, updates: multiprocessing.Queue, status: multiprocessing.Queue):
+    # SIGINT от терминала получает вся группа процессов - останавливает супервизор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    import bot as app
+    import metrics
+    from health_monitor import health_monitor, warm_up_and_monitor
+    from http_pool import close_http_pool, start_http_pool
+    from loop_monitor import loop_monitor
+
+    loop_monitor.start()
+    await start_http_pool()
+    warm_up_task = asyncio.create_task(warm_up_and_monitor())
+
+    loop = asyncio.get_running_loop()
+    parent = multiprocessing.parent_process()
+    in_flight = set()
+    counters = {'handled': 0, 'failed': 0}
+
+    # Очередь читает отдельный поток: в пуле по умолчанию он навсегда занял бы слот yt-dlp
+    received: asyncio.Queue = asyncio.Queue()
+    reader_stopped = threading.Event()
+
+    def read_updates():
+        while not reader_stopped.is_set():
+            try:
+                update = updates.get(timeout=1)
+            except queue.Empty:
+                if parent is None or parent.is_alive():
+                    continue
+                update = STOP
+            try:
+                loop.call_soon_threadsafe(received.put_nowait, update)
+            except RuntimeError:
+                # Цикл событий уже закрыт
+                return
+            if update is STOP:
+                return
+
+    async def handle(update: dict):
+        try:
+            await app.dp.feed_raw_update(app.bot, update)
+            counters['handled'] += 1
+        except Exception as e:
+            counters['failed'] += 1
+            logger.error(f"Воркер {index}: ошибка обработки обновления: {e}", exc_info=True)
+
+    async def heartbeat():
+        while True:
+            status.put({
+                'index': index,
+                'pid': os.getpid(),
+                'time': time.time(),
+                'in_flight': len(in_flight),
+                **counters,
+                'sources': health_monitor.snapshot(),
+                'loop': loop_monitor.snapshot(),
+                'metrics': metrics.render(),
+            })
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    reader = threading.Thread(target=read_updates, name=f'update-reader-{index}', daemon=True)
+    reader.start()
+    heartbeat_task = asyncio.create_task(heartbeat())
+    # Прерванные скачивания возобновляет воркер, которому принадлежит чат
+    resume_task = asyncio.create_task(
+        app.resume_download_jobs(lambda job: shard_of(job.chat_id, workers) == index)
+    )
+    logger.info(f"Воркер {index} запущен (pid {os.getpid()})")
+
+    try:
+        while True:
+            update = await received.get()
+            if update is STOP:
+                break
+            task = asyncio.create_task(handle(update))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+
+        if in_flight:
+            logger.info(f"Воркер {index}: дожидаемся {len(in_flight)} обновлений")
+            await asyncio.wait(in_flight, timeout=SHUTDOWN_GRACE)
+    finally:
+        reader_stopped.set()
+        heartbeat_task.cancel()
+        resume_task.cancel()
+        warm_up_task.cancel()
+        await health_monitor.stop()
+        await loop_monitor.stop()
+        await app.bot.session.close()
+        await close_http_pool()
+        logger.info(f"Воркер {index} остановлен")
+
+
+# --- Супервизор ---
+
+class WorkerHandle:
+    def __init__(self, index: int, context):
+        self.index = index
+        # Очередь переживает перезапуск воркера: обновления дождутся нового процесса
+        self.updates = context.Queue()
+        self.process: Optional[multiprocessing.Process] = None
+        self.restarts = 0
+        self.started_at = 0.0
+        self.last_status: dict = {}
+        self.restarting = False
+
+
+class Supervisor:
+    """Получает обновления, раздаёт их воркерам и следит за их здоровьем"""
+
+    def __init__(self, workers: int, log_queue):
+        self._context = multiprocessing.get_context('spawn')
+        self.log_queue = log_queue
+        self.status = self._context.Queue()
+        self.workers = [WorkerHandle(index, self._context) for index in range(workers)]
+        self._stopping = asyncio.Event()
+
+    def start_worker(self, worker: WorkerHandle):
+        worker.process = self._context.Process(
+            target=worker_main,
+            args=(worker.index, len(self.workers), worker.updates, self.status, self.log_queue),
+            name=f"bot-worker-{worker.index}"
+        )
+        worker.process.start()
+        worker.started_at = time.time()
+        worker.last_status = {}
+        logger.info(f"Запущен воркер {worker.index} (pid {worker.process.pid})")
+
+    async def stop_worker(self, worker: WorkerHandle, timeout: float = SHUTDOWN_GRACE + 10):
+        """Просит воркер завершиться после уже полученных обновлений"""
+        process = worker.process
+        if process is None or not process.is_alive():
+            return
+        worker.updates.put(STOP)
+        deadline = time.monotonic() + timeout
+        while process.is_alive() and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+        if process.is_alive():
+            logger.warning(f"Воркер {worker.index} не завершился за {timeout:.0f} сек, останавливаем принудительно")
+            process.terminate()
+        process.join(5)
+
+    async def rolling_restart(self):
+        """Перезапускает воркеры по одному; обновления их чатов ждут в очереди"""
+        logger.info("Поочерёдный перезапуск воркеров")
+        for worker in self.workers:
+            if self._stopping.is_set():
+                return
+            worker.restarting = True
+            try:
+                await self.stop_worker(worker)
+                self.start_worker(worker)
+            finally:
+                worker.restarting = False
+
+    def dispatch(self, update: dict):
+        worker = self.workers[shard_of(chat_id_of(update), len(self.workers))]
+        worker.updates.put(update)
+
+    async def poll(self, bot, allowed_updates: List[str]):
+        """Единственный getUpdates на все воркеры"""
+        from aiogram.methods import GetUpdates
+
+        offset = None
+        while not self._stopping.is_set():
+            try:
+                updates = await bot(GetUpdates(offset=offset, timeout=30, allowed_updates=allowed_updates))
+            except Exception as e:
+                logger.error(f"Ошибка получения обновлений: {e}")
+                await asyncio.sleep(5)
+                continue
+
+            for update in updates:
+                offset = update.update_id + 1
+                self.dispatch(update.model_dump(mode='json', by_alias=True, exclude_none=True))
+
+    async def watch(self):
+        """Принимает heartbeat воркеров и перезапускает упавшие"""
+        while not self._stopping.is_set():
+            while True:
+                try:
+                    message = self.status.get_nowait()
+                except queue.Empty:
+                    break
+                self.workers[message['index']].last_status = message
+
+            for worker in self.workers:
+                if worker.restarting or worker.process is None or worker.process.is_alive():
+                    continue
+                worker.restarts += 1
+                delay = min(RESTART_BACKOFF_MAX, 2 ** min(worker.restarts, 6))
+                # Воркер, проработавший дольше паузы, падает не в цикле - перезапускаем сразу
+                if time.time() - worker.started_at > delay:
+                    delay = 0
+                logger.error(
+                    f"Воркер {worker.index} завершился с кодом {worker.process.exitcode}, "
+                    f"перезапуск через {delay} сек"
+                )
+                worker.restarting = True
+                asyncio.get_running_loop().call_later(delay, self._restart_after_crash, worker)
+
+            await asyncio.sleep(1)
+
+    def _restart_after_crash(self, worker: WorkerHandle):
+        worker.restarting = False
+        if not self._stopping.is_set():
+            self.start_worker(worker)
+
+    def worker_health(self, worker: WorkerHandle) -> dict:
+        status = worker.last_status
+        alive = bool(worker.process and worker.process.is_alive())
+        age = time.time() - status['time'] if status else None
+        try:
+            backlog = worker.updates.qsize()
+        except NotImplementedError:
+            backlog = None
+        return {
+            'index': worker.index,
+            'pid': worker.process.pid if worker.process else None,
+            'alive': alive,
+            'healthy': alive and age is not None and age < HEARTBEAT_TIMEOUT,
+            'restarts': worker.restarts,
+            'heartbeat_age': round(age, 1) if age is not None else None,
+            'backlog': backlog,
+            'in_flight': status.get('in_flight'),
+            'handled': status.get('handled'),
+            'failed': status.get('failed'),
+            'loop': status.get('loop'),
+        }
+
+    # --- HTTP ---
+
+    async def health_check(self, request):
+        return web.Response(text="Bot is alive! 🎵", status=200)
+
+    async def health_endpoint(self, request):
+        workers = [self.worker_health(worker) for worker in self.workers]
+        latest = max((w.last_status for w in self.workers if w.last_status), key=lambda s: s['time'], default={})
+        return web.json_response({
+            'status': 'alive' if all(w['healthy'] for w in workers) else 'degraded',
+            'workers': workers,
+            'sources': latest.get('sources', {}),
+            'timestamp': datetime.now().isoformat()
+        })
+
+    async def metrics_endpoint(self, request):
+        import metrics
+
+        texts = {w.index: w.last_status.get('metrics', '') for w in self.workers if w.last_status}
+        return web.Response(body=merge_metrics(texts).encode('utf-8'), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+    async def start_web_server(self) -> web.AppRunner:
+        app = web.Application()
+        app.router.add_get('/', self.health_check)
+        app.router.add_get('/health', self.health_endpoint)
+        app.router.add_get('/metrics', self.metrics_endpoint)
+
+        port = int(os.getenv('PORT', 8080))
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '0.0.0.0', port).start()
+        logger.info(f"🌐 HTTP сервер супервизора запущен на порту {port}")
+        return runner
+
+    async def run(self):
+        from aiogram import Bot
+        import bot as app
+
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, self._stopping.set)
+        loop.add_signal_handler(signal.SIGINT, self._stopping.set)
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(self.rolling_restart()))
+
+        for worker in self.workers:
+            self.start_worker(worker)
+
+        web_runner = await self.start_web_server()
+        poller = Bot(token=app.BOT_TOKEN)
+        await poller.delete_webhook(drop_pending_updates=True)
+
+        tasks = [
+            asyncio.create_task(self.poll(poller, app.dp.resolve_used_update_types())),
+            asyncio.create_task(self.watch()),
+        ]
+        logger.info(f"🚀 Супервизор запущен: {len(self.workers)} воркеров")
+
+        try:
+            await self._stopping.wait()
+        finally:
+            logger.info("Остановка супервизора...")
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await asyncio.gather(*(self.stop_worker(worker) for worker in self.workers))
+            await poller.session.close()
+            await web_runner.cleanup()
+
+
+def merge_metrics(texts: Dict[int, str]) -> str:
+    """Объединяет вывод /metrics воркеров, добавляя метку worker к каждому значению"""
+    families: Dict[str, dict] = {}
+    for index, text in sorted(texts.items()):
+        name = None
+        for line in text.splitlines():
+            if line.startswith('# HELP ') or line.startswith('# TYPE '):
+                name = line.split(' ', 3)[2]
+                family = families.setdefault(name, {'header': [], 'samples': []})
+                if line not in family['header']:
+                    family['header'].append(line)
+            elif line and name:
+                metric, sep, rest = line.partition('{')
+                if sep:
+                    labeled = f'{metric}{{worker="{index}",{rest}'
+                else:
+                    metric, _, value = line.partition(' ')
+                    labeled = f'{metric}{{worker="{index}"}} {value}'
+                families[name]['samples'].append(labeled)
+
+    lines = []
+    for family in families.values():
+        lines.extend(family['header'])
+        lines.extend(family['samples'])
+    return '\n'.join(lines) + '\n'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Бот в нескольких процессах")
+    parser.add_argument(
+        '--workers', type=int, default=int(os.getenv('BOT_WORKERS', os.cpu_count() or 1)),
+        help='число воркеров (по умолчанию BOT_WORKERS или число CPU)'
+    )
+    args = parser.parse_args()
+
+    # Записи воркеров идут в ту же очередь, bot.log пишет один процесс
+    from logging_setup import setup_logging
+    log_queue = multiprocessing.get_context('spawn').Queue()
+    setup_logging('bot.log', log_queue=log_queue)
+
+    asyncio.run(Supervisor(max(1, args.workers), log_queue).run())
@@ -0,0 +1,150 @@
+"""
+Дисковый кэш аудио: LRU по объёму, восстановление индекса, временные файлы
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_cache import AudioCache
+
+
+def cached_keys(cache: AudioCache) -> list:
+    return list(cache._index)
+
+
+def test_evicts_least_recently_used_by_bytes(tmp_path):
+    cache = AudioCache(str(tmp_path), max_bytes=300, shared=False)
+    cache.put('a', b'a' * 100)
+    cache.put('b', b'b' * 100)
+    cache.put('c', b'c' * 100)
+
+    # Чтение делает 'a' самым свежим - вытесняется 'b'
+    assert cache.get('a') == b'a' * 100
+    cache.put('d', b'd' * 100)
+
+    assert cached_keys(cache) == ['c', 'a', 'd']
+    assert cache.total_bytes == 300
+    assert cache.evictions == 1
+    assert not os.path.exists(cache._path('b'))
+    assert cache.get('b') is None
+
+
+def test_large_put_evicts_several_entries(tmp_path):
+    cache = AudioCache(str(tmp_path), max_bytes=300, shared=False)
+    for key in 'abc':
+        cache.put(key, b'x' * 100)
+
+    cache.put('big', b'y' * 250)
+
+    assert cached_keys(cache) == ['big']
+    assert cache.total_bytes == 250
+
+
+def test_file_bigger_than_budget_is_not_cached(tmp_path):
+    cache = AudioCache(str(tmp_path), max_bytes=100, shared=False)
+    cache.put('huge', b'x' * 101)
+
+    assert cache.get('huge') is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_disabled_cache_stores_nothing(tmp_path):
+    cache = AudioCache(str(tmp_path / 'off'), max_bytes=0, shared=False)
+    cache.put('a', b'x')
+
+    assert cache.get('a') is None
+    assert not os.path.exists(tmp_path / 'off')
+
+
+def test_index_is_rebuilt_after_restart_in_access_order(tmp_path):
+    cache = AudioCache(str(tmp_path), max_bytes=1000, shared=False)
+    cache.put('old', b'o' * 100)
+    cache.put('new', b'n' * 200)
+    now = time.time()
+    os.utime(cache._path('old'), (now - 100, now - 100))
+    os.utime(cache._path('new'), (now, now))
+
+    restarted = AudioCache(str(tmp_path), max_bytes=1000, shared=False)
+
+    assert cached_keys(restarted) == ['old', 'new']
+    assert restarted.total_bytes == 300
+    assert restarted.get('new') == b'n' * 200
+
+
+def test_restart_with_smaller_budget_evicts_oldest(tmp_path):
+    cache = AudioCache(str(tmp_path), max_bytes=1000, shared=False)
+    cache.put('old', b'o' * 100)
+    cache.put('new', b'n' * 100)
+    now = time.time()
+    os.utime(cache._path('old'), (now - 100, now - 100))
+
+    restarted = AudioCache(str(tmp_path), max_bytes=150, shared=False)
+
+    assert cached_keys(restarted) == ['new']
+    assert not os.path.exists(cache._path('old'))
+
+
+def test_leftover_tmp_files_are_removed_on_start(tmp_path):
+    (tmp_path / '.tmpcrashed').write_bytes(b'partial')
+    (tmp_path / 'notes.txt').write_bytes(b'unrelated')
+
+    cache = AudioCache(str(tmp_path), max_bytes=1000, shared=False)
+
+    assert sorted(os.listdir(tmp_path)) == ['notes.txt']
+    assert cache.total_bytes == 0
+
+
+def test_shared_cache_keeps_fresh_tmp_files_of_other_workers(tmp_path):
+    fresh = tmp_path / '.tmpwriting'
+    stale = tmp_path / '.tmpstale'
+    fresh.write_bytes(b'in progress')
+    stale.write_bytes(b'crashed')
+    old = time.time() - AudioCache.STALE_TMP_SECONDS - 10
+    os.utime(stale, (old, old))
+
+    AudioCache(str(tmp_path), max_bytes=1000, shared=True)
+
+    assert fresh.exists()
+    assert not stale.exists()
+
+
+def test_shared_cache_reads_file_written_by_other_worker(tmp_path):
+    first = AudioCache(str(tmp_path), max_bytes=1000, shared=True)
+    second = AudioCache(str(tmp_path), max_bytes=1000, shared=True)
+    second.put('a', b'a' * 100)
+
+    assert first.get('a') == b'a' * 100
+    assert cached_keys(first) == ['a']
+    assert first.total_bytes == 100
+    assert first.hits == 1
+
+    assert first.get('missing') is None
+    assert first.misses == 1
+
+
+def test_shared_cache_rescans_only_when_over_budget_or_stale(tmp_path, monkeypatch):
+    first = AudioCache(str(tmp_path), max_bytes=300, shared=True)
+    second = AudioCache(str(tmp_path), max_bytes=300, shared=True)
+    rescans = []
+    original_rescan = first._rescan
+    monkeypatch.setattr(first, '_rescan', lambda: rescans.append(1) or original_rescan())
+
+    first.put('a', b'a' * 100)
+    assert rescans == []
+
+    # Чужие файлы не видны, пока свой индекс в бюджете и пересканирование не устарело
+    second.put('b', b'b' * 100)
+    second.put('c', b'c' * 100)
+    first._rescanned_at -= AudioCache.RESCAN_SECONDS
+    first.put('d', b'd' * 100)
+
+    assert rescans == [1]
+    # Бюджет соблюдается для всего каталога
+    assert first.total_bytes <= 300
+    assert len([name for name in os.listdir(tmp_path) if name.endswith(AudioCache.SUFFIX)]) == 3
+
+    first.put('e', b'e' * 100)
+    assert rescans == [1, 1]
+    assert first.total_bytes <= 300
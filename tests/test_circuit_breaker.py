@@ -0,0 +1,126 @@
+"""
+Выключатель источника: переходы closed -> open -> half_open -> closed
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import circuit_breaker
+from circuit_breaker import CircuitBreaker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, 'monotonic', clock)
+    return clock
+
+
+def make_breaker() -> CircuitBreaker:
+    return CircuitBreaker('test', failure_threshold=3, window=60, cooldown=30)
+
+
+def open_breaker(breaker: CircuitBreaker):
+    for _ in range(breaker.failure_threshold):
+        assert breaker.allow_request()
+        breaker.record_failure()
+
+
+def test_opens_after_threshold_within_window(clock):
+    breaker = make_breaker()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.is_open()
+    assert not breaker.allow_request()
+    assert breaker.rejected == 1
+    assert breaker.opened_count == 1
+
+
+def test_old_failures_fall_out_of_window(clock):
+    breaker = make_breaker()
+    breaker.record_failure()
+    breaker.record_failure()
+    clock.now += 61
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_full_cycle_closes_after_successful_probe(clock):
+    breaker = make_breaker()
+    open_breaker(breaker)
+
+    clock.now += 30
+    assert breaker.allow_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Пока пробный запрос выполняется, остальные пропускают источник
+    assert not breaker.allow_request()
+    assert breaker.is_open()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow_request()
+    assert not breaker.is_open()
+
+
+def test_failed_probe_reopens_for_another_cooldown(clock):
+    breaker = make_breaker()
+    open_breaker(breaker)
+
+    clock.now += 30
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opened_count == 2
+
+    clock.now += 29
+    assert not breaker.allow_request()
+    clock.now += 1
+    assert breaker.allow_request()
+
+
+def test_hung_probe_allows_another_after_cooldown(clock):
+    breaker = make_breaker()
+    open_breaker(breaker)
+
+    clock.now += 30
+    assert breaker.allow_request()
+    clock.now += 30
+    assert breaker.allow_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_late_success_during_cooldown_keeps_breaker_open(clock):
+    breaker = make_breaker()
+    open_breaker(breaker)
+
+    # Ответ запроса, начатого до отключения
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+
+
+def test_any_success_after_cooldown_closes(clock):
+    breaker = make_breaker()
+    open_breaker(breaker)
+
+    clock.now += 30
+    assert breaker.allow_request()
+    # Успех пришёл не от пробного запроса, но уже после паузы:
+    # источник отвечает, поэтому выключатель закрывается
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
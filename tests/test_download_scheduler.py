@@ -0,0 +1,140 @@
+"""
+Очередь скачиваний: короткие треки первыми, старение и отмена ожидающих
+"""
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import download_scheduler as scheduler_module
+from download_scheduler import DownloadScheduler
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    # Подменяем только время планировщика: часы цикла событий должны идти
+    monkeypatch.setattr(scheduler_module, 'time', SimpleNamespace(monotonic=clock))
+    return clock
+
+
+def make_scheduler() -> DownloadScheduler:
+    return DownloadScheduler(max_workers=1, bitrate_kbps=128, aging=1.0)
+
+
+async def wait_in_queue(scheduler: DownloadScheduler, name: str, duration: float, order: list):
+    await scheduler.acquire(duration)
+    order.append(name)
+    scheduler.release()
+
+
+async def run_queue(scheduler: DownloadScheduler, clock: Clock, jobs: list) -> list:
+    """Занимает единственный слот, ставит jobs (имя, длительность, задержка) в очередь и отпускает слот"""
+    order = []
+    await scheduler.acquire()
+    tasks = []
+    for name, duration, delay in jobs:
+        clock.now += delay
+        tasks.append(asyncio.create_task(wait_in_queue(scheduler, name, duration, order)))
+        await asyncio.sleep(0)
+    assert scheduler.queued == len(jobs)
+
+    scheduler.release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_free_slot_is_taken_immediately():
+    scheduler = DownloadScheduler(max_workers=2)
+
+    async def scenario():
+        await scheduler.acquire(600)
+        await scheduler.acquire(600)
+        return scheduler.active, scheduler.queued
+
+    assert asyncio.run(scenario()) == (2, 0)
+
+
+def test_short_job_overtakes_long_one(clock):
+    scheduler = make_scheduler()
+    jobs = [('long', 600, 0), ('short', 60, 1)]
+
+    assert asyncio.run(run_queue(scheduler, clock, jobs)) == ['short', 'long']
+    assert scheduler.active == 0
+
+
+def test_unknown_duration_counts_as_typical_song(clock):
+    scheduler = make_scheduler()
+    jobs = [('long', 600, 0), ('unknown', None, 0), ('short', 60, 0)]
+
+    assert asyncio.run(run_queue(scheduler, clock, jobs)) == ['short', 'unknown', 'long']
+
+
+def test_long_job_wins_after_aging(clock):
+    scheduler = make_scheduler()
+    # Разница стоимостей в МБ = сколько секунд ожидания её компенсируют при aging=1
+    head_start = scheduler.expected_cost(600) - scheduler.expected_cost(60)
+    jobs = [('long', 600, 0), ('short', 60, head_start + 1)]
+
+    assert asyncio.run(run_queue(scheduler, clock, jobs)) == ['long', 'short']
+
+
+def test_cancelled_waiter_with_granted_slot_passes_it_on():
+    scheduler = make_scheduler()
+    order = []
+
+    async def scenario():
+        await scheduler.acquire()
+        first = asyncio.create_task(wait_in_queue(scheduler, 'first', 60, order))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(wait_in_queue(scheduler, 'second', 600, order))
+        await asyncio.sleep(0)
+
+        # Слот передан первому, но его отменили раньше, чем он проснулся
+        scheduler.release()
+        first.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        # Без передачи слота второй ждал бы вечно
+        await asyncio.wait_for(second, 1)
+
+    asyncio.run(scenario())
+    assert order == ['second']
+    assert scheduler.active == 0
+    assert scheduler.queued == 0
+
+
+def test_cancelled_waiter_before_grant_is_skipped():
+    scheduler = make_scheduler()
+    order = []
+
+    async def scenario():
+        await scheduler.acquire()
+        first = asyncio.create_task(wait_in_queue(scheduler, 'first', 60, order))
+        second = asyncio.create_task(wait_in_queue(scheduler, 'second', 600, order))
+        await asyncio.sleep(0)
+
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert scheduler.queued == 1
+
+        scheduler.release()
+        await asyncio.wait_for(second, 1)
+
+    asyncio.run(scenario())
+    assert order == ['second']
+    assert scheduler.active == 0
@@ -0,0 +1,153 @@
+"""
+Очередь заданий на скачивание: переходы состояний, повторные нажатия, возобновление
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import job_queue
+from job_queue import DownloadJobQueue
+
+TRACK = {'title': 'Песня', 'source': 'mp3wr', 'url': 'https://example.com/track/1'}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(job_queue.time, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'bot.db')
+
+
+def test_running_sent_done(db_path):
+    queue = DownloadJobQueue(db_path)
+    job = queue.start(1, 10, 100, TRACK)
+    assert job.state == DownloadJobQueue.RUNNING
+    assert job.attempts == 1
+    assert job.track == TRACK
+
+    assert queue.mark_sent(job.id)
+    assert queue.get(job.id).state == DownloadJobQueue.SENT
+    assert queue.complete(job.id)
+    assert queue.get(job.id).state == DownloadJobQueue.DONE
+
+    # Повторное завершение ничего не меняет
+    assert not queue.complete(job.id)
+    assert not queue.fail(job.id, 'late')
+    assert not queue.mark_sent(job.id)
+    assert queue.get(job.id).state == DownloadJobQueue.DONE
+
+
+def test_running_failed_is_idempotent(db_path):
+    queue = DownloadJobQueue(db_path)
+    job = queue.start(1, 10, 100, TRACK)
+
+    assert queue.fail(job.id, 'DownloadFailed')
+    assert not queue.fail(job.id, 'again')
+    assert not queue.complete(job.id)
+    assert queue.get(job.id).state == DownloadJobQueue.FAILED
+
+
+def test_sent_job_cannot_fail(db_path):
+    queue = DownloadJobQueue(db_path)
+    job = queue.start(1, 10, 100, TRACK)
+    queue.mark_sent(job.id)
+
+    # Ошибка после отправки (например, при удалении прогресса) не отменяет отправку
+    assert not queue.fail(job.id, 'cleanup')
+    assert queue.get(job.id).state == DownloadJobQueue.SENT
+
+
+def test_duplicate_tap_is_ignored(db_path):
+    queue = DownloadJobQueue(db_path)
+    job = queue.start(1, 10, 100, TRACK)
+
+    # Пока задание выполняется
+    assert queue.start(1, 10, 100, TRACK) is None
+    # Тот же трек в другое сообщение - отдельное задание
+    assert queue.start(1, 11, 100, TRACK).id != job.id
+
+    queue.mark_sent(job.id)
+    queue.complete(job.id)
+    assert queue.start(1, 10, 100, TRACK) is None
+
+
+def test_failed_job_can_be_retried(db_path):
+    queue = DownloadJobQueue(db_path)
+    job = queue.start(1, 10, 100, TRACK)
+    queue.fail(job.id, 'DownloadFailed')
+
+    retry = queue.start(1, 10, 100, TRACK)
+    assert retry.id == job.id
+    assert retry.state == DownloadJobQueue.RUNNING
+    assert retry.attempts == 2
+
+
+def test_unfinished_after_restart(db_path):
+    queue = DownloadJobQueue(db_path)
+    running = queue.start(1, 10, 100, TRACK)
+    sent = queue.start(1, 11, 100, TRACK)
+    queue.mark_sent(sent.id)
+    done = queue.start(1, 12, 100, TRACK)
+    queue.complete(done.id)
+
+    # Свои выполняющиеся задания не считаются незавершёнными
+    assert queue.unfinished() == []
+
+    restarted = DownloadJobQueue(db_path)
+    unfinished = restarted.unfinished()
+    assert [job.id for job in unfinished] == [running.id, sent.id]
+    assert [job.state for job in unfinished] == [DownloadJobQueue.RUNNING, DownloadJobQueue.SENT]
+    # Зависшее задание прошлого запуска можно перезапустить тем же нажатием
+    assert restarted.start(1, 10, 100, TRACK).id == running.id
+
+
+def test_can_resume_limits(db_path, clock, monkeypatch):
+    monkeypatch.setattr(job_queue, 'JOB_MAX_ATTEMPTS', 2)
+    monkeypatch.setattr(job_queue, 'JOB_RESUME_MAX_AGE', 900)
+    queue = DownloadJobQueue(db_path)
+    job = queue.start(1, 10, 100, TRACK)
+    assert queue.can_resume(job)
+
+    clock.now += 900
+    assert not queue.can_resume(job)
+
+    clock.now -= 900
+    queue.fail(job.id, 'interrupted')
+    retried = queue.start(1, 10, 100, TRACK)
+    assert retried.attempts == 2
+    assert not queue.can_resume(retried)
+
+
+def test_prune_removes_only_old_finished_jobs(db_path, clock):
+    queue = DownloadJobQueue(db_path)
+    old_done = queue.start(1, 10, 100, TRACK)
+    queue.complete(old_done.id)
+    old_failed = queue.start(1, 11, 100, TRACK)
+    queue.fail(old_failed.id, 'DownloadFailed')
+    old_running = queue.start(1, 12, 100, TRACK)
+
+    clock.now += 100
+    fresh_done = queue.start(1, 13, 100, TRACK)
+    queue.complete(fresh_done.id)
+
+    assert queue.prune(max_age=50) == 2
+    assert queue.get(old_done.id) is None
+    assert queue.get(old_failed.id) is None
+    assert queue.get(old_running.id) is not None
+    assert queue.get(fresh_done.id) is not None
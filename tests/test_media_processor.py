@@ -0,0 +1,66 @@
+"""
+Обработка аудио перед отправкой: запасной путь при ошибках ffmpeg
+"""
+import asyncio
+import os
+import shutil
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from media_processor import MediaProcessingError, MediaProcessor, moov_after_mdat
+
+
+def box(kind: bytes, payload: bytes = b'') -> bytes:
+    return (8 + len(payload)).to_bytes(4, 'big') + kind + payload
+
+
+M4A_FASTSTART = box(b'ftyp', b'M4A ') + box(b'moov', b'\0' * 16) + box(b'mdat', b'\0' * 64)
+M4A_MOOV_AT_END = box(b'ftyp', b'M4A ') + box(b'mdat', b'\0' * 64) + box(b'moov', b'\0' * 16)
+WEBM = b'\x1a\x45\xdf\xa3' + b'\0' * 100
+
+
+def failing_processor() -> MediaProcessor:
+    """Процессор, у которого ffmpeg всегда завершается с ошибкой"""
+    processor = MediaProcessor(max_workers=1, timeout=5)
+    processor.ffmpeg_path = shutil.which('false')
+    return processor
+
+
+def test_moov_after_mdat():
+    assert not moov_after_mdat(M4A_FASTSTART)
+    assert moov_after_mdat(M4A_MOOV_AT_END)
+    assert not moov_after_mdat(b'')
+
+
+def test_moov_at_end_is_sent_without_remux():
+    processor = failing_processor()
+    result = asyncio.run(processor.process(M4A_MOOV_AT_END, 180))
+
+    assert (result.mode, result.ext, result.data) == ('passthrough', 'm4a', M4A_MOOV_AT_END)
+    assert processor.failed == 0
+
+
+def test_failed_remux_falls_back_to_original():
+    processor = failing_processor()
+    result = asyncio.run(processor.process(M4A_FASTSTART, 180))
+
+    assert (result.mode, result.ext) == ('passthrough', 'm4a')
+    assert processor.failed == 1
+
+
+def test_failed_transcode_falls_back_when_original_fits():
+    result = asyncio.run(failing_processor().process(WEBM, 180))
+
+    assert (result.mode, result.ext, result.data) == ('passthrough', 'webm', WEBM)
+
+
+def test_failed_transcode_of_oversized_file_raises():
+    with pytest.raises(MediaProcessingError):
+        asyncio.run(failing_processor().process(WEBM, None, max_bytes=50))
+
+
+def test_too_long_for_any_bitrate_is_too_large():
+    assert asyncio.run(failing_processor().process(WEBM, 10 ** 6, max_bytes=50)) is None
@@ -0,0 +1,144 @@
+"""
+Чтение и разбор HTML mp3wr.com и учёт ошибок в выключателе
+"""
+import asyncio
+import os
+import sys
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mp3wr_parser
+from mp3wr_parser import Mp3wrParser, parse_search_results
+
+SEARCH_PAGE = '''<html><head>{meta}</head><body>
+<div class="track-item">
+    <span class="track-title">Группа крови</span>
+    <span class="track-artist">Кино</span>
+    <a href="/download/1/kino.mp3">Скачать</a>
+</div>
+</body></html>'''
+
+
+async def against_server(routes: dict, call) -> tuple:
+    """
+    Вызывает call(parser) против локального сервера с routes {путь: (статус, тело)}
+
+    Returns:
+        Результат вызова и сколько ошибок он записал в выключатель MP3WR
+    """
+    def handler_for(status, body):
+        async def handler(request):
+            return web.Response(status=status, body=body, content_type='text/html')
+        return handler
+
+    app = web.Application()
+    for path, (status, body) in routes.items():
+        app.router.add_get(path, handler_for(status, body))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+
+    try:
+        async with Mp3wrParser() as parser:
+            parser.BASE_URL = f"http://127.0.0.1:{port}"
+            parser.breaker.record_success()
+            result = await call(parser)
+            return result, len(parser.breaker._failures)
+    finally:
+        await runner.cleanup()
+
+
+async def search_with_page(body: bytes) -> tuple:
+    """Поиск против локального сервера, который отдаёт text/html без charset"""
+    return await against_server({'/search/{query}': (200, body)}, lambda parser: parser.search('кино'))
+
+
+def test_search_without_charset_defaults_to_utf8():
+    body = SEARCH_PAGE.format(meta='').encode('utf-8')
+    results, failures = asyncio.run(search_with_page(body))
+
+    assert failures == 0
+    assert [(track['artist'], track['title']) for track in results] == [('Кино', 'Группа крови')]
+
+
+def test_search_without_charset_uses_meta_charset():
+    body = SEARCH_PAGE.format(meta='<meta charset="windows-1251">').encode('cp1251')
+    results, failures = asyncio.run(search_with_page(body))
+
+    assert failures == 0
+    assert [(track['artist'], track['title']) for track in results] == [('Кино', 'Группа крови')]
+
+
+def test_xml_declaration_is_ignored():
+    html = '<?xml version="1.0" encoding="utf-8"?>\n' + SEARCH_PAGE.format(meta='')
+    results = parse_search_results(html, 10, 'https://mp3wr.com')
+
+    assert [track['download_url'] for track in results] == ['https://mp3wr.com/download/1/kino.mp3']
+
+
+def test_parser_error_does_not_count_against_breaker(monkeypatch):
+    def broken_parser(*args):
+        raise ValueError("parser bug")
+
+    monkeypatch.setattr(mp3wr_parser, 'parse_search_results', broken_parser)
+    body = SEARCH_PAGE.format(meta='').encode('utf-8')
+    results, failures = asyncio.run(search_with_page(body))
+
+    assert results == []
+    assert failures == 0
+
+
+def test_failed_second_hop_counts_against_breaker():
+    track_page = b'<html><body><audio><source src="/files/kino.mp3"></audio></body></html>'
+    routes = {
+        '/download/1': (200, track_page),
+        '/files/kino.mp3': (404, b'not found'),
+    }
+
+    async def download(parser):
+        return await parser._fetch_track(f"{parser.BASE_URL}/download/1")
+
+    audio, failures = asyncio.run(against_server(routes, download))
+
+    assert audio is None
+    assert failures == 1
+
+
+async def stream_from_server(payload: bytes, max_bytes: int):
+    """stream_audio против ответа без Content-Length (chunked)"""
+    async def handler(request):
+        response = web.StreamResponse(headers={'Content-Type': 'audio/mpeg'})
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+        for start in range(0, len(payload), 100):
+            await response.write(payload[start:start + 100])
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_get('/track.mp3', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+
+    try:
+        async with Mp3wrParser() as parser:
+            async with parser.session.get(f"http://127.0.0.1:{port}/track.mp3") as response:
+                return await mp3wr_parser.stream_audio(response, max_bytes=max_bytes)
+    finally:
+        await runner.cleanup()
+
+
+def test_stream_audio_within_limit():
+    payload = bytes(range(256)) * 4
+    assert asyncio.run(stream_from_server(payload, max_bytes=len(payload))) == payload
+
+
+def test_stream_audio_stops_past_limit():
+    assert asyncio.run(stream_from_server(b'x' * 1000, max_bytes=999)) is None
@@ -0,0 +1,33 @@
+"""
+Канонический вид поисковых запросов для ключей кэша
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from query_normalizer import canonicalize_query, clean_query
+
+
+def test_clean_query_collapses_spaces():
+    assert clean_query('  Ария \t Беспечный\n ангел ') == 'Ария Беспечный ангел'
+    assert clean_query(None) == ''
+
+
+def test_case_spaces_and_punctuation():
+    assert canonicalize_query('  MORGENSHTERN,  Cadillac!! ', translit=False) == 'morgenshtern cadillac'
+    assert canonicalize_query('ac_dc - thunder', translit=False) == 'ac dc thunder'
+
+
+def test_yo_and_unicode_normalization():
+    assert canonicalize_query('Ёлка', translit=False) == canonicalize_query('елка', translit=False)
+    # Полноширинные символы и лигатуры приводятся NFKC
+    assert canonicalize_query('ＡＢＣ ﬁre', translit=False) == 'abc fire'
+    # "й" в NFD (и + кратка) собирается обратно
+    assert canonicalize_query('Мой', translit=False) == 'мой'
+
+
+def test_transliteration_matches_latin_spelling():
+    assert canonicalize_query('Моргенштерн', translit=True) == canonicalize_query('morgenshtern', translit=True)
+    assert canonicalize_query('Щука', translit=True) == 'schuka'
+    assert canonicalize_query('Щука', translit=False) == 'щука'
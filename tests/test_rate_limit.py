@@ -0,0 +1,133 @@
+"""
+Лимиты запросов: корзина токенов, вытеснение пользователей, предупреждения, сброс нагрузки
+"""
+import os
+import sys
+from datetime import datetime
+
+import pytest
+from aiogram.types import CallbackQuery, Chat, Message, User
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rate_limit
+from rate_limit import DOWNLOAD, SEARCH, LoadShedder, TokenBucket, UserRateLimiter, action_of
+
+START = 1000.0
+
+
+@pytest.fixture(autouse=True)
+def frozen_monotonic(monkeypatch):
+    # Корзины создаются с текущим временем; все замеры в тестах идут от START
+    monkeypatch.setattr(rate_limit.time, 'monotonic', lambda: START)
+
+
+def test_bucket_allows_burst_then_waits():
+    bucket = TokenBucket(rate=0.5, capacity=3)
+
+    assert [bucket.take(now=START) for _ in range(3)] == [0.0, 0.0, 0.0]
+    # Токена нет: следующий появится через 1 / rate
+    assert bucket.take(now=START) == pytest.approx(2.0)
+
+
+def test_bucket_refill_is_proportional_to_elapsed_time():
+    bucket = TokenBucket(rate=0.5, capacity=3)
+    for _ in range(3):
+        bucket.take(now=START)
+
+    # За секунду накопилось полтокена - ждать ещё секунду
+    assert bucket.take(now=START + 1) == pytest.approx(1.0)
+    assert bucket.take(now=START + 2) == 0.0
+    assert bucket.tokens == pytest.approx(0.0)
+
+
+def test_bucket_refill_is_capped_at_capacity():
+    bucket = TokenBucket(rate=0.5, capacity=3)
+    for _ in range(3):
+        bucket.take(now=START)
+
+    # После долгого простоя - снова не больше capacity запросов подряд
+    results = [bucket.take(now=START + 3600) for _ in range(4)]
+    assert results[:3] == [0.0, 0.0, 0.0]
+    assert results[3] > 0
+
+
+def test_limiter_keeps_separate_buckets_per_user():
+    limiter = UserRateLimiter(SEARCH, per_minute=6, burst=1)
+
+    assert limiter.check(1, now=START) == 0.0
+    assert limiter.check(1, now=START) == pytest.approx(10.0)
+    assert limiter.check(2, now=START) == 0.0
+
+
+def test_limiter_evicts_least_recently_seen_user(monkeypatch):
+    monkeypatch.setattr(rate_limit, 'MAX_TRACKED_USERS', 3)
+    limiter = UserRateLimiter(SEARCH, per_minute=6, burst=1)
+
+    for user_id in (1, 2, 3):
+        limiter.check(user_id, now=START)
+    # Пользователь 1 снова активен - вытесняется 2
+    limiter.check(1, now=START)
+    limiter.check(4, now=START)
+
+    assert list(limiter._buckets) == [3, 1, 4]
+
+
+def test_should_warn_once_per_wait_period():
+    limiter = UserRateLimiter(SEARCH, per_minute=6, burst=1)
+    limiter.check(1, now=START)
+    retry_after = limiter.check(1, now=START)
+
+    assert limiter.should_warn(1, retry_after, now=START)
+    assert not limiter.should_warn(1, retry_after, now=START + 5)
+    assert not limiter.should_warn(1, retry_after, now=START + retry_after - 0.1)
+    assert limiter.should_warn(1, retry_after, now=START + retry_after)
+    # О незнакомом пользователе не предупреждаем
+    assert not limiter.should_warn(99, retry_after, now=START)
+
+
+def test_load_shedder_scales_retry_after(monkeypatch):
+    shedder = LoadShedder(max_queue=10, max_lag=1.0, retry_after=10)
+    lag = {'value': 0.0}
+    depth = {'value': 0}
+    monkeypatch.setattr(rate_limit, 'queue_depth', lambda: depth['value'])
+    monkeypatch.setattr(rate_limit.loop_monitor, 'lag', lambda: lag['value'])
+
+    depth['value'] = 9
+    assert shedder.check() == 0.0
+
+    depth['value'] = 20
+    assert shedder.check() == pytest.approx(20.0)
+
+    depth['value'] = 0
+    lag['value'] = 1.5
+    assert shedder.check() == pytest.approx(15.0)
+
+    lag['value'] = 100
+    assert shedder.check() == 60.0
+
+
+USER = User(id=1, is_bot=False, first_name='Тест')
+
+
+def message(text: str) -> Message:
+    return Message(message_id=1, date=datetime.now(), chat=Chat(id=1, type='private'), from_user=USER, text=text)
+
+
+def callback(data: str) -> CallbackQuery:
+    return CallbackQuery(id='1', from_user=USER, chat_instance='1', data=data)
+
+
+def test_action_of_messages():
+    assert action_of(message('/start dl_dQw4w9WgXcQ')) == DOWNLOAD
+    assert action_of(message('/start q_0JDRgNC40Y8')) == SEARCH
+    assert action_of(message('/start')) is None
+    assert action_of(message('/status')) is None
+    assert action_of(message('Ария Беспечный ангел')) == SEARCH
+
+
+def test_action_of_callbacks():
+    assert action_of(callback('download_3')) == DOWNLOAD
+    assert action_of(callback('batch_0')) == DOWNLOAD
+    assert action_of(callback('page_1')) is None
+    assert action_of(callback('cancel')) is None
@@ -0,0 +1,148 @@
+"""
+Кэш поиска: время жизни, LRU, пустые результаты и объединение запросов
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import search_cache as search_cache_module
+from search_cache import SearchCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(search_cache_module.time, 'monotonic', clock)
+    return clock
+
+
+def test_entry_expires_after_ttl(clock):
+    cache = SearchCache(max_entries=10, ttl=60)
+    cache.put('q', [{'title': 'a'}])
+
+    clock.now += 60
+    assert cache.peek('q') == [{'title': 'a'}]
+    clock.now += 1
+    assert cache.peek('q') is None
+    assert 'q' not in cache._entries
+
+
+def test_least_recently_used_evicted(clock):
+    cache = SearchCache(max_entries=2, ttl=60)
+    cache.put('a', [{'title': 'a'}])
+    cache.put('b', [{'title': 'b'}])
+    cache.peek('a')
+    cache.put('c', [{'title': 'c'}])
+
+    assert list(cache._entries) == ['a', 'c']
+
+
+def test_results_are_copied():
+    cache = SearchCache(max_entries=10, ttl=60)
+    tracks = [{'title': 'a'}]
+    cache.put('q', tracks)
+    tracks[0]['title'] = 'changed'
+    cache.peek('q')[0]['title'] = 'changed'
+
+    assert cache.peek('q') == [{'title': 'a'}]
+
+
+def test_empty_result_not_cached():
+    cache = SearchCache(max_entries=10, ttl=60)
+    calls = []
+
+    async def search():
+        calls.append(1)
+        return []
+
+    async def scenario():
+        assert await cache.get_or_search('q', search) == []
+        assert await cache.get_or_search('q', search) == []
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+    assert cache.stats()['entries'] == 0
+
+
+def test_concurrent_requests_share_one_search():
+    cache = SearchCache(max_entries=10, ttl=60)
+    calls = []
+
+    async def search():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return [{'title': 'a'}]
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_search('q', search) for _ in range(5)))
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert results == [[{'title': 'a'}]] * 5
+    # Каждый получает свою копию
+    assert len({id(result) for result in results}) == 5
+    assert cache.misses == 1
+    assert cache.coalesced == 4
+
+    assert asyncio.run(cache.get_or_search('q', search)) == [{'title': 'a'}]
+    assert cache.hits == 1
+
+
+def test_waiters_get_leader_error_and_next_request_retries():
+    cache = SearchCache(max_entries=10, ttl=60)
+    calls = []
+
+    async def failing_search():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError('source down')
+
+    async def scenario():
+        return await asyncio.gather(
+            *(cache.get_or_search('q', failing_search) for _ in range(3)),
+            return_exceptions=True
+        )
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert cache._in_flight == {}
+
+    async def search():
+        return [{'title': 'a'}]
+
+    # Ошибка не кэшируется - следующий запрос ищет заново
+    assert asyncio.run(cache.get_or_search('q', search)) == [{'title': 'a'}]
+
+
+def test_waiter_searches_itself_when_leader_cancelled():
+    cache = SearchCache(max_entries=10, ttl=60)
+
+    async def slow_search():
+        await asyncio.sleep(10)
+        return [{'title': 'slow'}]
+
+    async def fast_search():
+        return [{'title': 'fast'}]
+
+    async def scenario():
+        leader = asyncio.create_task(cache.get_or_search('q', slow_search))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_or_search('q', fast_search))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await waiter
+
+    assert asyncio.run(scenario()) == [{'title': 'fast'}]
@@ -0,0 +1,105 @@
+"""
+Канонический ID трека, схлопывание дубликатов и поиск file_id копии
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from file_id_cache import FileIdCache
+from track_dedup import canonical_id, dedupe_tracks, same_duration, split_artist_title
+
+
+def test_split_artist_title_from_youtube_title():
+    track = {'title': 'Ария - Беспечный Ангел (Official Video)', 'artist': 'AriaVEVO'}
+    assert split_artist_title(track) == ('ария', 'беспечный ангел')
+
+
+def test_split_artist_title_strips_channel_suffix_and_feat():
+    track = {'title': 'Song Name (feat. Someone) [Lyrics]', 'artist': 'Band - Topic'}
+    assert split_artist_title(track) == ('band', 'song name')
+
+
+def test_canonical_id_same_across_sources():
+    youtube = {'title': 'Кино - Группа крови (Official Audio)', 'artist': 'KinoVEVO'}
+    mp3wr = {'title': 'Группа Крови', 'artist': 'Кино'}
+    assert canonical_id(youtube) == canonical_id(mp3wr)
+    assert canonical_id(mp3wr) != canonical_id({'title': 'Звезда по имени Солнце', 'artist': 'Кино'})
+
+
+def test_same_duration_tolerance_and_unknown():
+    assert same_duration(181, 184)
+    assert not same_duration(181, 186)
+    assert same_duration(None, 181)
+    assert not same_duration(None, 181, strict=True)
+    assert not same_duration(181, None, strict=True)
+    assert same_duration(181, 183, strict=True)
+
+
+def test_dedupe_prefers_source_and_keeps_position():
+    tracks = [
+        {'title': 'Кино - Группа крови', 'duration': '4:45', 'source': 'mp3wr', 'url': 'm1'},
+        {'title': 'Другая песня', 'artist': 'Кто-то', 'duration': '3:00', 'source': 'youtube', 'url': 'y0'},
+        {'title': 'Группа крови (Official Video)', 'artist': 'Кино', 'duration_seconds': 287,
+         'source': 'youtube', 'url': 'y1'},
+    ]
+    result = dedupe_tracks(tracks)
+
+    assert [track['url'] for track in result] == ['y1', 'y0']
+    assert all('canonical_id' in track for track in result)
+    # Исходные словари не меняются
+    assert 'canonical_id' not in tracks[2]
+
+
+def test_dedupe_keeps_versions_of_different_length_and_numbers():
+    tracks = [
+        {'title': 'Band - Song', 'duration': '3:00', 'source': 'youtube', 'url': 'a'},
+        {'title': 'Band - Song', 'duration': '7:30', 'source': 'mp3wr', 'url': 'b'},
+        {'title': 'Band - Symphony No. 5', 'duration': '5:00', 'source': 'youtube', 'url': 'c'},
+        {'title': 'Band - Symphony No. 9', 'duration': '5:00', 'source': 'youtube', 'url': 'd'},
+    ]
+    assert [track['url'] for track in dedupe_tracks(tracks)] == ['a', 'b', 'c', 'd']
+
+
+def make_track(url: str, duration, title: str = 'Кино - Группа крови') -> dict:
+    track = {'title': title, 'duration': duration, 'source': 'mp3wr', 'url': url}
+    track['canonical_id'] = canonical_id(track)
+    return track
+
+
+def test_file_id_found_for_copy_with_close_duration(tmp_path):
+    cache = FileIdCache(str(tmp_path / 'bot.db'))
+    cache.put(make_track('a', '4:45'), 'FILE_A')
+
+    assert cache.get(make_track('a', '4:45')) == 'FILE_A'
+    assert cache.get(make_track('b', '4:47')) == 'FILE_A'
+    assert cache.get(make_track('c', '5:30')) is None
+    cache.close()
+
+
+def test_unknown_duration_does_not_match_copy(tmp_path):
+    cache = FileIdCache(str(tmp_path / 'bot.db'))
+    cache.put(make_track('a', '4:45'), 'FILE_A')
+    cache.put(make_track('u', None), 'FILE_U')
+
+    # Неизвестная длительность с любой стороны - другая версия может быть другой длины
+    assert cache.get(make_track('b', None)) is None
+    assert cache.get(make_track('c', '3:00')) is None
+    assert cache.get(make_track('d', '4:44')) == 'FILE_A'
+    cache.close()
+
+
+def test_invalidate_removes_only_matching_copies(tmp_path):
+    cache = FileIdCache(str(tmp_path / 'bot.db'))
+    cache.put(make_track('a', '4:45'), 'FILE_A')
+    cache.put(make_track('b', '4:46'), 'FILE_B')
+    cache.put(make_track('long', '9:00'), 'FILE_LONG')
+    cache.put(make_track('u', None), 'FILE_U')
+
+    cache.invalidate(make_track('a', '4:45'))
+
+    assert cache.get_by_key('mp3wr:a') is None
+    assert cache.get_by_key('mp3wr:b') is None
+    assert cache.get_by_key('mp3wr:long')['file_id'] == 'FILE_LONG'
+    assert cache.get_by_key('mp3wr:u')['file_id'] == 'FILE_U'
+    cache.close()
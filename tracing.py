@@ -0,0 +1,156 @@
+"""
+Трассировка обработки одного обновления: поиск → скачивание → отправка
+"""
+import contextvars
+import functools
+import json
+import os
+import logging
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+logger = logging.getLogger(__name__)
+
+# Доля запросов, для которых пишется полная JSON-запись
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 0.1))
+# Запросы дольше этого (сек) пишутся всегда, с разбивкой по этапам
+TRACE_SLOW_SECONDS = float(os.getenv('TRACE_SLOW_SECONDS', 15))
+
+_current_trace: contextvars.ContextVar[Optional['Trace']] = contextvars.ContextVar('trace', default=None)
+
+
+class Trace:
+    """Запрос с идентификатором и списком замеров (span) его этапов"""
+
+    def __init__(self, kind: str, **attrs):
+        self.request_id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.attrs = attrs
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.spans: List[dict] = []
+        self.error: Optional[str] = None
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def to_record(self) -> dict:
+        return {
+            'request_id': self.request_id,
+            'kind': self.kind,
+            **self.attrs,
+            'started_at': self.started_at,
+            'duration_ms': round(self.elapsed * 1000, 1),
+            'error': self.error,
+            'spans': self.spans,
+        }
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def current_request_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.request_id if trace else None
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Замер этапа текущего запроса. Вне запроса ничего не делает.
+
+    Работает и в потоках исполнителя, если функция запущена через in_context().
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield attrs
+        return
+
+    started = time.perf_counter()
+    error = None
+    try:
+        yield attrs
+    except BaseException as e:
+        error = e.__class__.__name__
+        raise
+    finally:
+        record = {
+            'name': name,
+            'start_ms': round((started - trace.started) * 1000, 1),
+            'duration_ms': round((time.perf_counter() - started) * 1000, 1),
+            **attrs,
+        }
+        if error:
+            record['error'] = error
+        trace.spans.append(record)
+
+
+def mark_error(error: str):
+    """Отмечает текущий запрос как завершившийся ошибкой (если она перехвачена обработчиком)"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.error = error
+
+
+def in_context(func: Callable, *args, **kwargs) -> Callable[[], Any]:
+    """
+    Функция для run_in_executor, выполняющаяся в копии текущего контекста.
+
+    run_in_executor не переносит contextvars в поток, без этого замеры
+    внутри yt-dlp не попали бы в запрос.
+    """
+    return functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+
+
+def _update_attrs(update: Update) -> Dict[str, Any]:
+    event = update.event
+    user = getattr(event, 'from_user', None)
+    return {
+        'update_id': update.update_id,
+        'update_type': update.event_type,
+        'user_id': user.id if user else None,
+    }
+
+
+def emit(trace: Trace):
+    """Пишет запись о запросе: выборочно, а медленные и ошибочные - всегда"""
+    slow = trace.elapsed >= TRACE_SLOW_SECONDS
+    if not (slow or trace.error or random.random() < TRACE_SAMPLE_RATE):
+        return
+
+    record = json.dumps(trace.to_record(), ensure_ascii=False, default=str)
+    if slow:
+        breakdown = ', '.join(f"{s['name']}={s['duration_ms']:.0f}мс" for s in trace.spans)
+        logger.warning(f"Медленный запрос {trace.request_id}: {trace.elapsed:.1f} сек ({breakdown})")
+        logger.warning(record)
+    else:
+        logger.info(record)
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Внешний middleware: открывает трассировку на каждое обновление"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        trace = Trace('update', **_update_attrs(event)) if isinstance(event, Update) else Trace('event')
+        token = _current_trace.set(trace)
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            trace.error = e.__class__.__name__
+            raise
+        finally:
+            _current_trace.reset(token)
+            emit(trace)
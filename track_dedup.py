@@ -0,0 +1,167 @@
+"""
+Нормализация треков и схлопывание дубликатов из разных источников
+"""
+import hashlib
+import re
+import unicodedata
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Порядок предпочтения источников при выборе лучшей копии
+SOURCE_PREFERENCE = ('youtube', 'mp3wr', 'sefon')
+
+# Допустимая разница длительностей у дубликатов (сек)
+DURATION_TOLERANCE = 4
+
+# Порог похожести названий для нечёткого сравнения
+FUZZY_THRESHOLD = 0.9
+
+# Скобки с "шумом": (Official Video), [Lyrics], (Audio), (HD) и т.п.
+NOISE_RE = re.compile(
+    r'[\(\[\{][^\)\]\}]*\b('
+    r'official|video|audio|lyrics?|lyric video|visualizer|clip|hd|hq|4k|remaster(ed)?|'
+    r'клип|премьера|текст|караоке'
+    r')\b[^\)\]\}]*[\)\]\}]',
+    re.I
+)
+# Хвосты без скобок: "... - Official Video", "... | Lyrics"
+TAIL_NOISE_RE = re.compile(r'\s*[-|–—]\s*(official\s+(music\s+)?video|official\s+audio|lyrics?)\s*$', re.I)
+FEAT_RE = re.compile(r'\s*[\(\[]?\b(feat\.?|ft\.?|featuring)\s+[^\)\]]*[\)\]]?', re.I)
+TOPIC_RE = re.compile(r'\s*-\s*topic$|vevo$|\s+official$', re.I)
+NON_WORD_RE = re.compile(r'[^\w\s]+')
+DIGITS_RE = re.compile(r'\d+')
+SPACES_RE = re.compile(r'\s+')
+
+
+def parse_duration(value) -> Optional[int]:
+    """Длительность в секундах из числа или строки вида 'm:ss' / 'h:mm:ss'"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value) or None
+
+    parts = str(value).strip().split(':')
+    if not all(part.isdigit() for part in parts):
+        return None
+
+    seconds = 0
+    for part in parts:
+        seconds = seconds * 60 + int(part)
+    return seconds or None
+
+
+def track_duration(track: Dict) -> Optional[int]:
+    """Длительность трека в секундах: из duration_seconds или строки duration"""
+    return track.get('duration_seconds') or parse_duration(track.get('duration'))
+
+
+def _clean(text: str) -> str:
+    text = unicodedata.normalize('NFKC', text or '').casefold().replace('ё', 'е')
+    text = NON_WORD_RE.sub(' ', text)
+    return SPACES_RE.sub(' ', text).strip()
+
+
+def normalize_title(title: str) -> str:
+    """Название без пометок вроде (Official Video), [Lyrics], feat."""
+    title = NOISE_RE.sub(' ', title or '')
+    title = TAIL_NOISE_RE.sub('', title)
+    title = FEAT_RE.sub(' ', title)
+    return _clean(title)
+
+
+def normalize_artist(artist: str) -> str:
+    """Исполнитель без суффиксов каналов (' - Topic', 'VEVO')"""
+    artist = TOPIC_RE.sub('', (artist or '').strip())
+    artist = FEAT_RE.sub(' ', artist)
+    return _clean(artist)
+
+
+def split_artist_title(track: Dict) -> Tuple[str, str]:
+    """
+    Нормализованные исполнитель и название.
+
+    На YouTube исполнитель часто записан в самом названии ("Artist - Song"),
+    а в uploader стоит канал, поэтому такое название разбиваем.
+    """
+    title = track.get('title') or ''
+    artist = track.get('artist') or ''
+
+    for separator in (' - ', ' – ', ' — '):
+        if separator in title:
+            head, tail = title.split(separator, 1)
+            return normalize_artist(head), normalize_title(tail)
+
+    return normalize_artist(artist), normalize_title(title)
+
+
+def same_duration(a: Optional[int], b: Optional[int], strict: bool = False) -> bool:
+    """
+    Длительности совпадают с точностью до DURATION_TOLERANCE.
+
+    Неизвестная длительность совпадает с любой, если не задан strict:
+    в выдаче одного поиска это допустимо, а для file_id из базы так можно
+    отправить другую версию трека.
+    """
+    if not a or not b:
+        return not strict
+    return abs(a - b) <= DURATION_TOLERANCE
+
+
+def canonical_id(track: Dict) -> str:
+    """
+    Канонический идентификатор трека, общий для всех источников.
+
+    Зависит только от исполнителя и названия: округление длительности
+    разносило бы копии 181 и 183 сек по разным ключам. Длительность
+    сравнивается с допуском при сопоставлении (same_duration).
+    """
+    artist, title = split_artist_title(track)
+    raw = f"{artist}|{title}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def _same_track(a: dict, b: dict) -> bool:
+    if not same_duration(a['seconds'], b['seconds']):
+        return False
+    if a['key'] == b['key']:
+        return True
+    # "Part 1" и "Part 2", "No. 5" и "No. 9" - разные треки при любой похожести
+    if DIGITS_RE.findall(a['key']) != DIGITS_RE.findall(b['key']):
+        return False
+    return SequenceMatcher(None, a['key'], b['key']).ratio() >= FUZZY_THRESHOLD
+
+
+def dedupe_tracks(tracks: List[Dict], source_preference: Sequence[str] = SOURCE_PREFERENCE) -> List[Dict]:
+    """
+    Схлопывает дубликаты одного трека.
+
+    Из каждой группы остаётся копия из наиболее предпочтительного источника
+    (при равенстве - более ранняя в выдаче), группа занимает место своего
+    первого элемента. Возвращаются копии треков с 'canonical_id',
+    исходные словари не меняются.
+    """
+    rank = {source: idx for idx, source in enumerate(source_preference)}
+    groups = []
+
+    for position, track in enumerate(tracks):
+        artist, title = split_artist_title(track)
+        seconds = track_duration(track)
+        item = {
+            'track': track,
+            'key': f"{artist} {title}".strip(),
+            'seconds': seconds,
+            'rank': (rank.get(track.get('source', 'youtube'), len(rank)), position),
+        }
+
+        for group in groups:
+            if _same_track(group[0], item):
+                group.append(item)
+                break
+        else:
+            groups.append([item])
+
+    result = []
+    for group in groups:
+        best = min(group, key=lambda item: item['rank'])['track']
+        result.append({**best, 'canonical_id': canonical_id(best)})
+    return result
@@ -6,11 +6,38 @@ import os
 import logging
 from typing import List, Dict, Optional
 from io import BytesIO
-import yt_dlp
+from urllib.parse import parse_qs, urlparse
+
+from audio_cache import audio_cache
+from circuit_breaker import get_breaker
+from download_scheduler import download_scheduler
+from metrics import DOWNLOADED_BYTES, IN_FLIGHT, STAGE_SECONDS
+from query_normalizer import canonicalize_query, clean_query
+from search_cache import search_cache
+from search_filter import RANKS, UNSENDABLE, UNSENDABLE_NOTE, search_filter
+from tracing import in_context, span
 # from dotenv import load_dotenv
 # load_dotenv()
 logger = logging.getLogger(__name__)
 
+YOUTUBE_HOSTS = ('youtube.com', 'www.youtube.com', 'm.youtube.com', 'music.youtube.com')
+
+# Плейлисты альбомов YouTube Music; у бесконечных миксов (RD...) свой префикс
+ALBUM_PLAYLIST_PREFIX = 'OLAK5uy_'
+
+# Ответы YouTube о самой ссылке (удалена, приватная, опечатка), а не о его доступности
+CONTENT_ERROR_MARKERS = ('unavailable', 'private', 'does not exist', 'not found')
+
+
+def is_content_error(error: Exception) -> bool:
+    """Ошибка yt-dlp из-за запрошенного контента: выключатель YouTube она не должна размыкать"""
+    from yt_dlp.utils import DownloadError
+    
+    if not isinstance(error, DownloadError):
+        return False
+    message = str(error).lower()
+    return any(marker in message for marker in CONTENT_ERROR_MARKERS)
+
 
 class YouTubeDownloader:
     """Класс для работы с YouTube через yt-dlp"""
@@ -76,19 +103,118 @@ class YouTubeDownloader:
             'extract_flat': False,
         }
         
+        # Общий для процесса выключатель источника
+        self.breaker = get_breaker('youtube')
+        
         logger.info("YouTube downloader инициализирован с обходом защиты ботов")
     
-    async def search(self, query: str, limit: int = 10) -> List[Dict[str, str]]:
+    async def search(self, query: str, limit: int = 10, use_cache: bool = True) -> List[Dict[str, str]]:
         """
         Поиск музыки на YouTube
         
+        Эквивалентные запросы ("Моргенштерн", "morgenshtern ") используют
+        один результат из кэша поиска.
+        
         Args:
             query: поисковый запрос
             limit: максимальное количество результатов
+            use_cache: False - всегда обращаться к YouTube (проверки доступности)
             
         Returns:
             Список словарей с информацией о треках
         """
+        if not use_cache:
+            return await self._search(clean_query(query), limit)
+        return await search_cache.get_or_search(
+            self.search_cache_key(query, limit),
+            lambda: self._search(clean_query(query), limit)
+        )
+    
+    @staticmethod
+    def search_cache_key(query: str, limit: int) -> str:
+        """Ключ кэша поиска: одинаковый для эквивалентных запросов"""
+        return f"youtube:{limit}:{canonicalize_query(query)}"
+    
+    def peek_search(self, query: str, limit: int = 10) -> Optional[List[Dict[str, str]]]:
+        """Результат поиска только из кэша, без обращения к YouTube"""
+        return search_cache.peek(self.search_cache_key(query, limit))
+    
+    @staticmethod
+    def playlist_id(text: str) -> Optional[str]:
+        """
+        ID плейлиста из ссылки YouTube или None
+        
+        Ссылка на видео с list= считается плейлистом только для альбомов:
+        пользователь, отправивший песню из микса, ждёт одну песню.
+        """
+        url = urlparse(text.strip())
+        if url.scheme not in ('http', 'https') or url.hostname not in YOUTUBE_HOSTS:
+            return None
+        
+        list_id = parse_qs(url.query).get('list', [None])[0]
+        if not list_id:
+            return None
+        if url.path == '/playlist' or list_id.startswith(ALBUM_PLAYLIST_PREFIX):
+            return list_id
+        return None
+    
+    async def playlist(self, list_id: str, limit: int = 50) -> List[Dict[str, str]]:
+        """
+        Треки плейлиста в исходном порядке, без скачивания
+        
+        Фильтр поиска применяется и здесь: трансляции и треки, которые не
+        поместятся в лимит Telegram, пропускаются.
+        """
+        return await search_cache.get_or_search(
+            f"youtube:playlist:{limit}:{list_id}",
+            lambda: self._playlist(list_id, limit)
+        )
+    
+    async def _playlist(self, list_id: str, limit: int) -> List[Dict[str, str]]:
+        if not self.breaker.allow_request():
+            logger.warning("YouTube временно отключён после серии ошибок, пропускаем плейлист")
+            return []
+        
+        try:
+            loop = asyncio.get_event_loop()
+            with STAGE_SECONDS.time(stage='search'), IN_FLIGHT.track_inprogress(kind='ytdlp'), span('ytdlp.playlist'):
+                result = await loop.run_in_executor(
+                    None,
+                    in_context(self._playlist_sync, f"https://www.youtube.com/playlist?list={list_id}", limit)
+                )
+            self.breaker.record_success()
+        except Exception as e:
+            if is_content_error(e):
+                # Источник ответил, проблема в самом плейлисте
+                logger.warning(f"Плейлист {list_id} недоступен: {e}")
+                self.breaker.record_success()
+                return []
+            logger.error(f"Ошибка загрузки плейлиста {list_id}: {e}", exc_info=True)
+            self.breaker.record_failure()
+            return []
+        
+        entries = (result or {}).get('entries') or []
+        tracks = self._entries_to_tracks(entries, ranked=False)
+        logger.info(
+            f"Плейлист {list_id} ('{(result or {}).get('title')}'): "
+            f"{len(tracks)} треков, пропущено {len(entries) - len(tracks)}"
+        )
+        return tracks
+    
+    def _playlist_sync(self, url: str, limit: int) -> dict:
+        """Синхронное чтение списка видео плейлиста через yt-dlp"""
+        import yt_dlp
+        
+        opts = {**self.ydl_opts_search, 'extract_flat': 'in_playlist', 'playlistend': limit}
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            return ydl.extract_info(url, download=False)
+    
+    async def _search(self, query: str, limit: int) -> List[Dict[str, str]]:
+        """Поиск на YouTube без кэша"""
+        if not self.breaker.allow_request():
+            logger.warning("YouTube временно отключён после серии ошибок, пропускаем поиск")
+            return []
+        
         try:
             # Добавляем "audio" к запросу для лучших результатов
             search_query = f"ytsearch{limit}:{query} audio"
@@ -96,11 +222,12 @@ class YouTubeDownloader:
             
             # Выполняем поиск в отдельном потоке
             loop = asyncio.get_event_loop()
-            results = await loop.run_in_executor(
-                None,
-                self._search_sync,
-                search_query
-            )
+            with STAGE_SECONDS.time(stage='search'), IN_FLIGHT.track_inprogress(kind='ytdlp'), span('ytdlp.search'):
+                results = await loop.run_in_executor(
+                    None,
+                    in_context(self._search_sync, search_query)
+                )
+            self.breaker.record_success()
             
             if not results or 'entries' not in results:
                 logger.warning(f"YouTube не вернул результаты для запроса: {query}")
@@ -108,70 +235,131 @@ class YouTubeDownloader:
             
             logger.debug(f"YouTube вернул {len(results.get('entries', []))} результатов")
             
-            tracks = []
-            for entry in results.get('entries', []):
-                if not entry:
-                    continue
-                
-                # Извлекаем информацию о треке
-                title = entry.get('title', 'Неизвестно')
-                uploader = entry.get('uploader', 'Неизвестный исполнитель')
-                duration = entry.get('duration', 0)
-                url = entry.get('url') or f"https://youtube.com/watch?v={entry.get('id')}"
-                
-                # Форматируем длительность
-                duration_str = self._format_duration(duration)
-                
-                tracks.append({
-                    'title': title,
-                    'artist': uploader,
-                    'duration': duration_str,
-                    'url': url,
-                    'full_name': f"{uploader} - {title}"
-                })
+            tracks = self._entries_to_tracks(results.get('entries', []))
             
             logger.info(f"Поиск вернул {len(tracks)} треков для запроса: {query}")
             return tracks
             
         except Exception as e:
             logger.error(f"Ошибка поиска: {e}", exc_info=True)
+            self.breaker.record_failure()
             return []
     
+    def _entries_to_tracks(self, entries: list, ranked: bool = True) -> List[Dict[str, str]]:
+        """
+        Преобразует записи ytsearch (extract_flat) в треки
+        
+        Трансляции, плейлисты и треки, которые не поместятся в лимит Telegram,
+        отбрасываются; треки, требующие перекодирования, идут после остальных
+        (ranked=False сохраняет исходный порядок - для плейлистов).
+        """
+        # Треки по рангам: внутри ранга сохраняется порядок релевантности YouTube
+        by_rank = [[] for _ in range(RANKS)]
+        for entry in entries:
+            if not entry:
+                continue
+            
+            verdict = search_filter.check(entry)
+            if verdict.reason:
+                logger.debug(f"Результат '{entry.get('title')}' скрыт: {verdict.reason}")
+                continue
+            
+            # Извлекаем информацию о треке
+            title = entry.get('title', 'Неизвестно')
+            # В плейлистах вместо uploader бывает только channel
+            uploader = entry.get('uploader') or entry.get('channel') or 'Неизвестный исполнитель'
+            duration = entry.get('duration', 0)
+            url = entry.get('url') or f"https://youtube.com/watch?v={entry.get('id')}"
+            
+            # Форматируем длительность
+            duration_str = self._format_duration(duration)
+            
+            track = {
+                'title': title,
+                'artist': uploader,
+                'duration': duration_str,
+                'duration_seconds': int(duration) if duration else 0,
+                'url': url,
+                'video_id': entry.get('id') or self.extract_video_id(url),
+                'full_name': f"{uploader} - {title}"
+            }
+            if verdict.rank == UNSENDABLE:
+                track['note'] = UNSENDABLE_NOTE
+                track['unsendable'] = True
+            by_rank[verdict.rank if ranked else 0].append(track)
+        
+        return [track for tracks in by_rank for track in tracks]
+    
+    @staticmethod
+    def warm_up():
+        """
+        Импортирует yt-dlp и загружает его экстракторы.
+        
+        yt-dlp импортируется при первом использовании, а не при запуске
+        бота; вызов в фоне после старта избавляет первый поиск от этой задержки.
+        """
+        import yt_dlp
+        
+        with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}) as ydl:
+            ydl.get_info_extractor('Youtube')
+            ydl.get_info_extractor('YoutubeSearch')
+    
     def _search_sync(self, search_query: str) -> dict:
         """Синхронный поиск через yt-dlp"""
+        import yt_dlp
+        
         with yt_dlp.YoutubeDL(self.ydl_opts_search) as ydl:
             return ydl.extract_info(search_query, download=False)
     
-    async def download_track(self, url: str) -> Optional[bytes]:
+    async def download_track(self, url: str, duration_seconds: Optional[int] = None) -> Optional[bytes]:
         """
         Скачивание трека с YouTube
         
         Args:
             url: URL видео на YouTube
+            duration_seconds: длительность трека - короткие треки скачиваются без очереди за длинными
             
         Returns:
             Байты аудио файла или None в случае ошибки
         """
         try:
+            # Сначала проверяем локальный кэш
+            cache_key = audio_cache.make_key('youtube', self.extract_video_id(url), self.ydl_opts_download['format'])
+            with span('audio_cache.get') as cache_span:
+                cached = await audio_cache.aget(cache_key)
+                cache_span['hit'] = cached is not None
+            if cached:
+                logger.info(f"Трек взят из кэша: {url} ({len(cached)} байт)")
+                return cached
+            
+            if not self.breaker.allow_request():
+                logger.warning("YouTube временно отключён после серии ошибок, пропускаем скачивание")
+                return None
+            
             logger.info(f"Начало скачивания: {url}")
             
-            # Скачиваем во временный файл
+            # Скачиваем во временный файл, дождавшись своей очереди
             loop = asyncio.get_event_loop()
-            filename = await loop.run_in_executor(
-                None,
-                self._download_sync,
-                url
-            )
+            async with download_scheduler.slot(duration_seconds):
+                with IN_FLIGHT.track_inprogress(kind='ytdlp'):
+                    filename = await loop.run_in_executor(
+                        None,
+                        in_context(self._download_sync, url)
+                    )
             
             if not filename or not os.path.exists(filename):
                 logger.error(f"Файл не был создан или не найден: {filename}")
                 return None
             
             # Читаем файл
-            with open(filename, 'rb') as f:
-                audio_data = f.read()
+            with span('file.read'):
+                with open(filename, 'rb') as f:
+                    audio_data = f.read()
             
             logger.info(f"Файл прочитан: {len(audio_data)} байт")
+            DOWNLOADED_BYTES.inc(len(audio_data))
+            
+            await audio_cache.aput(cache_key, audio_data)
             
             # Удаляем временный файл
             try:
@@ -188,12 +376,14 @@ class YouTubeDownloader:
     
     def _download_sync(self, url: str) -> Optional[str]:
         """Синхронное скачивание через yt-dlp с несколькими методами"""
+        import yt_dlp
+        
         max_retries = 3
         
         # Пробуем разные форматы URL
         urls_to_try = [url]
         if 'youtube.com' in url or 'youtu.be' in url:
-            video_id = url.split('v=')[-1].split('&')[0] if 'v=' in url else url.split('/')[-1]
+            video_id = self.extract_video_id(url)
             urls_to_try.extend([
                 f"https://www.youtube.com/watch?v={video_id}",
                 f"https://youtu.be/{video_id}",
@@ -219,9 +409,10 @@ class YouTubeDownloader:
                 current_url = urls_to_try[attempt % len(urls_to_try)]
                 
                 logger.info(f"Попытка скачивания {attempt + 1}/{max_retries}: {current_url}")
-                logger.info(f"Используется клиент: {config['extractor_args']['youtube']['player_client']}")
+                client = ','.join(config['extractor_args']['youtube']['player_client'])
+                logger.info(f"Используется клиент: {client}")
                 
-                with yt_dlp.YoutubeDL(config) as ydl:
+                with span('ytdlp.attempt', attempt=attempt + 1, client=client), yt_dlp.YoutubeDL(config) as ydl:
                     info = ydl.extract_info(current_url, download=True)
                     
                     if not info:
@@ -236,6 +427,7 @@ class YouTubeDownloader:
                         filename = f"{video_id}.{ext}"
                         if os.path.exists(filename):
                             logger.info(f"✅ Файл успешно скачан: {filename}")
+                            self.breaker.record_success()
                             return filename
                     
                     logger.warning(f"Файл не найден после попытки {attempt + 1}")
@@ -255,9 +447,12 @@ class YouTubeDownloader:
                     time.sleep(delay)
                 elif "Video unavailable" in error_msg:
                     logger.error("Видео недоступно")
+                    # Источник ответил, проблема в самом видео
+                    self.breaker.record_success()
                     return None
                 elif "Private video" in error_msg:
                     logger.error("Приватное видео")
+                    self.breaker.record_success()
                     return None
                 elif "age-restricted" in error_msg.lower():
                     logger.warning("Видео с возрастными ограничениями, пробуем обойти...")
@@ -266,6 +461,7 @@ class YouTubeDownloader:
                 
                 if attempt == max_retries - 1:
                     logger.error("Все попытки исчерпаны")
+                    self.breaker.record_failure()
                     return None
                 
                 # Пауза перед повторной попыткой
@@ -274,8 +470,16 @@ class YouTubeDownloader:
                 logger.info(f"Ожидание {wait_time} секунд перед повторной попыткой...")
                 time.sleep(wait_time)
         
+        self.breaker.record_failure()
         return None
     
+    @staticmethod
+    def extract_video_id(url: str) -> str:
+        """Извлекает ID видео из ссылки YouTube"""
+        if 'v=' in url:
+            return url.split('v=')[-1].split('&')[0]
+        return url.rstrip('/').split('/')[-1].split('?')[0]
+    
     def _format_duration(self, seconds) -> str:
         """Форматирование длительности в минуты:секунды"""
         if not seconds: